@@ -0,0 +1,93 @@
+import argparse, os, random, shutil, subprocess, tempfile, time
+
+import lib.constants as constants
+import lib.downloader as downloader
+from lib.utils import DiscreteHistogram
+
+def generate_video(path, duration, gop_size, frame_rate):
+  """
+  Generate a synthetic H.264 + AAC test video.
+  :param path:          Where to save the video.
+  :param duration:      Duration of the video in seconds.
+  :param gop_size:      Number of frames between keyframes.
+  :param frame_rate:    Frame rate of the video.
+  :return:              None.
+  """
+
+  video_source = "testsrc=duration={:d}:size=1280x720:rate={:d}".format(duration, frame_rate)
+
+  subprocess.check_call(["ffmpeg", "-loglevel", "quiet", "-y", "-f", "lavfi", "-i", video_source,
+                         "-f", "lavfi", "-i", "sine=frequency=440:duration={:d}".format(duration),
+                         "-c:v", "libx264", "-g", str(gop_size), "-c:a", "aac", "-shortest", path])
+
+def benchmark(video_path, work_dir, segments, mode):
+  """
+  Cut all segments from a video and measure the speed.
+  :param video_path:    Path to the source video.
+  :param work_dir:      Where to save the slices.
+  :param segments:      List of (start, end) tuples.
+  :param mode:          Cut mode.
+  :return:              Tuple: cuts per second, number of failed cuts and a histogram of cut paths.
+  """
+
+  paths_hist = DiscreteHistogram()
+  failed = 0
+
+  start_time = time.time()
+
+  for i, (start, end) in enumerate(segments):
+    slice_path = os.path.join(work_dir, "{}_{:d}.mp4".format(mode, i))
+    success, cut_path = downloader.cut_video(video_path, slice_path, start, end, mode=mode)
+    paths_hist.add(cut_path)
+
+    if not success:
+      failed += 1
+
+  elapsed = time.time() - start_time
+
+  return len(segments) / elapsed, failed, paths_hist
+
+def main(args):
+
+  work_dir = tempfile.mkdtemp()
+
+  try:
+    video_path = os.path.join(work_dir, "source.mp4")
+    generate_video(video_path, args.video_duration, args.gop_size, args.frame_rate)
+
+    # half of the segments start on keyframes, the other half at random times
+    random.seed(args.seed)
+    keyframe_interval = args.gop_size / args.frame_rate
+    num_keyframes = int((args.video_duration - args.clip_duration) / keyframe_interval)
+    segments = []
+
+    for i in range(args.num_cuts):
+      if i % 2 == 0:
+        start = keyframe_interval * random.randint(0, num_keyframes)
+      else:
+        start = round(random.uniform(0, args.video_duration - args.clip_duration), 3)
+
+      segments.append((start, start + args.clip_duration))
+
+    for mode in [constants.CUT_MODE_REENCODE, constants.CUT_MODE_FAST]:
+      cuts_per_second, failed, paths_hist = benchmark(video_path, work_dir, segments, mode)
+
+      print("{}: {:.2f} cuts per second, {:d} failed".format(mode, cuts_per_second, failed))
+      paths_hist.print()
+      print()
+  finally:
+    shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Compare the speed of video cut modes on a synthetic video.")
+
+  parser.add_argument("--num-cuts", type=int, default=20, help="number of clips to cut in each mode")
+  parser.add_argument("--video-duration", type=int, default=300, help="duration of the source video in seconds")
+  parser.add_argument("--clip-duration", type=float, default=10, help="duration of each clip in seconds")
+  parser.add_argument("--gop-size", type=int, default=48, help="number of frames between keyframes")
+  parser.add_argument("--frame-rate", type=int, default=24, help="frame rate of the source video")
+  parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+  parsed = parser.parse_args()
+  main(parsed)
@@ -0,0 +1,153 @@
+import argparse, os, shutil, tempfile, time
+
+import lib.async_download as async_download
+import lib.constants as constants
+import lib.downloader as downloader
+import lib.mock_service as mock_service
+import lib.parallel_download as parallel
+import lib.rate_limit as rate_limit
+import lib.work_plan as work_plan
+
+MOCK_CLASS = "mock"
+
+def get_video_ids(num_videos):
+  """
+  Generate fake YouTube ids.
+  :param num_videos:    Number of ids.
+  :return:              List of ids.
+  """
+
+  return ["mock{:07d}".format(i) for i in range(num_videos)]
+
+def benchmark_sequential(service, work_dir, video_ids, clip_duration, cut_mode):
+  """
+  Process videos one by one with downloader.process_video.
+  :param service:         Running mock video service.
+  :param work_dir:        Where to save the videos.
+  :param video_ids:       List of video ids.
+  :param clip_duration:   Duration of each clip in seconds.
+  :param cut_mode:        Cut mode.
+  :return:                Tuple: videos per second and number of failed videos.
+  """
+
+  directory = os.path.join(work_dir, "sequential")
+  os.makedirs(directory)
+
+  fetcher = downloader.get_fetcher(constants.FETCHER_HTTP, url=service.base_url)
+  failed = 0
+
+  start_time = time.time()
+
+  for video_id in video_ids:
+    if not downloader.process_video(video_id, directory, 0, clip_duration, cut_mode=cut_mode, fetcher=fetcher):
+      failed += 1
+
+  elapsed = time.time() - start_time
+  fetcher.close()
+
+  return len(video_ids) / elapsed, failed
+
+def benchmark_pool(service, work_dir, video_ids, clip_duration, cut_mode, num_workers, retries,
+                   orchestrator=constants.ORCHESTRATOR_PROCESSES, num_cut_workers=None):
+  """
+  Process videos with parallel_download.Pool or async_download.AsyncPool.
+  :param service:         Running mock video service.
+  :param work_dir:        Where to save the videos.
+  :param video_ids:       List of video ids.
+  :param clip_duration:   Duration of each clip in seconds.
+  :param cut_mode:        Cut mode.
+  :param num_workers:     Number of download workers.
+  :param retries:         How many times to retry transient failures.
+  :param orchestrator:    constants.ORCHESTRATOR_PROCESSES or constants.ORCHESTRATOR_ASYNCIO.
+  :param num_cut_workers: Number of cut workers, defaults to num_workers.
+  :return:                Tuple: videos per second and number of failed videos.
+  """
+
+  directory = os.path.join(work_dir, orchestrator)
+  os.makedirs(directory)
+  failed_save_file = os.path.join(work_dir, "failed_{}.txt".format(orchestrator))
+
+  label_index = {MOCK_CLASS: [(video_id, 0, clip_duration) for video_id in video_ids]}
+  groups = [work_plan.WorkGroup(constants.TRAIN, None, [MOCK_CLASS], directory, label_index=label_index)]
+
+  start_time = time.time()
+
+  pool_kwargs = {"cut_mode": cut_mode, "retries": retries, "fetcher": constants.FETCHER_HTTP,
+                 "fetcher_url": service.base_url, "num_cut_workers": num_cut_workers}
+
+  if orchestrator == constants.ORCHESTRATOR_ASYNCIO:
+    async_download.AsyncPool(groups, num_workers, failed_save_file, False, False, False, **pool_kwargs).run()
+  else:
+    pool = parallel.Pool(groups, num_workers, failed_save_file, False, False, False, **pool_kwargs)
+    pool.start_workers()
+    pool.feed_videos()
+    pool.stop_workers()
+
+  elapsed = time.time() - start_time
+
+  return len(video_ids) / elapsed, len(parallel.read_ids(failed_save_file))
+
+def main(args):
+
+  work_dir = tempfile.mkdtemp()
+
+  try:
+    video_path = os.path.join(work_dir, "source.mp4")
+    mock_service.generate_video(video_path, duration=args.video_duration)
+
+    bandwidth = rate_limit.parse_size(args.bandwidth) if args.bandwidth is not None else None
+
+    service = mock_service.MockVideoService(video_path, latency=args.latency, bandwidth=bandwidth,
+                                            failure_rate=args.failure_rate, unavailable_rate=args.unavailable_rate,
+                                            seed=args.seed)
+    service.start()
+
+    try:
+      video_ids = get_video_ids(args.num_videos)
+
+      videos_per_second, failed = benchmark_sequential(service, work_dir, video_ids, args.clip_duration,
+                                                       args.cut_mode)
+      print("process_video: {:.2f} videos per second, {:d} failed".format(videos_per_second, failed))
+
+      videos_per_second, failed = benchmark_pool(service, work_dir, video_ids, args.clip_duration, args.cut_mode,
+                                                 args.num_workers, args.retries)
+      print("pool with {:d} workers: {:.2f} videos per second, {:d} failed".format(args.num_workers,
+                                                                                  videos_per_second, failed))
+
+      if args.num_async_downloads > 0:
+        videos_per_second, failed = benchmark_pool(service, work_dir, video_ids, args.clip_duration, args.cut_mode,
+                                                   args.num_async_downloads, args.retries,
+                                                   orchestrator=constants.ORCHESTRATOR_ASYNCIO,
+                                                   num_cut_workers=args.num_workers)
+        print("asyncio with {:d} downloads in flight: {:.2f} videos per second, {:d} failed".format(
+          args.num_async_downloads, videos_per_second, failed))
+    finally:
+      service.stop()
+
+    print("{:d} requests, {:d} bytes sent".format(service.num_requests, service.num_bytes))
+  finally:
+    shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Measure the download pipeline throughput against a local mock video service.")
+
+  parser.add_argument("--num-videos", type=int, default=20, help="number of videos to process")
+  parser.add_argument("--num-workers", type=int, default=4, help="number of download workers of the pool")
+  parser.add_argument("--num-async-downloads", type=int, default=0,
+                      help="also measure the asyncio orchestrator with this many downloads in flight (and "
+                           "--num-workers cut processes)")
+  parser.add_argument("--video-duration", type=int, default=20, help="duration of the served video in seconds")
+  parser.add_argument("--clip-duration", type=int, default=10, help="duration of each clip in seconds")
+  parser.add_argument("--cut-mode", default=constants.CUT_MODE_REENCODE,
+                      choices=[constants.CUT_MODE_REENCODE, constants.CUT_MODE_FAST], help="cut mode")
+  parser.add_argument("--latency", type=float, default=0.1, help="delay before each response in seconds")
+  parser.add_argument("--bandwidth", default="10M", help="bandwidth of each response in bytes per second")
+  parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests that fail with HTTP 503")
+  parser.add_argument("--unavailable-rate", type=float, default=0.0,
+                      help="fraction of video ids that always fail with HTTP 404")
+  parser.add_argument("--retries", type=int, default=2, help="how many times to retry transient failures")
+  parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+  parsed = parser.parse_args()
+  main(parsed)
@@ -0,0 +1,141 @@
+import argparse, os, shutil, tempfile, time
+
+import lib.constants as constants
+import lib.frame_pack as frame_pack
+import lib.mock_service as mock_service
+import lib.parallel_to_frames as parallel
+import lib.video as video
+import lib.work_plan as work_plan
+
+ENGINES = [constants.FRAMES_ENGINE_OPENCV, constants.FRAMES_ENGINE_FFMPEG]
+
+def generate_clips(directory, num_videos, duration, width, height):
+  """
+  Generate test clips, the first one is encoded and the others are copies of it.
+  :param directory:   Where to save the clips.
+  :param num_videos:  Number of clips.
+  :param duration:    Duration of each clip in seconds.
+  :param width:       Width of each clip.
+  :param height:      Height of each clip.
+  :return:            List of paths to the clips.
+  """
+
+  os.makedirs(directory)
+  paths = [os.path.join(directory, "clip{:05d}.mp4".format(i)) for i in range(num_videos)]
+
+  mock_service.generate_video(paths[0], duration=duration, width=width, height=height)
+
+  for path in paths[1:]:
+    shutil.copyfile(paths[0], path)
+
+  return paths
+
+def count_frames(directory):
+  """
+  Count the frames extracted into a directory tree.
+  :param directory:   The directory.
+  :return:            Number of frames.
+  """
+
+  num_frames = 0
+
+  for dir_path, _, file_names in os.walk(directory):
+    marker = video.read_frames_marker(dir_path)
+
+    if marker is not None:
+      num_frames += marker["num_frames"]
+
+    for file_name in file_names:
+      if file_name.endswith(constants.FRAMES_PACK_SUFFIX):
+        with frame_pack.PackReader(os.path.join(dir_path, file_name)) as reader:
+          num_frames += len(reader)
+
+  return num_frames
+
+def benchmark_sequential(work_dir, clip_paths, engine, output_format):
+  """
+  Extract the frames of the clips one by one with video.extract_frames.
+  :param work_dir:      Where to save the frames.
+  :param clip_paths:    List of paths to the clips.
+  :param engine:        Frame extraction engine.
+  :param output_format: Frames output format.
+  :return:              Tuple: frames per second and number of failed clips.
+  """
+
+  directory = os.path.join(work_dir, "sequential_{}".format(engine))
+  failed = 0
+
+  start_time = time.time()
+
+  for clip_path in clip_paths:
+    target_dir = os.path.join(directory, os.path.splitext(os.path.basename(clip_path))[0])
+
+    if not video.extract_frames(clip_path, target_dir, engine=engine, output_format=output_format):
+      failed += 1
+
+  elapsed = time.time() - start_time
+
+  return count_frames(directory) / elapsed, failed
+
+def benchmark_pool(work_dir, clips_dir, engine, output_format, num_workers):
+  """
+  Extract the frames of the clips with parallel_to_frames.Pool.
+  :param work_dir:      Where to save the frames.
+  :param clips_dir:     Directory with the clips.
+  :param engine:        Frame extraction engine.
+  :param output_format: Frames output format.
+  :param num_workers:   Number of workers.
+  :return:              Tuple: frames per second and number of failed clips.
+  """
+
+  directory = os.path.join(work_dir, "pool_{}".format(engine))
+
+  groups = [work_plan.WorkGroup(constants.TEST, None, None, directory, source_directory=clips_dir)]
+
+  start_time = time.time()
+
+  pool = parallel.Pool(groups, num_workers, None, engine=engine, output_format=output_format)
+  pool.start_workers()
+  pool.feed_videos()
+  counts = pool.stop_workers()
+
+  elapsed = time.time() - start_time
+  failed = counts.get(constants.TEST, {}).get(constants.JOB_STATUS_FAILED, 0)
+
+  return count_frames(directory) / elapsed, failed
+
+def main(args):
+
+  work_dir = tempfile.mkdtemp()
+
+  try:
+    clips_dir = os.path.join(work_dir, "clips")
+    clip_paths = generate_clips(clips_dir, args.num_videos, args.video_duration, args.width, args.height)
+
+    for engine in ENGINES:
+      frames_per_second, failed = benchmark_sequential(work_dir, clip_paths, engine, args.output_format)
+      print("{} one by one: {:.2f} frames per second, {:d} failed".format(engine, frames_per_second, failed))
+
+      if args.num_workers > 0:
+        frames_per_second, failed = benchmark_pool(work_dir, clips_dir, engine, args.output_format, args.num_workers)
+        print("{} pool with {:d} workers: {:.2f} frames per second, {:d} failed".format(
+          engine, args.num_workers, frames_per_second, failed))
+  finally:
+    shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Compare the throughput of the frame extraction engines on the same clips.")
+
+  parser.add_argument("--num-videos", type=int, default=10, help="number of clips to extract")
+  parser.add_argument("--num-workers", type=int, default=4,
+                      help="number of workers of the pool, 0 to only extract the clips one by one")
+  parser.add_argument("--video-duration", type=int, default=10, help="duration of each clip in seconds")
+  parser.add_argument("--output-format", default=constants.FRAMES_FORMAT_JPGS,
+                      choices=[constants.FRAMES_FORMAT_JPGS, constants.FRAMES_FORMAT_PACKED],
+                      help="frames output format")
+  parser.add_argument("--width", type=int, default=640, help="width of each clip")
+  parser.add_argument("--height", type=int, default=360, help="height of each clip")
+
+  parsed = parser.parse_args()
+  main(parsed)
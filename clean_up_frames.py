@@ -1,17 +1,81 @@
-import subprocess
+import argparse, os
 
-failed_frames_path = "dataset/failed_frames.txt"
+import lib.config as config
+import lib.constants as constants
+import lib.frame_shards as frame_shards
+import lib.video as video
 
-with open(failed_frames_path, "r") as file:
-  failed_frames = file.readlines()
+def find_incomplete(root):
+  """
+  Find video frames whose extraction did not finish: partial outputs left by crashed extractions (see
+  video.extract_frames), partial tar shards with their indexes (see frame_shards.ShardWriter) and directories without
+  the completion marker (e.g. written by older versions). Only run it when no extraction is running.
+  :param root:    Frames root, with or without class directories.
+  :return:        List of paths to the directories and files.
+  """
 
-failed_frames = [x.strip() for x in failed_frames]
+  incomplete = []
 
-for video_id in failed_frames:
-  subprocess.call(["find", "dataset/train_frames", "-maxdepth", "2",
-                   "-name", "*{:s}*".format(video_id),
-                   "-exec", "rmdir", "{}", ";"])
+  if not os.path.isdir(root):
+    return incomplete
 
-  subprocess.call(["find", "dataset/valid_frames", "-maxdepth", "2",
-                   "-name", "*{:s}*".format(video_id),
-                   "-exec", "rmdir", "{}", ";"])
\ No newline at end of file
+  for entry in os.scandir(root):
+    if entry.name.endswith(constants.PARTIAL_SUFFIX):
+      incomplete.append(entry.path)
+
+      # the index is written right before the shard is renamed
+      index_path = frame_shards.get_index_path(entry.path[:-len(constants.PARTIAL_SUFFIX)])
+      if entry.name.endswith(frame_shards.SHARD_SUFFIX + constants.PARTIAL_SUFFIX) and os.path.isfile(index_path):
+        incomplete.append(index_path)
+
+      continue
+
+    # packed frames of the test set are complete
+    if not entry.is_dir() or video.is_extracted(entry.path):
+      continue
+
+    if is_video_dir(entry.path):
+      # frames of the test set
+      incomplete.append(entry.path)
+      continue
+
+    # a class directory
+    for sub_entry in os.scandir(entry.path):
+      if sub_entry.name.endswith(constants.PARTIAL_SUFFIX) or \
+          (sub_entry.is_dir() and not video.is_extracted(sub_entry.path)):
+        incomplete.append(sub_entry.path)
+
+  return incomplete
+
+def is_video_dir(path):
+  """
+  Tell directories with the frames of a video from class directories.
+  :param path:    Path to the directory.
+  :return:        True if the directory is empty or holds JPEG frames.
+  """
+
+  names = os.listdir(path)
+
+  return len(names) == 0 or any(name.startswith("frame") and name.endswith(".jpg") for name in names)
+
+def main(args):
+
+  for root in args.roots:
+    for path in find_incomplete(root):
+      print("removing {}".format(path))
+
+      if not args.dry_run:
+        video.remove_path(path)
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Remove video frames whose extraction did not finish (no {} inside).".format(
+    constants.FRAMES_MARKER))
+
+  parser.add_argument("roots", nargs="*",
+                      default=[config.TRAIN_FRAMES_ROOT, config.VALID_FRAMES_ROOT, config.TEST_FRAMES_ROOT],
+                      help="frames roots to clean up")
+  parser.add_argument("--dry-run", action="store_true", default=False, help="only print what would be removed")
+
+  parsed = parser.parse_args()
+  main(parsed)
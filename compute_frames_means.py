@@ -1,8 +1,9 @@
-import argparse, cv2, os
+import argparse, os
 import numpy as np
 
 import lib.config as config
 import lib.utils as utils
+import lib.video as video
 
 def main(args):
 
@@ -16,11 +17,8 @@ def main(args):
 
     video_folder_path = os.path.join(config.TRAIN_FRAMES_ROOT, utils.class_name_to_dir_name(cls), video_id)
 
-    frame_paths = [os.path.join(video_folder_path, frame_path) for frame_path in os.listdir(video_folder_path)]
-
-    for frame_path in frame_paths:
-
-      frame = cv2.imread(frame_path)
+    # JPEG files or packed frames, nothing for videos whose extraction did not finish
+    for frame in video.load_frames(video_folder_path):
 
       assert len(frame.shape) == 3
       assert frame.shape[-1] == 3
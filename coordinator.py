@@ -0,0 +1,128 @@
+import argparse, time
+
+import download
+import lib.constants as constants
+import lib.coordinator as coordinator
+import lib.job_state as job_state
+import lib.parallel_download as parallel_download
+import lib.parallel_to_frames as parallel_to_frames
+import lib.parallel_to_sound as parallel_to_sound
+import lib.utils as utils
+import lib.work_plan as work_plan
+import videos_to_frames
+import videos_to_sound
+
+def plan(stage, categories, args):
+  """
+  Plan the work of a run the same way the stage's own script does, without starting any workers or creating any
+  directories on this host.
+  :param stage:         constants.STAGE_DOWNLOAD, STAGE_FRAMES or STAGE_SOUND.
+  :param categories:    List of (category, classes) tuples.
+  :param args:          Parsed command line arguments.
+  :return:              Tuple: list of work items and the counter of the skipped videos.
+  """
+
+  result_counter = work_plan.ResultCounter(None)
+
+  if stage == constants.STAGE_DOWNLOAD:
+    groups = download.plan_downloads(categories, args.test)
+    priority_classes = utils.load_json(args.priority_classes) if args.priority_classes is not None else None
+
+    items = parallel_download.plan_requests(groups, result_counter, skip=args.skip, state_db=args.state_db,
+                                            max_attempts=args.max_attempts, unavailable_file=args.unavailable_log,
+                                            schedule=args.schedule, priority_classes=priority_classes,
+                                            shortest_first=args.shortest_first, verbose=args.verbose)
+  elif stage == constants.STAGE_FRAMES:
+    groups = videos_to_frames.plan(categories, args.test)
+    items = parallel_to_frames.plan_requests(groups, result_counter, state_db=args.state_db,
+                                             max_attempts=args.max_attempts)
+  else:
+    groups = videos_to_sound.plan(categories, args.test)
+    items = parallel_to_sound.plan_requests(groups, result_counter, state_db=args.state_db,
+                                            max_attempts=args.max_attempts)
+
+  return items, result_counter
+
+def main(args):
+
+  if args.all:
+    # all categories => all videos
+    categories = work_plan.get_categories()
+  else:
+    categories = []
+
+    if args.categories:
+      # selected categories
+      categories += work_plan.get_categories(args.categories)
+
+    if args.classes:
+      # selected classes
+      categories.append((None, args.classes))
+
+  items, result_counter = plan(args.stage, categories, args)
+
+  work_coordinator = coordinator.WorkCoordinator(items, lease_timeout=args.lease_timeout)
+  server = coordinator.CoordinatorServer(work_coordinator, host=args.host, port=args.port)
+  server.start()
+
+  print("{:d} videos planned, serving on {}".format(len(items), server.url))
+
+  try:
+    while not work_coordinator.is_finished():
+      time.sleep(args.report_interval)
+
+      status = work_coordinator.status()
+      print("{:d} pending, {:d} leased, {}".format(status["pending"], status["leased"],
+                                                   work_plan.format_counts(status["results"])))
+
+    # workers that are waiting for the last leases learn that the run is finished
+    time.sleep(args.linger)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.stop()
+
+  status = work_coordinator.status()
+  print(work_plan.format_summary(result_counter.counts))
+  print("results: {}, {:d} expired leases".format(work_plan.format_counts(status["results"]),
+                                                  status["expired_leases"]))
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Hand out the planned work of a run to download.py, videos_to_frames.py or "
+                                   "videos_to_sound.py workers on multiple machines (see --coordinator-url).")
+
+  parser.add_argument("stage", choices=[constants.STAGE_DOWNLOAD, constants.STAGE_FRAMES, constants.STAGE_SOUND],
+                      help="what the workers do")
+
+  parser.add_argument("--categories", nargs="+", help="categories to process")
+  parser.add_argument("--classes", nargs="+", help="classes to process")
+  parser.add_argument("--all", action="store_true", help="process the whole dataset")
+  parser.add_argument("--test", action="store_true", help="process the test set")
+
+  parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+  parser.add_argument("--port", type=int, default=8100, help="port to listen on")
+  parser.add_argument("--lease-timeout", type=float, default=coordinator.DEFAULT_LEASE_TIMEOUT,
+                      help="give the videos of a worker to other workers if it does not renew its lease for this "
+                           "many seconds")
+  parser.add_argument("--report-interval", type=float, default=60, help="how often to print the progress in seconds")
+  parser.add_argument("--linger", type=float, default=2 * coordinator.DEFAULT_POLL_INTERVAL,
+                      help="how long to keep serving after all work is done, so that idle workers can stop")
+  parser.add_argument("-v", "--verbose", default=False, action="store_true", help="print additional info")
+
+  parser.add_argument("--state-db", help="SQLite database of a previous run, finished videos are not handed out")
+  parser.add_argument("--max-attempts", type=int, default=job_state.DEFAULT_MAX_ATTEMPTS,
+                      help="videos that failed this many times are not handed out")
+  parser.add_argument("--unavailable-log", default="dataset/unavailable.txt",
+                      help="videos in this list are not downloaded (download only)")
+  parser.add_argument("-s", "--skip", default=False, action="store_true",
+                      help="skip classes that already have folders (download only)")
+  parser.add_argument("--schedule", default=constants.SCHEDULE_ROUND_ROBIN,
+                      choices=[constants.SCHEDULE_ROUND_ROBIN, constants.SCHEDULE_CLASSES],
+                      help="order of the downloads (see download.py)")
+  parser.add_argument("--priority-classes", help="JSON list of classes to download first (download only)")
+  parser.add_argument("--shortest-first", default=False, action="store_true",
+                      help="download the shortest sections of each class first (download only)")
+
+  parsed = parser.parse_args()
+  main(parsed)
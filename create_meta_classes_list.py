@@ -3,13 +3,14 @@ import argparse, math, random
 import lib.config as config
 import lib.constants as constants
 import lib.metadata as metadata
+import lib.metadata_cache as metadata_cache
 import lib.utils as utils
 
 
 def main(args):
 
   # load and validate training videos
-  videos = utils.load_json(config.TRAIN_METADATA_PATH)
+  videos = metadata_cache.load(config.TRAIN_METADATA_PATH)
   if args.format == constants.FORMAT_VIDEOS:
     train_videos = metadata.get_valid_videos(videos, config.TRAIN_ROOT)
   elif args.format == constants.FORMAT_FRAMES:
@@ -20,7 +21,7 @@ def main(args):
     raise ValueError("Invalid format type.")
 
   # load and validate validation videos
-  videos = utils.load_json(config.VAL_METADATA_PATH)
+  videos = metadata_cache.load(config.VAL_METADATA_PATH)
   if args.format == constants.FORMAT_VIDEOS:
     validation_videos = metadata.get_valid_videos(videos, config.VALID_ROOT)
   elif args.format == constants.FORMAT_FRAMES:
@@ -33,7 +34,7 @@ def main(args):
   # maybe load and validate test videos
   test_videos = None
   if not args.validation_from_training:
-    videos = utils.load_json(config.TEST_METADATA_PATH)
+    videos = metadata_cache.load(config.TEST_METADATA_PATH)
     if args.format == constants.FORMAT_VIDEOS:
       test_videos = metadata.get_valid_videos(videos, config.TEST_ROOT, class_dirs=False)
     elif args.format == constants.FORMAT_FRAMES:
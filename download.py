@@ -1,7 +1,20 @@
-import argparse, json, os
+import argparse, os
 
 import lib.config as config
+import lib.async_download as async_download
+import lib.autotune as autotune
+import lib.constants as constants
+import lib.coordinator as coordinator
+import lib.job_state as job_state
+import lib.metadata as metadata
+import lib.metadata_cache as metadata_cache
 import lib.parallel_download as parallel
+import lib.rate_limit as rate_limit
+import lib.sharding as sharding
+import lib.utils as utils
+import lib.work_plan as work_plan
+
+DEFAULT_CUT_TIMEOUT = 600.0
 
 def maybe_create_dirs():
   """
@@ -16,101 +29,139 @@ def maybe_create_dirs():
       except FileExistsError:
         pass
 
-def download_category(category, num_workers, failed_save_file, compress, verbose, skip, log_file):
+def plan_downloads(categories, test):
   """
-  Download all videos that belong to the given category.
-  :param category:              The category to download.
-  :param num_workers:           Number of downloads in parallel.
-  :param failed_save_file:      Where to save failed video ids.
-  :param compress:              Decides if the videos should be compressed.
-  :param verbose:               Print status.
-  :param skip:                  Skip classes that already have folders (i.e. at least one video was downloaded).
-  :param log_file:              Path to log file for youtube-dl.
-  :return:                      None.
+  Plan all downloads of a run.
+  :param categories:    List of (category, classes) tuples to download from the training and validation sets.
+  :param test:          Download the test set.
+  :return:              List of work groups (see work_plan.WorkGroup).
   """
 
-  with open(config.CATEGORIES_PATH, "r") as file:
-    categories = json.load(file)
+  splits = []
+
+  if len(categories) > 0:
+    for split, list_path, save_root in zip([constants.TRAIN, constants.VALID],
+                                           [config.TRAIN_METADATA_PATH, config.VAL_METADATA_PATH],
+                                           [config.TRAIN_ROOT, config.VALID_ROOT]):
+      label_index = metadata.build_label_index(metadata_cache.load(list_path))
+      splits.append((split, None, save_root, label_index))
 
-  if category not in categories:
-    raise ValueError("Category {} not found.".format(category))
+  groups = work_plan.plan_groups(categories, splits)
 
-  classes = categories[category]
-  download_classes(classes, num_workers, failed_save_file, compress, verbose, skip, log_file)
+  if test:
+    label_index = metadata.build_label_index(metadata_cache.load(config.TEST_METADATA_PATH))
+    groups.append(work_plan.WorkGroup(constants.TEST, None, None, config.TEST_ROOT, label_index=label_index))
 
-def download_classes(classes, num_workers, failed_save_file, compress, verbose, skip, log_file):
+  return groups
+
+def download(groups, num_workers, failed_save_file, compress, verbose, skip, client=None,
+             lease_size=coordinator.DEFAULT_LEASE_SIZE, orchestrator=constants.ORCHESTRATOR_PROCESSES,
+             **pool_kwargs):
   """
-  Download all videos of the provided classes.
-  :param classes:               List of classes to download.
+  Download all planned videos with a single pool of workers.
+  :param groups:                Planned work (see plan_downloads).
   :param num_workers:           Number of downloads in parallel.
   :param failed_save_file:      Where to save failed video ids.
   :param compress:              Decides if the videos should be compressed.
   :param verbose:               Print status.
   :param skip:                  Skip classes that already have folders (i.e. at least one video was downloaded).
-  :param log_file:              Path to log file for youtube-dl.
-  :return:                      None.
+  :param client:                Coordinator client to lease the videos from instead of the planned work, None to
+                                download the planned work.
+  :param lease_size:            Number of videos leased at once.
+  :param orchestrator:          constants.ORCHESTRATOR_PROCESSES runs a process for each download,
+                                constants.ORCHESTRATOR_ASYNCIO runs all downloads from a single event loop.
+  :param pool_kwargs:           Additional options of the download pool (see parallel_download.Pool).
+  :return:                      Number of videos with each status for each work group.
   """
 
-  for list_path, save_root in zip([config.TRAIN_METADATA_PATH, config.VAL_METADATA_PATH],
-                                        [config.TRAIN_ROOT, config.VALID_ROOT]):
-    with open(list_path) as file:
-      data = json.load(file)
+  if orchestrator == constants.ORCHESTRATOR_ASYNCIO:
+    pool = async_download.AsyncPool(groups, num_workers, failed_save_file, compress, verbose, skip, **pool_kwargs)
+    return pool.run()
+
+  pool = parallel.Pool(groups, num_workers, failed_save_file, compress, verbose, skip, **pool_kwargs)
+  pool.start_workers()
 
-    pool = parallel.Pool(classes, data, save_root, num_workers, failed_save_file, compress, verbose, skip,
-                         log_file=log_file)
-    pool.start_workers()
+  if client is None:
     pool.feed_videos()
-    pool.stop_workers()
+  else:
+    coordinator.feed_pool(pool, client, lease_size=lease_size, num_results=parallel.count_results)
+
+  return pool.stop_workers()
 
-def download_test_set(num_workers, failed_log, compress, verbose, skip, log_file):
+def get_pool_kwargs(args):
   """
-  Download the test set.
-  :param num_workers:           Number of downloads in parallel.
-  :param failed_log:            Where to save failed video ids.
-  :param compress:              Decides if the videos should be compressed.
-  :param verbose:               Print status.
-  :param skip:                  Skip classes that already have folders (i.e. at least one video was downloaded).
-  :param log_file:              Path to log file for youtube-dl.
-  :return:
+  Collect additional options of the download pool from command line arguments.
+  :param args:    Parsed command line arguments.
+  :return:        Dictionary of keyword arguments for parallel_download.Pool.
   """
 
-  with open(config.TEST_METADATA_PATH) as file:
-    data = json.load(file)
-
-  pool = parallel.Pool(None, data, config.TEST_ROOT, num_workers, failed_log, compress, verbose, skip,
-                       log_file=log_file)
-  pool.start_workers()
-  pool.feed_videos()
-  pool.stop_workers()
+  return {
+    "log_file": args.log_file,
+    "cut_mode": args.cut_mode,
+    "cut_log_file": args.cut_log,
+    "num_cut_workers": args.num_cut_workers,
+    "cut_queue_size": args.cut_queue_size,
+    "state_db": args.state_db,
+    "max_attempts": args.max_attempts,
+    "retries": args.retries,
+    "unavailable_file": args.unavailable_log,
+    "max_requests_per_second": args.max_requests_per_second,
+    "max_bandwidth": rate_limit.parse_size(args.max_bandwidth) if args.max_bandwidth is not None else None,
+    "fetcher": args.fetcher,
+    "fetcher_url": args.fetcher_url,
+    "target_resolution": args.target_resolution,
+    "audio_only": args.audio_only,
+    "download_timeout": args.download_timeout,
+    "cut_timeout": args.cut_timeout,
+    "scratch_directory": args.scratch_dir,
+    "min_free_space": rate_limit.parse_size(args.min_free_space) if args.min_free_space is not None else None,
+    "schedule": args.schedule,
+    "priority_classes": utils.load_json(args.priority_classes) if args.priority_classes is not None else None,
+    "shortest_first": args.shortest_first,
+    "num_shards": args.num_shards,
+    "shard_index": args.shard_index,
+    "autotune": args.autotune,
+    "autotune_interval": args.autotune_interval,
+    "threads_per_worker": args.threads_per_worker
+  }
 
 def main(args):
 
   maybe_create_dirs()
 
-  if args.all:
-    # download all categories => all videos
-    with open(config.CATEGORIES_PATH, "r") as file:
-      categories = json.load(file)
+  # each shard writes its own logs, merge_shards.py combines them, the pool reads the unavailable videos of all shards
+  for name in ["failed_log", "cut_log", "state_db"]:
+    setattr(args, name, sharding.shard_path(getattr(args, name), args.num_shards, args.shard_index))
 
-    for category in categories:
-      download_category(category, args.num_workers, args.failed_log, args.compress, args.verbose, args.skip,
-                        args.log_file)
+  pool_kwargs = get_pool_kwargs(args)
 
+  if args.all:
+    # download all categories => all videos
+    categories = work_plan.get_categories()
   else:
+    categories = []
+
     if args.categories:
       # download selected categories
-      for category in args.categories:
-        download_category(category, args.num_workers, args.failed_log, args.compress, args.verbose, args.skip,
-                          args.log_file)
+      categories += work_plan.get_categories(args.categories)
 
     if args.classes:
       # download selected classes
-      download_classes(args.classes, args.num_workers, args.failed_log, args.compress, args.verbose, args.skip,
-                       args.log_file)
+      categories.append((None, args.classes))
+
+  client = None
+  groups = []
+
+  if args.coordinator_url is not None:
+    # the coordinator planned the work
+    client = coordinator.CoordinatorClient(args.coordinator_url, coordinator.get_worker_name())
+  else:
+    groups = plan_downloads(categories, args.test)
+
+  counts = download(groups, args.num_workers, args.failed_log, args.compress, args.verbose, args.skip, client=client,
+                    lease_size=args.lease_size, orchestrator=args.orchestrator, **pool_kwargs)
 
-    if args.test:
-      # download the test set
-      download_test_set(args.num_workers, args.failed_log, args.compress, args.verbose, args.skip, args.failed_log)
+  print(work_plan.format_summary(counts))
 
 if __name__ == "__main__":
 
@@ -122,11 +173,104 @@ if __name__ == "__main__":
   parser.add_argument("--test", action="store_true", help="download the test set")
 
   parser.add_argument("--num-workers", type=int, default=1, help="number of downloader processes")
+  parser.add_argument("--num-cut-workers", type=int, help="number of processes cutting the downloaded videos "
+                                                          "(defaults to --num-workers)")
+  parser.add_argument("--cut-queue-size", type=int, help="maximum number of downloaded videos waiting to be cut "
+                                                         "(defaults to twice the number of cut workers)")
   parser.add_argument("--failed-log", default="dataset/failed.txt", help="where to save list of failed videos")
   parser.add_argument("--compress", default=False, action="store_true", help="compress videos using gzip (not recommended)")
   parser.add_argument("-v", "--verbose", default=False, action="store_true", help="print additional info")
   parser.add_argument("-s", "--skip", default=False, action="store_true", help="skip classes that already have folders")
   parser.add_argument("-l", "--log-file", help="log file for youtube-dl (the library used to download YouTube videos)")
+  parser.add_argument("--cut-mode", default=constants.CUT_MODE_REENCODE,
+                      choices=[constants.CUT_MODE_REENCODE, constants.CUT_MODE_FAST],
+                      help="{}: re-encode the whole clip, {}: seek in the input and copy the streams when the clip "
+                           "starts near a keyframe".format(constants.CUT_MODE_REENCODE, constants.CUT_MODE_FAST))
+  parser.add_argument("--cut-log", help="where to save which cut path (copy, splice or reencode) each video took")
+  parser.add_argument("--state-db", help="SQLite database recording the state of each video, finished videos are "
+                                         "skipped when the download is resumed")
+  parser.add_argument("--max-attempts", type=int, default=job_state.DEFAULT_MAX_ATTEMPTS,
+                      help="do not retry videos that failed this many times (requires --state-db)")
+  parser.add_argument("--retries", type=int, default=2, help="how many times to retry downloads that failed because "
+                                                             "of throttling or network errors")
+  parser.add_argument("--unavailable-log", default="dataset/unavailable.txt",
+                      help="list of videos that cannot be downloaded (e.g. removed or private), the videos are skipped "
+                           "and new unavailable videos are added to it")
+  parser.add_argument("--max-requests-per-second", type=float,
+                      help="maximum number of downloads started per second by all workers together")
+  parser.add_argument("--max-bandwidth", help="maximum aggregate download bandwidth in bytes per second, "
+                                              "K, M and G suffixes are supported (e.g. 50M)")
+  parser.add_argument("--fetcher", default=constants.FETCHER_SUBPROCESS,
+                      choices=[constants.FETCHER_SUBPROCESS, constants.FETCHER_API, constants.FETCHER_HTTP],
+                      help="{}: run youtube-dl for each video, {}: keep one youtube-dl (or yt-dlp) instance per worker "
+                           "and reuse its connections, {}: download from a mock video service (see "
+                           "mock_video_service.py)".format(constants.FETCHER_SUBPROCESS, constants.FETCHER_API,
+                                                           constants.FETCHER_HTTP))
+  parser.add_argument("--fetcher-url", help="URL of the mock video service (e.g. http://127.0.0.1:8000)")
+  parser.add_argument("--target-resolution", type=int,
+                      help="download the smallest format whose shorter side has at least this many pixels "
+                           "(e.g. 256 for frames resized by videos_to_frames.py) instead of the best format")
+  parser.add_argument("--audio-only", default=False, action="store_true",
+                      help="download only sound tracks (enough for videos_to_sound.py)")
+  parser.add_argument("--download-timeout", type=float, default=1800,
+                      help="kill a download worker (and youtube-dl) that spends more seconds on a single video and "
+                           "requeue the video")
+  parser.add_argument("--cut-timeout", type=float,
+                      help="kill a cut worker (and ffmpeg) that spends more seconds on a single video and requeue "
+                           "the video, defaults to {:.0f}".format(DEFAULT_CUT_TIMEOUT))
+
+  parser.add_argument("--scratch-dir", help="where to save whole videos before they are cut (e.g. a tmpfs or a local "
+                                          "NVMe drive), defaults to the class directories")
+  parser.add_argument("--min-free-space", help="pause downloads while the scratch or dataset volume has less free "
+                                               "space, K, M and G suffixes are supported (e.g. 20G)")
+  parser.add_argument("--schedule", default=constants.SCHEDULE_ROUND_ROBIN,
+                      choices=[constants.SCHEDULE_ROUND_ROBIN, constants.SCHEDULE_CLASSES],
+                      help="{}: take one video of each class in turn, so that a partial download is balanced, {}: "
+                           "download one class after another".format(constants.SCHEDULE_ROUND_ROBIN,
+                                                                     constants.SCHEDULE_CLASSES))
+  parser.add_argument("--priority-classes", help="JSON list of classes to download before all other classes (e.g. "
+                                                 "a subset for hyper-parameter search)")
+  parser.add_argument("--shortest-first", default=False, action="store_true",
+                      help="download the shortest sections of each class first")
+
+  parser.add_argument("--orchestrator", default=constants.ORCHESTRATOR_PROCESSES,
+                      choices=[constants.ORCHESTRATOR_PROCESSES, constants.ORCHESTRATOR_ASYNCIO],
+                      help="{}: a process for each download worker, {}: all downloads in flight are driven by a "
+                           "single event loop, so --num-workers can be in the hundreds".format(
+                             constants.ORCHESTRATOR_PROCESSES, constants.ORCHESTRATOR_ASYNCIO))
+  parser.add_argument("--autotune", default=False, action="store_true",
+                      help="search for the number of download workers with the highest throughput, starting with "
+                           "--num-workers, and split the cores between the cut workers")
+  parser.add_argument("--autotune-interval", type=float, default=autotune.DEFAULT_INTERVAL,
+                      help="how long to measure each number of workers in seconds")
+  parser.add_argument("--threads-per-worker", type=int, help="number of ffmpeg threads of each cut worker")
+  parser.add_argument("--coordinator-url", help="lease the videos from a coordinator (see coordinator.py) instead of "
+                                                "planning them, e.g. http://10.0.0.1:8100")
+  parser.add_argument("--lease-size", type=int, default=coordinator.DEFAULT_LEASE_SIZE,
+                      help="number of videos leased from the coordinator at once")
+  parser.add_argument("--num-shards", type=int, default=1,
+                      help="split the videos between this many machines by a hash of their ids")
+  parser.add_argument("--shard-index", type=int, default=0, help="index of the shard processed by this machine, "
+                                                                 "from 0 to --num-shards - 1")
 
   parsed = parser.parse_args()
+
+  if not 0 <= parsed.shard_index < parsed.num_shards:
+    parser.error("--shard-index has to be between 0 and --num-shards - 1")
+
+  if parsed.orchestrator == constants.ORCHESTRATOR_ASYNCIO and parsed.coordinator_url is not None:
+    parser.error("--coordinator-url is not supported by --orchestrator {}".format(constants.ORCHESTRATOR_ASYNCIO))
+
+  if parsed.orchestrator == constants.ORCHESTRATOR_ASYNCIO and parsed.autotune:
+    parser.error("--autotune is not supported by --orchestrator {}".format(constants.ORCHESTRATOR_ASYNCIO))
+
+  if parsed.orchestrator == constants.ORCHESTRATOR_ASYNCIO and parsed.cut_timeout is not None:
+    parser.error("--cut-timeout is not supported by --orchestrator {}".format(constants.ORCHESTRATOR_ASYNCIO))
+
+  if parsed.orchestrator == constants.ORCHESTRATOR_PROCESSES and parsed.cut_timeout is None:
+    parsed.cut_timeout = DEFAULT_CUT_TIMEOUT
+
+  if parsed.fetcher == constants.FETCHER_HTTP and parsed.fetcher_url is None:
+    parser.error("--fetcher {} requires --fetcher-url".format(constants.FETCHER_HTTP))
+
   main(parsed)
\ No newline at end of file
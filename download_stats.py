@@ -1,26 +1,32 @@
 import argparse, os
 
 import lib.config as config
+import lib.metadata as metadata
+import lib.metadata_cache as metadata_cache
 import lib.utils as utils
 
-def count_present_and_missing(cls, directory, metadata):
+def count_present_and_missing(cls, directory, label_index):
   """
   Count present and missing videos for a class based on metadata.
   :param cls:           The class. If None, count all videos (used for testing videos - no classes).
   :param directory:     Directory containing the videos.
-  :param metadata:      Kinetics metadata json.
+  :param label_index:   Kinetics metadata indexed by labels (see metadata.build_label_index).
   :return:              Tuple: number present videos, number of missing videos
   """
 
   present = 0
   missing = 0
 
-  for key in metadata:
-    if cls is None or metadata[key]["annotations"]["label"] == cls:
-      if os.path.isfile(os.path.join(directory, "{}.mp4".format(key))):
-        present += 1
-      else:
-        missing += 1
+  if cls is None:
+    segments = (segment for label_segments in label_index.values() for segment in label_segments)
+  else:
+    segments = label_index.get(cls.lower(), [])
+
+  for video_id, _, _ in segments:
+    if os.path.isfile(os.path.join(directory, "{}.mp4".format(video_id))):
+      present += 1
+    else:
+      missing += 1
 
   return present, missing
 
@@ -31,9 +37,9 @@ def main(args):
   classes = utils.load_json(config.CLASSES_PATH)
 
   # load lists of videos
-  train_metadata = utils.load_json(config.TRAIN_METADATA_PATH)
-  val_metadata = utils.load_json(config.VAL_METADATA_PATH)
-  test_metadata = utils.load_json(config.TEST_METADATA_PATH)
+  train_metadata = metadata.build_label_index(metadata_cache.load(config.TRAIN_METADATA_PATH))
+  val_metadata = metadata.build_label_index(metadata_cache.load(config.VAL_METADATA_PATH))
+  test_metadata = metadata.build_label_index(metadata_cache.load(config.TEST_METADATA_PATH))
 
   num_found = 0
   total = 0
@@ -0,0 +1,378 @@
+import asyncio, os, queue, threading, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import lib.autotune as autotune
+import lib.constants as constants
+import lib.downloader as downloader
+import lib.job_state as job_state
+import lib.parallel_download as parallel_download
+import lib.supervisor as supervisor
+import lib.work_plan as work_plan
+
+class AsyncPool(parallel_download.Pool):
+  """
+  Schedules downloads from a single event loop instead of one process per download: num_workers is the number of
+  downloads in flight, each runs the blocking download code of the download workers (see
+  parallel_download.download_request) in a thread with its own fetcher. A download that times out is cancelled, its
+  youtube-dl process is killed (see downloader.SubprocessFetcher.cancel). Cutting is CPU-bound and runs in a small
+  process pool. Accepts the options of parallel_download.Pool, except cut_timeout, max_requeues and autotune: a cut
+  cannot be interrupted without restarting the process pool and the number of threads is fixed.
+  """
+
+  def __init__(self, *args, **kwargs):
+
+    super().__init__(*args, **kwargs)
+
+    if self.cut_timeout is not None:
+      raise ValueError("The asynchronous pool does not support cut timeouts.")
+    if self.max_requeues != supervisor.DEFAULT_MAX_REQUEUES:
+      raise ValueError("The asynchronous pool does not requeue videos.")
+    if self.autotune:
+      raise ValueError("The asynchronous pool does not support autotuning.")
+
+    # written by the threads and the event loop, putting never blocks
+    self.failed_queue = queue.Queue()
+    self.state_queue = queue.Queue() if self.state_db is not None else None
+    self.unavailable_queue = queue.Queue() if self.unavailable_file is not None else None
+
+    self.download_executor = None
+    self.cut_executor = None
+    self.download_slots = None
+    self.cut_slots = None
+    self.writer_threads = []
+
+    self.local = threading.local()
+    self.fetchers = []
+    self.lock = threading.Lock()
+
+  def run(self):
+    """
+    Download all planned videos.
+    :return:    Number of videos with each status for each work group (see work_plan.ResultCounter).
+    """
+
+    requests = self.plan_videos()
+
+    if self.scratch_directory is not None:
+      os.makedirs(self.scratch_directory, exist_ok=True)
+
+    self.start_writers()
+
+    try:
+      asyncio.run(self.process_all(requests))
+    finally:
+      self.stop_writers()
+
+    if self.rate_limiter is not None:
+      print(self.rate_limiter.report())
+
+    return self.result_counter.counts
+
+  def start_writers(self):
+    """
+    Start the threads that write the failed videos, the unavailable videos and the job states, so that the event
+    loop never waits for files or the database.
+    :return:    None.
+    """
+
+    writers = []
+
+    if self.failed_save_file is not None:
+      writers.append((parallel_download.write_failed_worker, (self.failed_queue, self.failed_save_file)))
+    if self.unavailable_file is not None:
+      writers.append((parallel_download.write_failed_worker, (self.unavailable_queue, self.unavailable_shard_file)))
+    if self.state_db is not None:
+      writers.append((job_state.state_worker, (self.state_queue, self.state_db)))
+
+    for target, args in writers:
+      thread = threading.Thread(target=target, args=args)
+      thread.start()
+      self.writer_threads.append((thread, args[0]))
+
+  def stop_writers(self):
+    """
+    Write everything left in the queues and stop the writer threads.
+    :return:    None.
+    """
+
+    for _, writer_queue in self.writer_threads:
+      writer_queue.put(None)
+
+    for thread, _ in self.writer_threads:
+      thread.join()
+
+    self.writer_threads = []
+
+  def create_cut_executor(self):
+    """
+    Start the cut processes.
+    :return:    Process pool executor.
+    """
+
+    return ProcessPoolExecutor(self.num_cut_workers, initializer=autotune.set_worker_threads,
+                               initargs=(self.threads_per_worker,))
+
+  async def process_all(self, requests):
+    """
+    Process download requests, at most num_workers downloads run at the same time.
+    :param requests:    List of download requests (see parallel_download.group_requests).
+    :return:            None.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    self.download_executor = ThreadPoolExecutor(self.num_workers)
+    self.cut_executor = self.create_cut_executor()
+    self.download_slots = asyncio.Semaphore(self.num_workers)
+    self.cut_slots = asyncio.Semaphore(self.num_cut_workers + self.cut_queue_size)
+
+    tasks = set()
+
+    try:
+      for request in requests:
+        await self.download_slots.acquire()
+
+        if self.disk_guard is not None:
+          # wait before starting another download, cuts keep running and free the scratch space
+          await self.wait_for_disk_space()
+
+        task = loop.create_task(self.process_request(request))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+      if len(tasks) > 0:
+        # process_request handles its errors, anything else must not cancel the other videos
+        for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+          if isinstance(outcome, Exception):
+            print("unexpected error: {}".format(outcome))
+    finally:
+      # all downloads are finished unless the loop was interrupted, then the running ones are stopped
+      with self.lock:
+        fetchers = list(self.fetchers)
+
+      for fetcher in fetchers:
+        fetcher.cancel()
+
+      self.download_executor.shutdown(wait=True, cancel_futures=True)
+      self.cut_executor.shutdown(wait=True)
+
+      for fetcher in self.fetchers:
+        fetcher.close()
+
+  async def wait_for_disk_space(self):
+    """
+    Wait until all watched volumes have enough free space (see disk_space.DiskSpaceGuard).
+    :return:    None.
+    """
+
+    loop = asyncio.get_running_loop()
+    full_volume = await loop.run_in_executor(None, self.disk_guard.find_full_volume)
+
+    if full_volume is None:
+      return
+
+    print("pausing: only {:.1f} MB free on the volume of {}".format(full_volume[1] / 1024 ** 2, full_volume[0]))
+    start_time = time.time()
+
+    while full_volume is not None:
+      await asyncio.sleep(self.disk_guard.check_interval)
+      full_volume = await loop.run_in_executor(None, self.disk_guard.find_full_volume)
+
+    print("resuming after {:.0f}s".format(time.time() - start_time))
+
+  async def process_request(self, request):
+    """
+    Download a video and cut out all its sections.
+    :param request:   Download request, the caller acquired a download slot for it.
+    :return:          None.
+    """
+
+    cut_request = None
+
+    try:
+      cut_request = await self.download(request)
+
+      if cut_request is not None:
+        # downloads wait while the cut workers cannot keep up
+        await self.cut_slots.acquire()
+    finally:
+      self.download_slots.release()
+
+    if cut_request is None:
+      return
+
+    try:
+      await self.cut(cut_request)
+    finally:
+      self.cut_slots.release()
+
+  async def download(self, request):
+    """
+    Download the whole video of a request in a thread. Errors fail all sections of the video, the other videos go on.
+    :param request:   Download request.
+    :return:          Cut request (see parallel_download.download_request), None if there is nothing to cut.
+    """
+
+    video_id, targets = request
+    loop = asyncio.get_running_loop()
+
+    try:
+      # the download slot is held until the thread is free again, also after a timeout
+      results, cut_request = await loop.run_in_executor(self.download_executor, self.download_blocking, request)
+    except Exception as error:
+      print("downloading {} failed: {}".format(video_id, error))
+
+      self.failed_queue.put(video_id)
+      job_state.put_state(self.state_queue, video_id, constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED,
+                          error=constants.ERROR_UNKNOWN)
+      self.add_results([work_plan.Result(target[-1], constants.JOB_STATUS_FAILED, video_id) for target in targets])
+      return None
+
+    self.add_results(results)
+
+    return cut_request
+
+  def download_blocking(self, request):
+    """
+    Download the video of a request with the fetcher of the current thread. The timeout starts when the thread picks
+    up the request, a download that times out is cancelled (see downloader.SubprocessFetcher.cancel) and recorded as
+    a timeout instead of its own outcome.
+    :param request:     Download request.
+    :return:            Tuple: list of results and the cut request (see parallel_download.download_request).
+    """
+
+    video_id, targets = request
+    fetcher = self.get_fetcher()
+    cancelled = threading.Event()
+    timer = None
+
+    if self.download_timeout is not None:
+      timer = threading.Timer(self.download_timeout, cancel_download, (cancelled, fetcher))
+      timer.start()
+
+    # the records of the download are held back until it is known whether it timed out
+    failed_queue = queue.Queue()
+    unavailable_queue = queue.Queue() if self.unavailable_queue is not None else None
+    state_queue = queue.Queue() if self.state_queue is not None else None
+
+    try:
+      results, cut_request = parallel_download.download_request(
+        request, failed_queue, unavailable_queue, state_queue, self.log_file, self.retries, self.rate_limiter, fetcher,
+        self.target_resolution, self.audio_only, self.scratch_directory, cancelled=cancelled)
+    finally:
+      if timer is not None:
+        timer.cancel()
+        timer.join()
+
+      if cancelled.is_set():
+        # a cancelled fetcher fails all further downloads
+        self.drop_fetcher(fetcher)
+
+    if cancelled.is_set():
+      self.cleanup_download(request)
+
+      self.failed_queue.put(video_id)
+      job_state.put_state(self.state_queue, video_id, constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED,
+                          error=constants.ERROR_TIMEOUT)
+
+      return [work_plan.Result(target[-1], constants.JOB_STATUS_FAILED, video_id) for target in targets], None
+
+    for source, target in [(failed_queue, self.failed_queue), (unavailable_queue, self.unavailable_queue),
+                           (state_queue, self.state_queue)]:
+      while source is not None and not source.empty():
+        target.put(source.get())
+
+    return results, cut_request
+
+  def get_fetcher(self):
+    """
+    Get the fetcher of the current thread, each thread keeps its own fetcher for all its downloads.
+    :return:    The fetcher.
+    """
+
+    fetcher = getattr(self.local, "fetcher", None)
+
+    if fetcher is None:
+      fetcher = downloader.get_fetcher(self.fetcher, url=self.fetcher_url)
+      self.local.fetcher = fetcher
+
+      with self.lock:
+        self.fetchers.append(fetcher)
+
+    return fetcher
+
+  def drop_fetcher(self, fetcher):
+    """
+    Close the fetcher of the current thread, the next download of the thread creates a new one.
+    :param fetcher:   The fetcher.
+    :return:          None.
+    """
+
+    self.local.fetcher = None
+    fetcher.close()
+
+    with self.lock:
+      self.fetchers.remove(fetcher)
+
+  async def cut(self, cut_request):
+    """
+    Cut out all sections of a downloaded video in the process pool.
+    :param cut_request:   Cut request returned by download.
+    :return:              None.
+    """
+
+    video_id, download_path, cuts = cut_request
+    loop = asyncio.get_running_loop()
+    executor = self.cut_executor
+
+    try:
+      durations = await loop.run_in_executor(executor, downloader.cut_sections, video_id, download_path, cuts,
+                                             self.compress, self.cut_mode, self.cut_log_file)
+    except Exception as error:
+      if isinstance(error, BrokenProcessPool):
+        # a cut process died, all cuts running in the pool fail and the next ones need a new pool
+        if executor is self.cut_executor:
+          print("a cut process died while cutting {}, restarting the cut processes".format(video_id))
+          self.cut_executor = self.create_cut_executor()
+      else:
+        print("cutting {} failed: {}".format(video_id, error))
+
+      await loop.run_in_executor(None, remove_file, download_path)
+      durations = [(False, 0.0)] * len(cuts)
+
+    # reporting checks the sizes of the slices
+    results = await loop.run_in_executor(None, parallel_download.report_cuts, video_id, cuts, durations,
+                                         self.failed_queue, self.state_queue)
+    self.add_results(results)
+
+  def add_results(self, results):
+    """
+    Count results.
+    :param results:   List of results (see work_plan.Result).
+    :return:          None.
+    """
+
+    for result in results:
+      self.result_counter.add(result.group_name, result.status)
+
+def remove_file(path):
+  """
+  Remove a file if it exists.
+  :param path:    Path to the file.
+  :return:        None.
+  """
+
+  if os.path.isfile(path):
+    os.remove(path)
+
+def cancel_download(cancelled, fetcher):
+  """
+  Stop a download that timed out.
+  :param cancelled:   Event that stops retrying (see downloader.download_video).
+  :param fetcher:     Fetcher running the download.
+  :return:            None.
+  """
+
+  cancelled.set()
+  fetcher.cancel()
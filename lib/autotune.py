@@ -0,0 +1,217 @@
+import os, sys, threading, time
+
+# how long each configuration is measured in seconds
+DEFAULT_INTERVAL = 60.0
+# a configuration has to be this much faster to replace the best one
+DEFAULT_TOLERANCE = 0.05
+
+# threads each ffmpeg and OpenCV call of this process may use, None for their defaults
+worker_threads = None
+
+def get_cpu_count():
+  """
+  Get the number of cores this process may run on.
+  :return:    Number of cores.
+  """
+
+  if hasattr(os, "sched_getaffinity"):
+    return len(os.sched_getaffinity(0))
+
+  return os.cpu_count() or 1
+
+def get_threads_per_worker(num_workers):
+  """
+  Split the cores between workers, so that they do not oversubscribe them.
+  :param num_workers:   Number of workers.
+  :return:              Number of threads of each worker.
+  """
+
+  return max(get_cpu_count() // max(num_workers, 1), 1)
+
+def set_worker_threads(num_threads):
+  """
+  Pin the number of threads used by ffmpeg (see ffmpeg_threads) and OpenCV in this process.
+  :param num_threads:   Number of threads, 0 or None for the library defaults.
+  :return:              None.
+  """
+
+  global worker_threads
+
+  num_threads = num_threads or None
+
+  if num_threads == worker_threads:
+    return
+
+  worker_threads = num_threads
+
+  # only workers that use OpenCV have it loaded
+  if "cv2" in sys.modules:
+    sys.modules["cv2"].setNumThreads(num_threads if num_threads is not None else -1)
+
+def ffmpeg_threads():
+  """
+  Get the ffmpeg option that limits the threads of an input or an output to the pinned number.
+  :return:    List of arguments, empty if the threads are not pinned.
+  """
+
+  if worker_threads is None:
+    return []
+
+  return ["-threads", str(worker_threads)]
+
+class Autotuner:
+  """
+  Searches for the number of workers of a pool with the highest throughput. Each configuration is measured for an
+  interval, then the neighbours of the best configuration are tried with a step that halves whenever none of them is
+  faster. The threads of each worker are pinned to their share of the cores. When the search converges, the pool keeps
+  the best configuration.
+  """
+
+  def __init__(self, name, worker_supervisor, result_counter, worker_threads=None, min_workers=1, max_workers=None,
+               interval=DEFAULT_INTERVAL, tolerance=DEFAULT_TOLERANCE):
+    """
+    :param name:                Name of the workers used in the log.
+    :param worker_supervisor:   Supervisor of the tuned workers (see supervisor.Supervisor).
+    :param result_counter:      Result counter of the pool (see work_plan.ResultCounter), measures the throughput.
+    :param worker_threads:      Shared value with the number of threads of each worker, None if the workers do not
+                                use ffmpeg or OpenCV.
+    :param min_workers:         Minimum number of workers.
+    :param max_workers:         Maximum number of workers, defaults to twice the number of cores or of the starting
+                                workers, whichever is larger.
+    :param interval:            How long each configuration is measured in seconds.
+    :param tolerance:           Relative improvement needed to prefer a configuration.
+    """
+
+    self.name = name
+    self.supervisor = worker_supervisor
+    self.result_counter = result_counter
+    self.worker_threads = worker_threads
+    self.min_workers = min_workers
+    self.max_workers = max_workers if max_workers is not None else \
+      max(2 * get_cpu_count(), 2 * worker_supervisor.num_workers)
+    self.interval = interval
+    self.tolerance = tolerance
+
+    self.measured = {}
+    self.best = None
+    self.step = max(worker_supervisor.num_workers // 2, 1)
+    self.converged = False
+
+    self.stop_event = threading.Event()
+    self.thread = None
+
+  def choose(self, num_workers, throughput):
+    """
+    Record the throughput of a configuration and choose the next one.
+    :param num_workers:   Number of workers that were measured.
+    :param throughput:    Their throughput in results per second.
+    :return:              Number of workers to measure next, the best configuration once the search converged.
+    """
+
+    self.measured[num_workers] = throughput
+
+    if self.best is None or throughput > self.measured[self.best] * (1 + self.tolerance):
+      self.best = num_workers
+
+    while self.step > 0:
+      for candidate in [self.best + self.step, self.best - self.step]:
+        if self.min_workers <= candidate <= self.max_workers and candidate not in self.measured:
+          return candidate
+
+      self.step //= 2
+
+    self.converged = True
+
+    return self.best
+
+  def apply(self, num_workers):
+    """
+    Change the number of workers and pin their threads.
+    :param num_workers:   Number of workers.
+    :return:              None.
+    """
+
+    if self.worker_threads is not None:
+      self.worker_threads.value = get_threads_per_worker(num_workers)
+
+    self.supervisor.resize(num_workers)
+
+  def format_configuration(self, num_workers):
+    """
+    Describe a configuration.
+    :param num_workers:   Number of workers.
+    :return:              String.
+    """
+
+    description = "{:d} workers".format(num_workers)
+
+    if self.worker_threads is not None:
+      description += ", {:d} threads each".format(get_threads_per_worker(num_workers))
+
+    return description
+
+  def run(self):
+    """
+    Measure configurations until the search converges or the tuner is stopped.
+    :return:    None.
+    """
+
+    num_workers = self.supervisor.num_workers
+    self.apply(num_workers)
+
+    while not self.converged:
+      start_count = self.result_counter.num_collected
+      start_time = time.time()
+
+      if self.stop_event.wait(self.interval):
+        break
+
+      num_results = self.result_counter.num_collected - start_count
+
+      if num_results == 0 and len(self.measured) == 0:
+        # the work is still being planned
+        continue
+
+      throughput = num_results / (time.time() - start_time)
+      print("{} autotune: {}: {:.2f} videos/s".format(self.name, self.format_configuration(num_workers), throughput))
+
+      num_workers = self.choose(num_workers, throughput)
+      self.apply(num_workers)
+
+    if self.converged:
+      print("{} autotune: picked {}".format(self.name, self.report()))
+
+  def start(self):
+    """
+    Start tuning in a background thread.
+    :return:    None.
+    """
+
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    """
+    Stop tuning.
+    :return:    None.
+    """
+
+    self.stop_event.set()
+
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+    if not self.converged:
+      print("{} autotune: stopped before converging, best so far {}".format(self.name, self.report()))
+
+  def report(self):
+    """
+    Describe the best configuration found so far.
+    :return:    Report string.
+    """
+
+    if self.best is None:
+      return "no measurement"
+
+    return "{} ({:.2f} videos/s)".format(self.format_configuration(self.best), self.measured[self.best])
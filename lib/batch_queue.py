@@ -0,0 +1,185 @@
+import collections, queue, time
+from multiprocessing import Queue
+
+# maximum number of batches waiting in a queue
+DEFAULT_MAX_BATCHES = 100
+DEFAULT_MAX_BATCH_SIZE = 64
+# how long a worker can hold finished results before sending them
+DEFAULT_MAX_DELAY = 1.0
+
+class BatchQueue:
+  """
+  A multiprocessing queue that carries lists of work items instead of single items, so that the pickling, pipe write
+  and lock handoff are paid once per batch. None is the end signal of a consumer.
+
+  The batch size adapts to the consumers: it doubles each time the queue is full (the consumers are behind and a
+  larger batch does not delay anyone) and halves each time the queue is found empty (a consumer is waiting and
+  should get work right away). A batch never takes more than its share of the remaining items, so that the last
+  items are spread over all consumers.
+  """
+
+  def __init__(self, num_consumers=1, max_batches=DEFAULT_MAX_BATCHES, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """
+    :param num_consumers:     Number of processes reading from the queue.
+    :param max_batches:       Maximum number of batches in the queue.
+    :param max_batch_size:    Maximum number of items in a batch.
+    """
+
+    self.num_consumers = max(num_consumers, 1)
+    self.max_batch_size = max_batch_size
+    self.batch_size = 1
+    self.queue = Queue(max_batches)
+
+  def put(self, item):
+    """
+    Put a single item (e.g. a requeued one) or the end signal into the queue.
+    :param item:    The item, None for the end signal.
+    :return:        None.
+    """
+
+    self.queue.put(None if item is None else [item])
+
+  def put_many(self, items):
+    """
+    Put items into the queue in batches, blocks while the queue is full.
+    :param items:   List of items.
+    :return:        None.
+    """
+
+    start = 0
+
+    while start < len(items):
+      share = max((len(items) - start) // self.num_consumers, 1)
+      batch = items[start:start + min(self.batch_size, share)]
+      start += len(batch)
+
+      self.put_batch(batch)
+
+  def put_batch(self, batch):
+    """
+    Put a batch into the queue and adapt the batch size.
+    :param batch:   List of items.
+    :return:        None.
+    """
+
+    starving = self.queue.empty()
+
+    try:
+      self.queue.put_nowait(batch)
+    except queue.Full:
+      self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+      self.queue.put(batch)
+      return
+
+    if starving:
+      self.batch_size = max(self.batch_size // 2, 1)
+
+  def get_batch(self):
+    """
+    Take a batch from the queue, blocks until there is one.
+    :return:    List of items, None for the end signal.
+    """
+
+    return self.queue.get()
+
+class BatchReader:
+  """
+  Hands out the items of batches taken from a batch queue one at a time.
+  """
+
+  def __init__(self, batch_queue, before_wait=None, slot=None):
+    """
+    :param batch_queue:     The batch queue.
+    :param before_wait:     Called before blocking on an empty queue (e.g. to send finished results), None for
+                            nothing.
+    :param slot:            Slot of the worker (see supervisor.WorkerSlot), the items the worker did not start are
+                            recorded there and the worker stops when it is retired. None if the worker is not
+                            supervised.
+    """
+
+    self.batch_queue = batch_queue
+    self.before_wait = before_wait
+    self.slot = slot
+    self.items = collections.deque()
+
+  def get(self):
+    """
+    Get the next item.
+    :return:    The item, None for the end signal.
+    """
+
+    if len(self.items) == 0:
+      if self.before_wait is not None:
+        self.before_wait()
+
+      if self.slot is not None and self.slot.is_retired():
+        # the supervisor reduced the number of workers
+        return None
+
+      batch = self.batch_queue.get_batch()
+
+      if batch is None:
+        return None
+
+      self.items.extend(batch)
+
+      if self.slot is not None:
+        self.slot.hold(batch)
+
+    if self.slot is not None:
+      self.slot.advance()
+
+    return self.items.popleft()
+
+class BatchWriter:
+  """
+  Collects records (e.g. results of a worker) and sends them as one list when enough of them piled up, when the
+  oldest one has waited too long or when flushed.
+  """
+
+  def __init__(self, output_queue, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY, slot=None):
+    """
+    :param output_queue:      Queue of lists of records.
+    :param max_batch_size:    Maximum number of records sent at once.
+    :param max_delay:         Maximum time in seconds a record is held.
+    :param slot:              Slot of the worker (see supervisor.WorkerSlot), the held records are recorded there.
+                              None if the worker is not supervised.
+    """
+
+    self.output_queue = output_queue
+    self.slot = slot
+    self.max_batch_size = max_batch_size
+    self.max_delay = max_delay
+    self.records = []
+    self.first_time = None
+
+  def put(self, record):
+    """
+    Add a record.
+    :param record:    The record.
+    :return:          None.
+    """
+
+    if len(self.records) == 0:
+      self.first_time = time.time()
+
+    self.records.append(record)
+
+    if self.slot is not None:
+      self.slot.add_result(record)
+
+    if len(self.records) >= self.max_batch_size or time.time() - self.first_time >= self.max_delay:
+      self.flush()
+
+  def flush(self):
+    """
+    Send all held records.
+    :return:    None.
+    """
+
+    if len(self.records) > 0:
+      self.output_queue.put(self.records)
+      self.records = []
+
+      if self.slot is not None:
+        self.slot.clear_results()
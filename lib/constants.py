@@ -9,4 +9,49 @@ FORMAT_SOUND = "sound"
 TFRECORDS_KEY_PATH = "path"
 TFRECORDS_KEY_LENGTH = "length"
 TFRECORDS_KEY_SOUND_RAW = "sound_raw"
-TFRECORDS_KEY_CLS_ID = "cls_id"
\ No newline at end of file
+TFRECORDS_KEY_CLS_ID = "cls_id"
+CUT_MODE_REENCODE = "reencode"
+CUT_MODE_FAST = "fast"
+
+CUT_PATH_REENCODE = "reencode"
+CUT_PATH_COPY = "copy"
+CUT_PATH_SPLICE = "splice"
+
+STAGE_DOWNLOAD = "download"
+STAGE_CUT = "cut"
+STAGE_FRAMES = "frames"
+STAGE_SOUND = "sound"
+
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+JOB_STATUS_PERMANENT = "permanent"
+JOB_STATUS_SKIPPED = "skipped"
+
+ERROR_TRANSIENT = "transient"
+ERROR_PERMANENT = "permanent"
+ERROR_UNKNOWN = "unknown"
+ERROR_TIMEOUT = "timeout"
+
+FETCHER_SUBPROCESS = "subprocess"
+FETCHER_API = "api"
+FETCHER_HTTP = "http"
+
+ORCHESTRATOR_PROCESSES = "processes"
+ORCHESTRATOR_ASYNCIO = "asyncio"
+
+FRAMES_ENGINE_OPENCV = "opencv"
+FRAMES_ENGINE_FFMPEG = "ffmpeg"
+# written into a directory of video frames after all frames, records their number and size
+FRAMES_MARKER = "frames.json"
+
+# suffix of the sibling the frames are extracted into before it is renamed
+PARTIAL_SUFFIX = ".partial"
+
+FRAMES_FORMAT_JPGS = "jpgs"
+FRAMES_FORMAT_PACKED = "packed"
+FRAMES_FORMAT_TAR = "tar"
+# suffix of the file with the packed frames of a video (see frame_pack)
+FRAMES_PACK_SUFFIX = ".frames"
+
+SCHEDULE_CLASSES = "classes"
+SCHEDULE_ROUND_ROBIN = "round-robin"
@@ -0,0 +1,575 @@
+import collections, http.client, json, os, socket, threading, time, urllib.parse, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import lib.constants as constants
+
+DEFAULT_LEASE_TIMEOUT = 600.0
+DEFAULT_LEASE_SIZE = 10
+DEFAULT_MAX_LEASES = 4
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_MAX_CONNECTION_ERRORS = 10
+
+# the worst status of a video wins when a video has multiple results
+STATUS_PRIORITY = [constants.JOB_STATUS_DONE, constants.JOB_STATUS_SKIPPED, constants.JOB_STATUS_PERMANENT,
+                   constants.JOB_STATUS_FAILED]
+
+class WorkCoordinator:
+  """
+  Owns the planned work of a run and hands it out to workers on any host in leases. A lease has to be renewed by
+  heartbeats, the items of leases that expire go back to the queue. Items are identified by the video id, their first
+  element.
+  """
+
+  def __init__(self, items, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+    """
+    :param items:           List of planned work items (e.g. download requests), they have to be JSON serializable.
+    :param lease_timeout:   Time in seconds after which a lease without a heartbeat expires.
+    """
+
+    self.lease_timeout = lease_timeout
+
+    self.pending = collections.deque(items)
+    self.leases = {}
+    self.results = {}
+    self.lock = threading.Lock()
+
+    self.num_items = len(items)
+    self.num_expired = 0
+
+  def lease(self, worker, max_items):
+    """
+    Lease a batch of items.
+    :param worker:      Name of the worker used in reports.
+    :param max_items:   Maximum number of items.
+    :return:            Tuple: lease id (None if no item is pending) and list of items.
+    """
+
+    with self.lock:
+      self.expire()
+
+      if len(self.pending) == 0:
+        return None, []
+
+      items = [self.pending.popleft() for _ in range(min(max_items, len(self.pending)))]
+      lease_id = uuid.uuid4().hex
+      self.leases[lease_id] = {"worker": worker, "items": items, "deadline": time.time() + self.lease_timeout}
+
+      return lease_id, items
+
+  def heartbeat(self, lease_id):
+    """
+    Renew a lease.
+    :param lease_id:    Id of the lease.
+    :return:            False if the lease expired and its items were given to other workers.
+    """
+
+    with self.lock:
+      self.expire()
+      lease = self.leases.get(lease_id)
+
+      if lease is None:
+        return False
+
+      lease["deadline"] = time.time() + self.lease_timeout
+
+      return True
+
+  def complete(self, lease_id, results):
+    """
+    Return the results of a lease. Items without a result go back to the queue.
+    :param lease_id:    Id of the lease.
+    :param results:     Dictionary with video ids as keys and statuses (constants.JOB_STATUS_*) as values.
+    :return:            False if the lease expired before, its results are ignored.
+    """
+
+    with self.lock:
+      lease = self.leases.pop(lease_id, None)
+
+      if lease is None:
+        return False
+
+      for item in lease["items"]:
+        if item[0] in results:
+          self.results[item[0]] = results[item[0]]
+        else:
+          self.pending.append(item)
+
+      return True
+
+  def expire(self):
+    """
+    Requeue the items of expired leases, the caller holds the lock.
+    :return:    None.
+    """
+
+    now = time.time()
+
+    for lease_id in [lease_id for lease_id, lease in self.leases.items() if lease["deadline"] < now]:
+      lease = self.leases.pop(lease_id)
+      self.pending.extend(lease["items"])
+      self.num_expired += 1
+      print("lease of {} expired, requeueing {:d} items".format(lease["worker"], len(lease["items"])))
+
+  def is_finished(self):
+    """
+    Check if all items have results.
+    :return:    True if no item is pending or leased.
+    """
+
+    with self.lock:
+      self.expire()
+      return len(self.pending) == 0 and len(self.leases) == 0
+
+  def status(self):
+    """
+    Summarize the progress of the run.
+    :return:    Dictionary with the number of pending and leased items, the number of finished items with each status
+                and whether the run is finished.
+    """
+
+    with self.lock:
+      self.expire()
+
+      counts = {}
+      for status in self.results.values():
+        counts[status] = counts.get(status, 0) + 1
+
+      return {
+        "pending": len(self.pending),
+        "leased": sum(len(lease["items"]) for lease in self.leases.values()),
+        "results": counts,
+        "expired_leases": self.num_expired,
+        "finished": len(self.pending) == 0 and len(self.leases) == 0
+      }
+
+class CoordinatorServer:
+  """
+  HTTP interface of a WorkCoordinator: POST /lease, /heartbeat and /complete with JSON bodies and GET /status.
+  """
+
+  def __init__(self, coordinator, host="127.0.0.1", port=0):
+    """
+    :param coordinator:   The work coordinator.
+    :param host:          Address to listen on.
+    :param port:          Port to listen on, 0 picks a free port.
+    """
+
+    self.coordinator = coordinator
+
+    self.server = ThreadingHTTPServer((host, port), CoordinatorHandler)
+    self.server.daemon_threads = True
+    self.server.coordinator = coordinator
+    self.thread = None
+
+  @property
+  def url(self):
+    """
+    URL of the coordinator (the argument of CoordinatorClient).
+    :return:    The URL.
+    """
+
+    host, port = self.server.server_address[:2]
+    return "http://{}:{:d}".format(host, port)
+
+  def start(self):
+    """
+    Serve requests in a background thread.
+    :return:    None.
+    """
+
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    """
+    Stop the server.
+    :return:    None.
+    """
+
+    self.server.shutdown()
+    self.server.server_close()
+
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+  """
+  Request handler of CoordinatorServer.
+  """
+
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+
+    if self.path != "/status":
+      self.send_error(404, "Not found")
+      return
+
+    self.send_json(self.server.coordinator.status())
+
+  def do_POST(self):
+
+    coordinator = self.server.coordinator
+
+    try:
+      body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+    except ValueError:
+      self.send_error(400, "Invalid JSON")
+      return
+
+    if self.path == "/lease":
+      lease_id, items = coordinator.lease(body["worker"], body["max_items"])
+      self.send_json({"lease_id": lease_id, "items": items, "finished": lease_id is None and
+                      coordinator.is_finished()})
+    elif self.path == "/heartbeat":
+      self.send_json({"ok": coordinator.heartbeat(body["lease_id"])})
+    elif self.path == "/complete":
+      self.send_json({"ok": coordinator.complete(body["lease_id"], body["results"])})
+    else:
+      self.send_error(404, "Not found")
+
+  def send_json(self, data):
+
+    body = json.dumps(data).encode("utf-8")
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class CoordinatorClient:
+  """
+  Client of a CoordinatorServer, safe to use from multiple threads.
+  """
+
+  def __init__(self, url, worker, timeout=60):
+    """
+    :param url:       URL of the coordinator (e.g. http://10.0.0.1:8100).
+    :param worker:    Name of this worker used in reports of the coordinator.
+    :param timeout:   Timeout of a request in seconds.
+    """
+
+    parsed = urllib.parse.urlparse(url)
+
+    self.host = parsed.hostname
+    self.port = parsed.port
+    self.worker = worker
+    self.timeout = timeout
+
+    self.connection = None
+    self.lock = threading.Lock()
+
+  def request(self, method, path, data=None):
+    """
+    Send a request to the coordinator, the connection is kept alive between requests.
+    :param method:    HTTP method.
+    :param path:      Path of the endpoint.
+    :param data:      JSON body of the request.
+    :return:          Decoded JSON response.
+    """
+
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+
+    with self.lock:
+      if self.connection is None:
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+      try:
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        content = response.read()
+      except (OSError, http.client.HTTPException):
+        self.close_connection()
+        raise
+
+      if response.status != 200:
+        raise http.client.HTTPException("coordinator returned HTTP {:d} for {}".format(response.status, path))
+
+      return json.loads(content.decode("utf-8"))
+
+  def lease(self, max_items):
+    """
+    Lease a batch of items.
+    :param max_items:   Maximum number of items.
+    :return:            Tuple: lease id (None if no item is pending), list of items and whether the run is finished.
+    """
+
+    response = self.request("POST", "/lease", {"worker": self.worker, "max_items": max_items})
+
+    return response["lease_id"], response["items"], response["finished"]
+
+  def heartbeat(self, lease_id):
+    """
+    Renew a lease.
+    :param lease_id:    Id of the lease.
+    :return:            False if the lease expired.
+    """
+
+    return self.request("POST", "/heartbeat", {"lease_id": lease_id})["ok"]
+
+  def complete(self, lease_id, results):
+    """
+    Return the results of a lease.
+    :param lease_id:    Id of the lease.
+    :param results:     Dictionary with video ids as keys and statuses as values.
+    :return:            False if the lease expired before.
+    """
+
+    return self.request("POST", "/complete", {"lease_id": lease_id, "results": results})["ok"]
+
+  def status(self):
+    """
+    Get the progress of the run.
+    :return:    Status dictionary (see WorkCoordinator.status).
+    """
+
+    return self.request("GET", "/status")
+
+  def close_connection(self):
+    """
+    Close the connection, the next request opens a new one.
+    :return:    None.
+    """
+
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
+
+class LeaseTracker:
+  """
+  Tracks the leased items of a local pool, returns each lease to the coordinator when all its items have results and
+  renews unfinished leases in a background thread. Leases that expired (their items were given to other workers or
+  leased again) are dropped, their results are no longer reported.
+  """
+
+  def __init__(self, client, num_results=None, heartbeat_interval=DEFAULT_LEASE_TIMEOUT / 3):
+    """
+    :param client:                Coordinator client.
+    :param num_results:           Called with an item, returns how many results the pool reports for it (e.g. one per
+                                  target of a download request). None if each item has a single result.
+    :param heartbeat_interval:    How often to renew the leases in seconds.
+    """
+
+    self.client = client
+    self.num_results = num_results
+    self.heartbeat_interval = heartbeat_interval
+
+    self.leases = {}
+    self.lease_by_id = {}
+    self.lock = threading.Lock()
+    self.lease_done = threading.Condition(self.lock)
+    self.stop_event = threading.Event()
+    self.thread = None
+
+  def add(self, lease_id, items):
+    """
+    Start tracking a lease.
+    :param lease_id:    Id of the lease.
+    :param items:       Leased items.
+    :return:            None.
+    """
+
+    with self.lock:
+      remaining = {}
+
+      for item in items:
+        # the coordinator gives out an item again only after its previous lease expired
+        previous_lease_id = self.lease_by_id.get(item[0])
+
+        if previous_lease_id is not None:
+          self.drop(previous_lease_id)
+
+        remaining[item[0]] = self.num_results(item) if self.num_results is not None else 1
+        self.lease_by_id[item[0]] = lease_id
+
+      self.leases[lease_id] = {"remaining": remaining, "results": {}}
+
+  def drop(self, lease_id):
+    """
+    Stop tracking an expired lease, the caller holds the lock.
+    :param lease_id:    Id of the lease.
+    :return:            None.
+    """
+
+    lease = self.leases.pop(lease_id, None)
+
+    if lease is None:
+      return
+
+    for video_id in lease["remaining"]:
+      if self.lease_by_id.get(video_id) == lease_id:
+        del self.lease_by_id[video_id]
+
+    self.lease_done.notify_all()
+
+  def on_result(self, group_name, status, video_id):
+    """
+    Record a result reported by the pool (see work_plan.ResultCounter).
+    :param group_name:    Name of the work group.
+    :param status:        Status of the video.
+    :param video_id:      YouTube ID of the video.
+    :return:              None.
+    """
+
+    with self.lock:
+      lease_id = self.lease_by_id.get(video_id)
+
+      if lease_id is None:
+        return
+
+      lease = self.leases[lease_id]
+      previous = lease["results"].get(video_id, constants.JOB_STATUS_DONE)
+      lease["results"][video_id] = max(previous, status, key=get_status_priority)
+      lease["remaining"][video_id] -= 1
+
+      if lease["remaining"][video_id] <= 0:
+        del lease["remaining"][video_id]
+        del self.lease_by_id[video_id]
+
+      if len(lease["remaining"]) > 0:
+        return
+
+      del self.leases[lease_id]
+      self.lease_done.notify_all()
+
+    try:
+      if not self.client.complete(lease_id, lease["results"]):
+        print("lease {} expired before it was completed".format(lease_id))
+    except (OSError, http.client.HTTPException) as error:
+      # the coordinator requeues the items when the lease expires
+      print("could not complete lease {}: {}".format(lease_id, error))
+
+  def wait(self, max_leases):
+    """
+    Wait until fewer than the given number of leases are unfinished, so that the pool does not hoard work that idle
+    workers on other hosts could take.
+    :param max_leases:    Maximum number of unfinished leases.
+    :return:              None.
+    """
+
+    with self.lease_done:
+      self.lease_done.wait_for(lambda: len(self.leases) < max_leases)
+
+  def renew(self):
+    """
+    Renew all unfinished leases until stopped.
+    :return:    None.
+    """
+
+    while not self.stop_event.wait(self.heartbeat_interval):
+      with self.lock:
+        lease_ids = list(self.leases.keys())
+
+      for lease_id in lease_ids:
+        try:
+          renewed = self.client.heartbeat(lease_id)
+        except (OSError, http.client.HTTPException) as error:
+          print("could not renew lease {}: {}".format(lease_id, error))
+          continue
+
+        if not renewed:
+          print("lease {} expired, its items were given to other workers".format(lease_id))
+
+          with self.lock:
+            self.drop(lease_id)
+
+  def start(self):
+    """
+    Start renewing leases.
+    :return:    None.
+    """
+
+    self.thread = threading.Thread(target=self.renew, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    """
+    Stop renewing leases.
+    :return:    None.
+    """
+
+    self.stop_event.set()
+
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+def get_worker_name():
+  """
+  Name of this worker in the reports of the coordinator.
+  :return:    Host name and process id.
+  """
+
+  return "{}-{:d}".format(socket.gethostname(), os.getpid())
+
+def get_status_priority(status):
+  """
+  Rank statuses, a video with multiple results gets the highest ranked one.
+  :param status:    Status (constants.JOB_STATUS_*).
+  :return:          Rank.
+  """
+
+  return STATUS_PRIORITY.index(status) if status in STATUS_PRIORITY else len(STATUS_PRIORITY)
+
+def feed_pool(pool, client, lease_size=DEFAULT_LEASE_SIZE, max_leases=DEFAULT_MAX_LEASES, num_results=None,
+              poll_interval=DEFAULT_POLL_INTERVAL, heartbeat_interval=DEFAULT_LEASE_TIMEOUT / 3,
+              max_connection_errors=DEFAULT_MAX_CONNECTION_ERRORS):
+  """
+  Feed a started pool (parallel_download.Pool, parallel_to_frames.Pool or parallel_to_sound.Pool) with items leased
+  from a coordinator instead of its own plan. Returns when the coordinator has no more work and all leases of this
+  pool were completed.
+  :param pool:                    The pool, its workers have to be started.
+  :param client:                  Coordinator client.
+  :param lease_size:              Number of items leased at once.
+  :param max_leases:              Maximum number of unfinished leases held by the pool.
+  :param num_results:             Number of results the pool reports for an item (see LeaseTracker).
+  :param poll_interval:           How long to wait before asking again when all items are leased by other workers.
+  :param heartbeat_interval:      How often to renew leases in seconds, has to be shorter than the lease timeout of
+                                  the coordinator.
+  :param max_connection_errors:   Give up after this many consecutive failed requests to the coordinator.
+  :return:                        None.
+  """
+
+  tracker = LeaseTracker(client, num_results=num_results, heartbeat_interval=heartbeat_interval)
+  pool.result_counter.listener = tracker.on_result
+  tracker.start()
+
+  num_errors = 0
+
+  try:
+    while True:
+      tracker.wait(max_leases)
+
+      try:
+        lease_id, items, finished = client.lease(lease_size)
+        num_errors = 0
+      except (OSError, http.client.HTTPException) as error:
+        num_errors += 1
+
+        if num_errors >= max_connection_errors:
+          print("giving up on the coordinator: {}".format(error))
+          break
+
+        time.sleep(poll_interval)
+        continue
+
+      if lease_id is None:
+        if finished:
+          break
+
+        # the rest is leased by other workers, their leases might still expire
+        time.sleep(poll_interval)
+        continue
+
+      tracker.add(lease_id, items)
+
+      # blocks while the local queue is full, the leases are renewed in the meantime
+      pool.videos_queue.put_many([tuple(item) for item in items])
+  finally:
+    tracker.stop()
@@ -0,0 +1,73 @@
+import os, shutil, time
+
+DEFAULT_CHECK_INTERVAL = 5.0
+
+class DiskSpaceGuard:
+  """
+  Pauses a worker while any of the watched volumes has less free space than a threshold.
+  """
+
+  def __init__(self, paths, min_free_space, check_interval=DEFAULT_CHECK_INTERVAL):
+    """
+    :param paths:             Directories on the watched volumes.
+    :param min_free_space:    Minimum free space in bytes.
+    :param check_interval:    How often to check the free space while paused, in seconds.
+    """
+
+    self.paths = sorted(set(paths))
+    self.min_free_space = min_free_space
+    self.check_interval = check_interval
+
+  def find_full_volume(self):
+    """
+    Find a watched volume with too little free space.
+    :return:    Tuple: the directory and its free space in bytes, None if there is enough space everywhere.
+    """
+
+    for path in self.paths:
+      free_space = get_free_space(path)
+
+      if free_space is not None and free_space < self.min_free_space:
+        return path, free_space
+
+    return None
+
+  def wait(self):
+    """
+    Wait until all watched volumes have enough free space.
+    :return:    Time spent waiting in seconds.
+    """
+
+    full_volume = self.find_full_volume()
+
+    if full_volume is None:
+      return 0.0
+
+    print("pausing: only {:.1f} MB free on the volume of {}".format(full_volume[1] / 1024 ** 2, full_volume[0]))
+    start_time = time.time()
+
+    while full_volume is not None:
+      time.sleep(self.check_interval)
+      full_volume = self.find_full_volume()
+
+    waited = time.time() - start_time
+    print("resuming after {:.0f}s".format(waited))
+
+    return waited
+
+def get_free_space(path):
+  """
+  Get the free space on the volume of a directory.
+  :param path:    The directory, its closest existing parent is used if it does not exist.
+  :return:        Free space in bytes, None if it cannot be determined.
+  """
+
+  path = os.path.abspath(path)
+
+  while not os.path.exists(path) and os.path.dirname(path) != path:
+    path = os.path.dirname(path)
+
+  try:
+    return shutil.disk_usage(path).free
+  except OSError:
+    return None
@@ -1,45 +1,660 @@
-import os, subprocess
+import http.client, json, os, random, re, shutil, socket, subprocess, threading, time
+import urllib.parse
+
+import lib.autotune as autotune
+import lib.constants as constants
+import lib.supervisor as supervisor
+
+VIDEO_URL = "https://youtube.com/watch?v={}"
+
+# timeout of each network operation of the fetchers that download in-process, in seconds
+SOCKET_TIMEOUT = 60
+# error output of downloads stopped by Fetcher.cancel, not worth retrying
+CANCELLED_ERROR = "ERROR: download cancelled\n"
+
+# youtube-dl errors of videos that will never be available
+PERMANENT_ERROR_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+  r"video unavailable", r"video is unavailable", r"private video", r"video is private", r"has been removed",
+  r"account .* (terminated|closed)", r"copyright", r"not available in your country", r"blocked it",
+  r"confirm your age", r"members-only", r"incomplete youtube id", r"unsupported url", r"video does not exist"
+]]
+
+# youtube-dl errors that might disappear when retried later
+TRANSIENT_ERROR_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+  r"http error 429", r"too many requests", r"http error 5\d\d", r"timed out", r"connection (reset|refused|aborted)",
+  r"temporary failure in name resolution", r"urlopen error", r"unable to download webpage", r"incompleteread",
+  r"giving up after", r"remote end closed connection"
+]]
+
+# codecs whose stream-copied part can be joined to a part re-encoded by the encoders below
+SPLICE_VIDEO_CODECS = ["h264"]
+SPLICE_AUDIO_CODECS = ["aac", None]
+SPLICE_VIDEO_ENCODER = "libx264"
+SPLICE_AUDIO_ENCODER = "aac"
+# H.264 profiles reported by ffprobe and the matching libx264 profiles
+SPLICE_PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high",
+                   "High 10": "high10", "High 4:2:2": "high422", "High 4:4:4 Predictive": "high444"}
+# stream parameters that have to be the same in the re-encoded and the copied part of a splice, the joined slice only
+# has one set of them
+SPLICE_PARAMS = ["codec_name", "profile", "level", "pix_fmt", "width", "height"]
+
+def classify_failure(return_code, stderr):
+  """
+  Decide if a failed download is worth retrying based on the exit status and the error output of youtube-dl.
+  :param return_code:     Exit status of youtube-dl.
+  :param stderr:          Error output of youtube-dl.
+  :return:                constants.ERROR_PERMANENT if the video cannot be downloaded at all (e.g. it was removed),
+                          constants.ERROR_TRANSIENT if the download might succeed later (e.g. throttling),
+                          otherwise constants.ERROR_UNKNOWN.
+  """
+
+  if return_code < 0:
+    # killed by a signal
+    return constants.ERROR_TRANSIENT
+
+  for pattern in PERMANENT_ERROR_PATTERNS:
+    if pattern.search(stderr):
+      return constants.ERROR_PERMANENT
+
+  for pattern in TRANSIENT_ERROR_PATTERNS:
+    if pattern.search(stderr):
+      return constants.ERROR_TRANSIENT
+
+  return constants.ERROR_UNKNOWN
+
+def backoff_delay(attempt, backoff_base, backoff_max):
+  """
+  Compute a jittered exponential backoff delay.
+  :param attempt:         Number of the failed attempt, starting from 0.
+  :param backoff_base:    Delay after the first failed attempt in seconds.
+  :param backoff_max:     Maximum delay in seconds.
+  :return:                Delay in seconds.
+  """
+
+  return min(backoff_max, backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+class SubprocessFetcher:
+  """
+  Downloads each video by running a new youtube-dl process.
+  """
+
+  def __init__(self):
+
+    self.process = None
+    self.cancelled = False
+    self.lock = threading.Lock()
+
+  def fetch(self, video_id, download_path, format_spec):
+    """
+    Download a video.
+    :param video_id:        YouTube ID of the video.
+    :param download_path:   Where to save the video.
+    :param format_spec:     youtube-dl format selector.
+    :return:                Tuple: exit status and error output of youtube-dl.
+    """
+
+    with self.lock:
+      if self.cancelled:
+        return 1, CANCELLED_ERROR
+
+      self.process = subprocess.Popen(
+        ["youtube-dl", VIDEO_URL.format(video_id), "--quiet", "-f", format_spec, "--output", download_path,
+         "--no-continue"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    _, stderr = self.process.communicate()
+
+    with self.lock:
+      return_code = self.process.returncode
+      self.process = None
+
+      if self.cancelled:
+        return 1, CANCELLED_ERROR
+
+    return return_code, stderr.decode(errors="replace")
+
+  def cancel(self):
+    """
+    Kill the running download (youtube-dl and the ffmpeg it started) and fail all further downloads. Can be called
+    from another thread.
+    :return:    None.
+    """
+
+    with self.lock:
+      self.cancelled = True
+
+      if self.process is not None:
+        supervisor.kill_process_tree(self.process.pid)
+
+  def close(self):
+    """
+    Release resources held by the fetcher.
+    :return:    None.
+    """
+    pass
+
+class YoutubeDLFetcher:
+  """
+  Downloads videos using the youtube-dl (or yt-dlp) Python API. A single YoutubeDL instance is kept for all videos, so
+  the extractors are imported once and HTTP connections and cached player data are reused between videos.
+  Falls back to SubprocessFetcher if the library is not installed or fails unexpectedly.
+  """
+
+  class Logger:
+    """
+    Collects error messages of YoutubeDL, so that failures can be classified the same way as for the subprocess.
+    """
+
+    def __init__(self):
+      self.messages = []
+
+    def debug(self, message):
+      pass
+
+    def info(self, message):
+      pass
+
+    def warning(self, message):
+      self.messages.append(message)
+
+    def error(self, message):
+      self.messages.append(message)
+
+  def __init__(self):
+
+    self.fallback = SubprocessFetcher()
+    self.logger = self.Logger()
+    self.ydl = None
+    self.download_error = None
+    self.yt_dlp = False
+    self.format_selectors = {}
+    self.cancelled = False
+
+    try:
+      import yt_dlp as library
+      self.yt_dlp = True
+    except ImportError:
+      try:
+        import youtube_dl as library
+      except ImportError:
+        print("youtube-dl library not found, falling back to the youtube-dl command")
+        return
+
+    self.download_error = library.utils.DownloadError
+    # a stalled download ends after the socket timeout, it cannot be cancelled
+    self.ydl = library.YoutubeDL({"quiet": True, "no_warnings": True, "noprogress": True, "continuedl": False,
+                                  "socket_timeout": SOCKET_TIMEOUT, "logger": self.logger})
+
+  def fetch(self, video_id, download_path, format_spec):
+    """
+    Download a video.
+    :param video_id:        YouTube ID of the video.
+    :param download_path:   Where to save the video.
+    :param format_spec:     youtube-dl format selector.
+    :return:                Tuple: exit status (0 for success) and error messages.
+    """
+
+    if self.cancelled:
+      return 1, CANCELLED_ERROR
+
+    if self.ydl is None:
+      return self.fallback.fetch(video_id, download_path, format_spec)
+
+    self.logger.messages = []
+
+    try:
+      self.set_format(format_spec)
+      self.ydl.params["outtmpl"] = {"default": download_path} if self.yt_dlp else download_path
+      return_code = self.ydl.download([VIDEO_URL.format(video_id)])
+    except self.download_error:
+      return_code = 1
+    except Exception:
+      # unexpected failure of the library, use the command line tool for this video
+      return self.fallback.fetch(video_id, download_path, format_spec)
+
+    return return_code, "\n".join(self.logger.messages)
+
+  def set_format(self, format_spec):
+    """
+    Select the formats of the next download.
+    youtube-dl parses the format selector for every video, but yt-dlp parses it only once when YoutubeDL is created,
+    so the parsed selector of each format selector is cached and swapped in.
+    :param format_spec:     youtube-dl format selector.
+    :return:                None.
+    """
+
+    self.ydl.params["format"] = format_spec
+
+    if self.yt_dlp:
+      if format_spec not in self.format_selectors:
+        self.format_selectors[format_spec] = self.ydl.build_format_selector(format_spec)
+
+      self.ydl.format_selector = self.format_selectors[format_spec]
+
+  def cancel(self):
+    """
+    Fail all further downloads and kill a running download of the command line tool. A running download of the
+    library cannot be interrupted, it ends at the latest when its socket times out. Can be called from another thread.
+    :return:    None.
+    """
+
+    self.cancelled = True
+    self.fallback.cancel()
+
+  def close(self):
+    """
+    Release resources held by the fetcher.
+    :return:    None.
+    """
+
+    if self.ydl is not None and hasattr(self.ydl, "close"):
+      self.ydl.close()
+
+class HTTPFetcher:
+  """
+  Downloads videos from a plain HTTP server that serves them under /videos/<id>.mp4 (see mock_service). Used to test
+  and benchmark the download pipeline without YouTube. The connection is kept alive between videos.
+  """
+
+  def __init__(self, base_url, timeout=SOCKET_TIMEOUT):
+    """
+    :param base_url:    URL of the server (e.g. http://127.0.0.1:8000).
+    :param timeout:     Socket timeout in seconds.
+    """
+
+    url = urllib.parse.urlsplit(base_url)
+
+    if url.scheme != "http" or not url.hostname:
+      raise ValueError("Invalid fetcher URL.")
+
+    self.host = url.hostname
+    self.port = url.port
+    self.path = url.path.rstrip("/")
+    self.timeout = timeout
+    self.connection = None
+    self.cancelled = False
+    self.lock = threading.Lock()
+
+  def fetch(self, video_id, download_path, format_spec):
+    """
+    Download a video.
+    :param video_id:        YouTube ID of the video.
+    :param download_path:   Where to save the video.
+    :param format_spec:     youtube-dl format selector, ignored.
+    :return:                Tuple: exit status (0 for success) and error messages in the format of youtube-dl.
+    """
+
+    try:
+      with self.lock:
+        if self.cancelled:
+          return 1, CANCELLED_ERROR
+
+        if self.connection is None:
+          self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        # connected here, so that cancel can always shut the socket down
+        if self.connection.sock is None:
+          self.connection.connect()
+
+      self.connection.request("GET", "{}/videos/{}.mp4".format(self.path, urllib.parse.quote(video_id)))
+      response = self.connection.getresponse()
+
+      if response.status == 404:
+        response.read()
+        return 1, "ERROR: Video unavailable\n"
+
+      if response.status != 200:
+        response.read()
+        return 1, "ERROR: unable to download video data: HTTP Error {:d}: {}\n".format(response.status,
+                                                                                       response.reason)
+
+      with open(download_path, "wb") as file:
+        shutil.copyfileobj(response, file)
+
+      if self.cancelled:
+        raise OSError("cancelled")
+    except (OSError, http.client.HTTPException) as error:
+      # start with a fresh connection next time
+      self.close()
 
-def download_video(video_id, download_path, video_format="mp4", log_file=None):
+      if os.path.isfile(download_path):
+        os.remove(download_path)
+
+      if self.cancelled:
+        return 1, CANCELLED_ERROR
+
+      return 1, "ERROR: Unable to download webpage: {}\n".format(error)
+
+    return 0, ""
+
+  def cancel(self):
+    """
+    Stop the running download by shutting its socket down and fail all further downloads. Can be called from another
+    thread.
+    :return:    None.
+    """
+
+    with self.lock:
+      self.cancelled = True
+
+      if self.connection is not None and self.connection.sock is not None:
+        try:
+          self.connection.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+          pass
+
+  def close(self):
+    """
+    Close the connection.
+    :return:    None.
+    """
+
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
+
+def get_fetcher(name, url=None):
+  """
+  Create a video fetcher.
+  :param name:    Name of the fetcher (constants.FETCHER_*).
+  :param url:     URL of the video server, required by constants.FETCHER_HTTP.
+  :return:        The fetcher.
+  """
+
+  if name == constants.FETCHER_SUBPROCESS:
+    return SubprocessFetcher()
+  elif name == constants.FETCHER_API:
+    return YoutubeDLFetcher()
+  elif name == constants.FETCHER_HTTP:
+    if url is None:
+      raise ValueError("The HTTP fetcher requires a URL.")
+    return HTTPFetcher(url)
+  else:
+    raise ValueError("Invalid fetcher.")
+
+def get_format_spec(video_format="mp4", target_resolution=None, audio_only=False):
+  """
+  Build a youtube-dl format selector.
+  :param video_format:        Preferred container of the video stream.
+  :param target_resolution:   Minimum length of the shorter side of the video in pixels. The smallest format that
+                              meets it is selected. None selects the best format.
+  :param audio_only:          Download only the sound track.
+  :return:                    The format selector.
+  """
+
+  if audio_only:
+    return "bestaudio[ext=m4a]/bestaudio/best"
+
+  if target_resolution is None:
+    return "bestvideo[ext={}]+bestaudio/best".format(video_format)
+
+  # both sides have to meet the target, so that it works for portrait videos too
+  size_filter = "[height>={0:d}][width>={0:d}]".format(target_resolution)
+
+  return "/".join([
+    "worstvideo{}[ext={}]+bestaudio".format(size_filter, video_format),
+    "worstvideo{}+bestaudio".format(size_filter),
+    "worst{}".format(size_filter),
+    # the video is smaller than the target
+    "bestvideo[ext={}]+bestaudio".format(video_format),
+    "best"
+  ])
+
+def download_video(video_id, download_path, video_format="mp4", log_file=None, retries=0, backoff_base=5.0,
+                   backoff_max=300.0, rate_limiter=None, fetcher=None, target_resolution=None, audio_only=False,
+                   cancelled=None):
   """
   Download video from YouTube.
   :param video_id:        YouTube ID of the video.
   :param download_path:   Where to save the video.
   :param video_format:    Format to download.
   :param log_file:        Path to a log file for youtube-dl.
-  :return:                Tuple: path to the downloaded video and a bool indicating success.
+  :param retries:         How many times to retry transient failures.
+  :param backoff_base:    Delay before the first retry in seconds, the delay doubles with every retry.
+  :param backoff_max:     Maximum delay between retries in seconds.
+  :param rate_limiter:    Rate limiter shared by all download workers (see rate_limit.RateLimiter).
+  :param fetcher:         Video fetcher (see get_fetcher), a youtube-dl process is started for each video by default.
+  :param target_resolution:   Download the smallest format whose shorter side has at least this many pixels.
+  :param audio_only:          Download only the sound track.
+  :param cancelled:           Event that stops retrying once it is set, the caller cancels the running fetch (see
+                              SubprocessFetcher.cancel).
+  :return:                Tuple: bool indicating success and the class of the error (None if successful).
   """
 
-  if log_file is None:
-    stderr = subprocess.DEVNULL
-  else:
-    stderr = open(log_file, "a")
+  if fetcher is None:
+    fetcher = SubprocessFetcher()
 
-  return_code = subprocess.call(
-    ["youtube-dl", "https://youtube.com/watch?v={}".format(video_id), "--quiet", "-f",
-     "bestvideo[ext={}]+bestaudio/best".format(video_format), "--output", download_path, "--no-continue"], stderr=stderr)
-  success = return_code == 0
+  format_spec = get_format_spec(video_format, target_resolution=target_resolution, audio_only=audio_only)
+  attempt = 0
+
+  while True:
+    if rate_limiter is not None:
+      rate_limiter.acquire()
+
+    return_code, stderr = fetcher.fetch(video_id, download_path, format_spec)
+
+    if log_file is not None and stderr:
+      with open(log_file, "a") as file:
+        file.write(stderr)
+
+    if return_code == 0:
+      return True, None
+
+    error = classify_failure(return_code, stderr)
 
-  if log_file is not None:
-    stderr.close()
+    if error != constants.ERROR_TRANSIENT or attempt >= retries:
+      return False, error
 
-  return success
+    delay = backoff_delay(attempt, backoff_base, backoff_max)
 
-def cut_video(raw_video_path, slice_path, start, end):
+    if cancelled is None:
+      time.sleep(delay)
+    elif cancelled.wait(delay):
+      return False, constants.ERROR_TIMEOUT
+
+    attempt += 1
+
+def cut_video(raw_video_path, slice_path, start, end, mode=constants.CUT_MODE_REENCODE):
   """
   Cut out the section of interest from a video.
   :param raw_video_path:    Path to the whole video.
   :param slice_path:        Where to save the slice.
   :param start:             Start of the section.
   :param end:               End of the section.
-  :return:                  Tuple: Path to the video slice and a bool indicating success.
+  :param mode:              Cut mode: constants.CUT_MODE_REENCODE decodes the video from the beginning and re-encodes
+                            the whole slice, constants.CUT_MODE_FAST seeks in the input and copies the streams whenever
+                            possible (see cut_video_fast).
+  :return:                  Tuple: bool indicating success and the cut path that was taken (constants.CUT_PATH_*).
   """
 
-  return_code = subprocess.call(["ffmpeg", "-loglevel", "quiet", "-i", raw_video_path, "-strict", "-2",
-                                 "-ss", str(start), "-to", str(end), slice_path])
+  if mode == constants.CUT_MODE_FAST:
+    return cut_video_fast(raw_video_path, slice_path, start, end)
+  elif mode != constants.CUT_MODE_REENCODE:
+    raise ValueError("Invalid cut mode.")
+
+  threads = autotune.ffmpeg_threads()
+  return_code = subprocess.call(["ffmpeg", "-loglevel", "quiet"] + threads + ["-i", raw_video_path, "-strict", "-2",
+                                 "-ss", str(start), "-to", str(end)] + threads + [slice_path])
   success = return_code == 0
 
-  return success
+  return success, constants.CUT_PATH_REENCODE
+
+def probe_streams(video_path):
+  """
+  Read the parameters of the streams of a video.
+  :param video_path:    Path to the video.
+  :return:              List of dictionaries of ffprobe stream entries (codec_type, codec_name, avg_frame_rate, profile,
+                        level, pix_fmt, width and height). None if probing failed.
+  """
+
+  try:
+    output = subprocess.check_output(
+      ["ffprobe", "-loglevel", "quiet", "-print_format", "json", "-show_entries",
+       "stream=codec_type,codec_name,avg_frame_rate,profile,level,pix_fmt,width,height", video_path])
+  except subprocess.CalledProcessError:
+    return None
+
+  return json.loads(output.decode()).get("streams", [])
+
+def probe_keyframes(video_path, start, end):
+  """
+  Find the streams, frame rate and video keyframes of the section of interest.
+  Only packet headers are read, the video is not decoded.
+  :param video_path:    Path to the video.
+  :param start:         Start of the section.
+  :param end:           End of the section.
+  :return:              Tuple: video stream (see probe_streams), audio codec (None if there is no audio), frame rate and
+                        a sorted list of keyframe timestamps. None if probing failed.
+  """
+
+  try:
+    output = subprocess.check_output(
+      ["ffprobe", "-loglevel", "quiet", "-print_format", "json", "-select_streams", "v:0",
+       "-show_entries", "packet=pts_time,flags", "-read_intervals", "{:f}%{:f}".format(start, end), video_path])
+  except subprocess.CalledProcessError:
+    return None
+
+  streams = probe_streams(video_path)
+
+  if streams is None:
+    return None
+
+  packets = json.loads(output.decode()).get("packets", [])
+
+  video_stream = None
+  audio_codec = None
+  frame_rate = None
+
+  for stream in streams:
+    if stream.get("codec_type") == "video" and video_stream is None:
+      video_stream = stream
+      numerator, denominator = stream.get("avg_frame_rate", "0/0").split("/")
+      if int(denominator) > 0 and int(numerator) > 0:
+        frame_rate = int(numerator) / int(denominator)
+    elif stream.get("codec_type") == "audio" and audio_codec is None:
+      audio_codec = stream.get("codec_name")
+
+  if video_stream is None or frame_rate is None:
+    return None
+
+  keyframes = sorted(float(packet["pts_time"]) for packet in packets
+                     if "K" in packet.get("flags", "") and packet.get("pts_time", "N/A") != "N/A")
+
+  return video_stream, audio_codec, frame_rate, keyframes
+
+def can_splice(video_stream, audio_codec):
+  """
+  Decide if the head of a section of a video can be re-encoded with the same stream parameters as the rest of it.
+  :param video_stream:  Video stream of the video (see probe_streams).
+  :param audio_codec:   Audio codec of the video, None if there is no audio.
+  :return:              True if the video can be spliced.
+  """
+
+  return video_stream.get("codec_name") in SPLICE_VIDEO_CODECS and audio_codec in SPLICE_AUDIO_CODECS and \
+         video_stream.get("profile") in SPLICE_PROFILES and video_stream.get("level", 0) > 0 and \
+         video_stream.get("pix_fmt") is not None
+
+def cut_video_fast(raw_video_path, slice_path, start, end):
+  """
+  Cut out the section of interest by seeking in the input and copying the streams.
+  If the section starts on a keyframe, the whole section is stream-copied. Otherwise, only the partial GOP before the
+  first keyframe of the section is re-encoded with the profile, level and pixel format of the video, and the rest is
+  stream-copied and concatenated to it. If neither is possible (e.g. the section contains no keyframe, the codec cannot
+  be spliced or the re-encoded part does not match the rest), the section is re-encoded with input seeking, which is
+  still frame-accurate and much faster than decoding the video from its beginning.
+  :param raw_video_path:    Path to the whole video.
+  :param slice_path:        Where to save the slice.
+  :param start:             Start of the section.
+  :param end:               End of the section.
+  :return:                  Tuple: bool indicating success and the cut path that was taken (constants.CUT_PATH_*).
+  """
+
+  probe = probe_keyframes(raw_video_path, start, end)
+
+  if probe is not None:
+    video_stream, audio_codec, frame_rate, keyframes = probe
+    tolerance = 0.5 / frame_rate
+
+    # the section starts on a keyframe => copy everything
+    if any(abs(keyframe - start) <= tolerance for keyframe in keyframes):
+      return ffmpeg_slice(raw_video_path, slice_path, start, end, copy=True), constants.CUT_PATH_COPY
+
+    # re-encode the head of the section up to its first keyframe and copy the rest
+    next_keyframes = [keyframe for keyframe in keyframes if start + tolerance < keyframe < end - tolerance]
+
+    if len(next_keyframes) > 0 and can_splice(video_stream, audio_codec) and \
+        splice_video(raw_video_path, slice_path, start, next_keyframes[0], end, video_stream):
+      return True, constants.CUT_PATH_SPLICE
+
+  return ffmpeg_slice(raw_video_path, slice_path, start, end, copy=False), constants.CUT_PATH_REENCODE
+
+def ffmpeg_slice(video_path, slice_path, start, end, copy, video_stream=None):
+  """
+  Cut a section of a video using input seeking.
+  :param video_path:        Path to the video.
+  :param slice_path:        Where to save the slice.
+  :param start:             Start of the section.
+  :param end:               End of the section.
+  :param copy:              Copy the streams instead of re-encoding them.
+  :param video_stream:      Video stream (see probe_streams) whose profile, level and pixel format to re-encode with,
+                            None for the defaults of the encoder.
+  :return:                  Bool indicating success.
+  """
+
+  threads = autotune.ffmpeg_threads()
+  cmd = ["ffmpeg", "-loglevel", "quiet", "-y", "-ss", str(start)] + threads + ["-i", video_path, "-t", str(end - start)]
+
+  if copy:
+    cmd += ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+  else:
+    cmd += ["-c:v", SPLICE_VIDEO_ENCODER, "-c:a", SPLICE_AUDIO_ENCODER, "-strict", "-2"] + threads
+
+    if video_stream is not None:
+      cmd += ["-profile:v", SPLICE_PROFILES[video_stream["profile"]], "-level", str(video_stream["level"]),
+              "-pix_fmt", video_stream["pix_fmt"]]
+
+  return subprocess.call(cmd + [slice_path]) == 0
+
+def splice_video(video_path, slice_path, start, keyframe, end, video_stream):
+  """
+  Re-encode a section of a video up to a keyframe, copy the rest of the section and join both parts.
+  The joined slice keeps only one set of codec parameters, so the re-encoded part is checked to match the video stream
+  before joining.
+  :param video_path:    Path to the video.
+  :param slice_path:    Where to save the slice.
+  :param start:         Start of the section.
+  :param keyframe:      Timestamp of the first keyframe in the section.
+  :param end:           End of the section.
+  :param video_stream:  Video stream of the video (see probe_streams).
+  :return:              Bool indicating success, False if the parts could not be joined.
+  """
+
+  head_path = "{}.head.mp4".format(slice_path)
+  tail_path = "{}.tail.mp4".format(slice_path)
+  list_path = "{}.concat.txt".format(slice_path)
+
+  try:
+    if not ffmpeg_slice(video_path, head_path, start, keyframe, copy=False, video_stream=video_stream):
+      return False
+
+    head_streams = probe_streams(head_path)
+    head_video = [stream for stream in head_streams or [] if stream.get("codec_type") == "video"]
+
+    if len(head_video) == 0 or any(head_video[0].get(key) != video_stream.get(key) for key in SPLICE_PARAMS):
+      return False
+
+    if not ffmpeg_slice(video_path, tail_path, keyframe, end, copy=True):
+      return False
+
+    with open(list_path, "w") as file:
+      for path in [head_path, tail_path]:
+        file.write("file '{}'\n".format(os.path.abspath(path)))
+
+    return subprocess.call(["ffmpeg", "-loglevel", "quiet", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                            "-c", "copy", slice_path]) == 0
+  finally:
+    for path in [head_path, tail_path, list_path]:
+      if os.path.isfile(path):
+        os.remove(path)
 
 def compress_video(video_path):
   """
@@ -49,23 +664,56 @@ def compress_video(video_path):
   """
   return subprocess.call(["gzip", video_path]) == 0
 
-def process_video(video_id, directory, start, end, video_format="mp4", compress=False, overwrite=False, log_file=None):
+def get_slice_path(video_id, directory, video_format="mp4"):
   """
-  Process one video for the kinetics dataset.
+  Get the path of a processed video.
+  :param video_id:        YouTube ID of the video.
+  :param directory:       Directory where the video is saved.
+  :param video_format:    Format of the processed video.
+  :return:                Path to the video slice.
+  """
+
+  return "{}.{}".format(os.path.join(directory, video_id), video_format)
+
+def get_raw_paths(video_id, directory, video_format="mp4"):
+  """
+  Get all paths a whole downloaded video can be saved to.
+  :param video_id:        YouTube ID of the video.
+  :param directory:       Directory where the video is saved.
+  :param video_format:    Format of the processed video.
+  :return:                List of paths, youtube-dl sometimes saves the video as mkv.
+  """
+
+  download_path = "{}_raw.{}".format(os.path.join(directory, video_id), video_format)
+  mkv_download_path = "{}_raw.mkv".format(os.path.join(directory, video_id))
+
+  return [download_path, mkv_download_path]
+
+def download_raw_video(video_id, directory, video_format="mp4", overwrite=False, log_file=None, retries=0,
+                       rate_limiter=None, fetcher=None, target_resolution=None, audio_only=False,
+                       scratch_directory=None, cancelled=None):
+  """
+  Download the whole video, so that the section of interest can be cut out of it later.
   :param video_id:        YouTube ID of the video.
   :param directory:       Directory where to save the video.
-  :param start:           Start of the section of interest.
-  :param end:             End of the section of interest.
   :param video_format:    Format of the processed video.
-  :param compress:        Decides if the video slice should be compressed by gzip.
   :param overwrite:       Overwrite processed videos.
   :param log_file:        Path to a log file for youtube-dl.
-  :return:                Bool indicating success.
+  :param retries:         How many times to retry transient download failures.
+  :param rate_limiter:    Rate limiter shared by all download workers (see rate_limit.RateLimiter).
+  :param fetcher:         Video fetcher (see get_fetcher).
+  :param target_resolution:   Download the smallest format whose shorter side has at least this many pixels.
+  :param audio_only:          Download only the sound track.
+  :param scratch_directory:   Where to save the whole video (e.g. a fast local volume), defaults to the directory
+                              of the processed video.
+  :param cancelled:           Event that stops retrying once it is set (see download_video).
+  :return:                Tuple: bool indicating success, path to the downloaded video and the class of the download
+                          error. The path is None if the video has already been processed or if the download failed.
   """
 
-  download_path = "{}_raw.{}".format(os.path.join(directory, video_id), video_format)
-  mkv_download_path = "{}_raw.mkv".format(os.path.join(directory, video_id))
-  slice_path = "{}.{}".format(os.path.join(directory, video_id), video_format)
+  raw_directory = scratch_directory if scratch_directory is not None else directory
+  download_path, mkv_download_path = get_raw_paths(video_id, raw_directory, video_format)
+  slice_path = get_slice_path(video_id, directory, video_format)
 
   # simply delete residual downloaded videos
   if os.path.isfile(download_path):
@@ -76,27 +724,55 @@ def process_video(video_id, directory, start, end, video_format="mp4", compress=
     if overwrite:
       os.remove(slice_path)
     else:
-      return True
+      return True, None, None
 
   # sometimes videos are downloaded as mkv
   if not os.path.isfile(mkv_download_path):
-    # download video and cut out the section of interest
-    success = download_video(video_id, download_path, log_file=log_file)
+    # download video
+    success, error = download_video(video_id, download_path, log_file=log_file, retries=retries,
+                                    rate_limiter=rate_limiter, fetcher=fetcher, target_resolution=target_resolution,
+                                    audio_only=audio_only, cancelled=cancelled)
 
     if not success:
-      return False
+      return False, None, error
 
   # video was downloaded as mkv instead of mp4
   if not os.path.isfile(download_path) and os.path.isfile(mkv_download_path):
     download_path = mkv_download_path
 
-  success = cut_video(download_path, slice_path, start, end)
+  if rate_limiter is not None and os.path.isfile(download_path):
+    rate_limiter.charge_bytes(os.path.getsize(download_path))
+
+  return True, download_path, None
+
+def cut_raw_video(video_id, download_path, slice_path, start, end, compress=False, cut_mode=constants.CUT_MODE_REENCODE,
+                  cut_log_file=None, remove_raw=True):
+  """
+  Cut out the section of interest from a downloaded video and remove the downloaded video.
+  :param video_id:        YouTube ID of the video.
+  :param download_path:   Path to the downloaded video.
+  :param slice_path:      Where to save the video slice.
+  :param start:           Start of the section of interest.
+  :param end:             End of the section of interest.
+  :param compress:        Decides if the video slice should be compressed by gzip.
+  :param cut_mode:        How to cut out the section of interest (see cut_video).
+  :param cut_log_file:    Path to a log file recording which cut path each video took.
+  :param remove_raw:      Remove the downloaded video, disable when more sections are cut out of it.
+  :return:                Bool indicating success.
+  """
+
+  success, cut_path = cut_video(download_path, slice_path, start, end, mode=cut_mode)
+
+  if cut_log_file is not None:
+    with open(cut_log_file, "a") as file:
+      file.write("{}\t{}\t{}\n".format(video_id, cut_path, "ok" if success else "failed"))
 
   if not success:
     return False
 
-  # remove the downloaded video
-  os.remove(download_path)
+  if remove_raw:
+    # remove the downloaded video
+    os.remove(download_path)
 
   if compress:
     # compress the video slice
@@ -104,11 +780,70 @@ def process_video(video_id, directory, start, end, video_format="mp4", compress=
 
   return True
 
-def download_class_sequential(class_name, videos_dict, directory, compress=False, log_file=None):
+def cut_sections(video_id, download_path, cuts, compress=False, cut_mode=constants.CUT_MODE_REENCODE,
+                 cut_log_file=None):
+  """
+  Cut out all sections of interest from one downloaded video and remove the downloaded video.
+  :param video_id:        YouTube ID of the video.
+  :param download_path:   Path to the downloaded video.
+  :param cuts:            List of (slice path, start, end, group name) tuples.
+  :param compress:        Decides if the video slices should be compressed by gzip.
+  :param cut_mode:        How to cut out the sections of interest (see cut_video).
+  :param cut_log_file:    Path to a log file recording which cut path each video took.
+  :return:                List of (success, duration in seconds) tuples, one for each cut.
+  """
+
+  results = []
+
+  for slice_path, start, end, _ in cuts:
+    start_time = time.time()
+    success = cut_raw_video(video_id, download_path, slice_path, start, end, compress=compress, cut_mode=cut_mode,
+                            cut_log_file=cut_log_file, remove_raw=False)
+    results.append((success, time.time() - start_time))
+
+  if os.path.isfile(download_path):
+    os.remove(download_path)
+
+  return results
+
+def process_video(video_id, directory, start, end, video_format="mp4", compress=False, overwrite=False, log_file=None,
+                  cut_mode=constants.CUT_MODE_REENCODE, cut_log_file=None, fetcher=None, target_resolution=None,
+                  audio_only=False):
+  """
+  Process one video for the kinetics dataset.
+  :param video_id:        YouTube ID of the video.
+  :param directory:       Directory where to save the video.
+  :param start:           Start of the section of interest.
+  :param end:             End of the section of interest.
+  :param video_format:    Format of the processed video.
+  :param compress:        Decides if the video slice should be compressed by gzip.
+  :param overwrite:       Overwrite processed videos.
+  :param log_file:        Path to a log file for youtube-dl.
+  :param cut_mode:        How to cut out the section of interest (see cut_video).
+  :param cut_log_file:    Path to a log file recording which cut path each video took.
+  :param fetcher:         Video fetcher (see get_fetcher).
+  :param target_resolution:   Download the smallest format whose shorter side has at least this many pixels.
+  :param audio_only:          Download only the sound track, the slice will not contain any video.
+  :return:                Bool indicating success.
+  """
+
+  success, download_path, _ = download_raw_video(video_id, directory, video_format=video_format, overwrite=overwrite,
+                                                 log_file=log_file, fetcher=fetcher,
+                                                 target_resolution=target_resolution, audio_only=audio_only)
+
+  if not success or download_path is None:
+    return success
+
+  slice_path = get_slice_path(video_id, directory, video_format)
+
+  return cut_raw_video(video_id, download_path, slice_path, start, end, compress=compress, cut_mode=cut_mode,
+                       cut_log_file=cut_log_file)
+
+def download_class_sequential(class_name, label_index, directory, compress=False, log_file=None):
   """
   Download all videos with the given label sequentially.
   :param class_name:      The label.
-  :param videos_dict:     Dataset metadata.
+  :param label_index:     Dataset metadata indexed by labels (see metadata.build_label_index).
   :param directory:       Directory where to save the videos.
   :param compress:        Decides if the video slice should be compressed by gzip.
   :param log_file:        Path to a log file for youtube-dl.
@@ -125,27 +860,23 @@ def download_class_sequential(class_name, videos_dict, directory, compress=False
     except FileExistsError:
       pass
 
-  for key in videos_dict.keys():
-    metadata = videos_dict[key]
-    annotations = metadata["annotations"]
-
-    if annotations["label"].lower() == class_name.lower():
-      start = annotations["segment"][0]
-      end = annotations["segment"][1]
-
-      if not process_video(key, class_dir, start, end, compress=compress, log_file=log_file):
-        failed_videos.append(key)
+  for video_id, start, end in label_index.get(class_name.lower(), []):
+    if not process_video(video_id, class_dir, start, end, compress=compress, log_file=log_file):
+      failed_videos.append(video_id)
 
   return failed_videos
 
-def download_class_parallel(class_name, videos_dict, directory, videos_queue):
+def plan_class_parallel(class_name, label_index, directory, skip_ids=None, skip_slices=None):
   """
-  Download all videos of the given class in parallel.
-  :param class_name:        Name of the class.
-  :param videos_dict:       Dictionary of all videos.
+  Plan the download of all videos of the given class, the videos are downloaded in parallel by parallel_download.Pool.
+  The class directory is not created.
+  :param class_name:        Name of the class. If None, plan all videos.
+  :param label_index:       All videos indexed by labels (see metadata.build_label_index).
   :param directory:         Where to save the videos.
-  :param videos_queue:      Videos queue for parallel download.
-  :return:                  None.
+  :param skip_ids:          Set of video ids that should not be downloaded.
+  :param skip_slices:       Set of (video id, slice path) tuples of sections that should not be cut again.
+  :return:                  Tuple: list of (video id, class directory, start, end) tuples and number of skipped
+                            videos.
   """
 
   if class_name is None:
@@ -153,19 +884,19 @@ def download_class_parallel(class_name, videos_dict, directory, videos_queue):
   else:
     class_dir = os.path.join(directory, class_name.replace(" ", "_"))
 
-  if not os.path.isdir(class_dir):
-    # when using multiple processes, the folder might have been already created (after the if was evaluated)
-    try:
-      os.mkdir(class_dir)
-    except FileExistsError:
-      pass
+  if class_name is None:
+    segments = (segment for label_segments in label_index.values() for segment in label_segments)
+  else:
+    segments = label_index.get(class_name.lower(), [])
 
-  for key in videos_dict.keys():
-    metadata = videos_dict[key]
-    annotations = metadata["annotations"]
+  planned = []
+  num_skipped = 0
 
-    if class_name is None or annotations["label"].lower() == class_name.lower():
-      start = annotations["segment"][0]
-      end = annotations["segment"][1]
+  for video_id, start, end in segments:
+    if (skip_ids is not None and video_id in skip_ids) or \
+        (skip_slices is not None and (video_id, get_slice_path(video_id, class_dir)) in skip_slices):
+      num_skipped += 1
+    else:
+      planned.append((video_id, class_dir, start, end))
 
-      videos_queue.put((key, class_dir, start, end))
+  return planned, num_skipped
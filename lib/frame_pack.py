@@ -0,0 +1,154 @@
+import mmap, os, struct, threading
+
+# file layout: header, the JPEG bytes of all frames back to back, offsets of the frames (one more than the number of
+# frames, the last one is the end of the last frame) and a footer that locates the offsets
+MAGIC = b"KFPK"
+VERSION = 1
+HEADER = struct.Struct("<4sI")
+# magic, version, number of frames, width, height, position of the offsets
+FOOTER = struct.Struct("<4sIIIIQ")
+OFFSET = struct.Struct("<Q")
+
+class PackWriter:
+  """
+  Writes the frames of a video into a single pack file. Frames can be added out of order (e.g. by several encode
+  threads), they are held until all frames before them are written.
+  """
+
+  def __init__(self, path):
+    """
+    :param path:    Where to save the pack.
+    """
+
+    self.path = path
+    self.file = open(path, "wb")
+    self.file.write(HEADER.pack(MAGIC, VERSION))
+
+    self.offsets = [HEADER.size]
+    self.pending = {}
+    self.lock = threading.Lock()
+
+  def write(self, index, data):
+    """
+    Add a frame.
+    :param index:   Number of the frame.
+    :param data:    JPEG bytes of the frame.
+    :return:        None.
+    """
+
+    with self.lock:
+      self.pending[index] = data
+
+      while len(self.offsets) - 1 in self.pending:
+        data = self.pending.pop(len(self.offsets) - 1)
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+  def close(self, num_frames, width, height):
+    """
+    Write the offsets and the footer and close the file.
+    :param num_frames:  Number of frames.
+    :param width:       Width of the frames.
+    :param height:      Height of the frames.
+    :return:            None.
+    """
+
+    if len(self.offsets) - 1 != num_frames or len(self.pending) > 0:
+      self.file.close()
+      raise ValueError("Missing frames in {}.".format(self.path))
+
+    index_offset = self.offsets[-1]
+
+    self.file.write(b"".join(OFFSET.pack(offset) for offset in self.offsets))
+    self.file.write(FOOTER.pack(MAGIC, VERSION, num_frames, width, height, index_offset))
+    self.file.close()
+
+  def abort(self):
+    """
+    Close the file without finishing it.
+    :return:    None.
+    """
+
+    self.file.close()
+
+class PackReader:
+  """
+  Reads single frames from a pack file: opening reads the footer and the offsets, each frame is then a single pread
+  or a slice of a memory map.
+  """
+
+  def __init__(self, path, use_mmap=False):
+    """
+    :param path:        Path to the pack.
+    :param use_mmap:    Map the whole file into memory instead of reading each frame with pread.
+    """
+
+    self.path = path
+    self.fd = os.open(path, os.O_RDONLY)
+    self.mmap = None
+
+    try:
+      size = os.fstat(self.fd).st_size
+
+      if size < HEADER.size + OFFSET.size + FOOTER.size:
+        raise ValueError("{} is not a frame pack.".format(path))
+
+      magic, version, self.num_frames, self.width, self.height, index_offset = FOOTER.unpack(
+        os.pread(self.fd, FOOTER.size, size - FOOTER.size))
+
+      index_size = (self.num_frames + 1) * OFFSET.size
+
+      if magic != MAGIC or version != VERSION or index_offset + index_size + FOOTER.size != size:
+        raise ValueError("{} is not a frame pack.".format(path))
+
+      index = os.pread(self.fd, index_size, index_offset)
+      self.offsets = struct.unpack("<{:d}Q".format(self.num_frames + 1), index)
+
+      if use_mmap:
+        self.mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+    except Exception:
+      os.close(self.fd)
+      raise
+
+  def __len__(self):
+
+    return self.num_frames
+
+  def __enter__(self):
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+
+    self.close()
+
+  def read_frame(self, index):
+    """
+    Read the JPEG bytes of a frame.
+    :param index:   Number of the frame.
+    :return:        The bytes.
+    """
+
+    if not 0 <= index < self.num_frames:
+      raise IndexError("Frame {:d} out of range, the pack has {:d} frames.".format(index, self.num_frames))
+
+    start, end = self.offsets[index], self.offsets[index + 1]
+
+    if self.mmap is not None:
+      return self.mmap[start:end]
+
+    return os.pread(self.fd, end - start, start)
+
+  def close(self):
+    """
+    Close the pack.
+    :return:    None.
+    """
+
+    if self.mmap is not None:
+      self.mmap.close()
+      self.mmap = None
+
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
@@ -0,0 +1,305 @@
+import io, json, os, socket, tarfile, time
+
+import lib.constants as constants
+import lib.utils as utils
+
+DEFAULT_SHARD_SIZE = 1024 ** 3
+SHARD_SUFFIX = ".tar"
+INDEX_SUFFIX = ".index.json"
+
+class ShardWriter:
+  """
+  Writes videos into WebDataset-style tar shards: the frames of a video are one sample, the files of a sample share
+  the video id as their key (<video id>.json with the label and the size of the frames, <video id>.frame000000.jpg,
+  ...). A shard is finished once it reaches the maximum size: its index sidecar (see read_index) is written and the
+  shard is renamed from its partial name, so incomplete shards are never mistaken for finished ones.
+  """
+
+  def __init__(self, directory, prefix, max_size=DEFAULT_SHARD_SIZE):
+    """
+    :param directory:   Where to save the shards.
+    :param prefix:      Prefix of the shard names, has to be unique for each writer (see get_shard_prefix).
+    :param max_size:    Size in bytes after which a shard is finished.
+    """
+
+    self.directory = directory
+    self.prefix = prefix
+    self.max_size = max_size
+
+    self.num_shards = 0
+    self.path = None
+    self.file = None
+    self.tar = None
+    self.samples = []
+    # samples of the finished shards not taken yet (see take_finished)
+    self.finished = []
+
+  def add_video(self, video_id, label, frames, width, height):
+    """
+    Append the frames of a video to the current shard.
+    :param video_id:    YouTube id of the video, the key of the sample.
+    :param label:       Label of the video, None if unknown (the test set).
+    :param frames:      List of the JPEG bytes of all frames.
+    :param width:       Width of the frames.
+    :param height:      Height of the frames.
+    :return:            None.
+    """
+
+    if self.tar is None:
+      self.open_shard()
+
+    start = self.file.tell()
+    info = {"video_id": video_id, "label": label, "num_frames": len(frames), "width": width, "height": height}
+
+    self.add_file("{}.json".format(video_id), json.dumps(info).encode())
+
+    for i, data in enumerate(frames):
+      self.add_file("{}.frame{:06d}.jpg".format(video_id, i), data)
+
+    # the offset and size let readers fetch a single video with one ranged read
+    info["offset"] = start
+    info["size"] = self.file.tell() - start
+    self.samples.append(info)
+
+    if self.file.tell() >= self.max_size:
+      self.finish_shard()
+
+  def add_file(self, name, data):
+    """
+    Append a file to the current shard.
+    :param name:    Name of the file.
+    :param data:    Its bytes.
+    :return:        None.
+    """
+
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    member.mtime = int(time.time())
+
+    self.tar.addfile(member, io.BytesIO(data))
+
+  def open_shard(self):
+    """
+    Start a new shard.
+    :return:    None.
+    """
+
+    name = "{}-{:06d}{}".format(self.prefix, self.num_shards, SHARD_SUFFIX)
+    self.path = os.path.join(self.directory, name)
+    self.num_shards += 1
+
+    os.makedirs(self.directory, exist_ok=True)
+
+    self.file = open(self.path + constants.PARTIAL_SUFFIX, "wb")
+    self.tar = tarfile.open(fileobj=self.file, mode="w", format=tarfile.USTAR_FORMAT)
+    self.samples = []
+
+  def finish_shard(self):
+    """
+    Close the current shard, write its index and give it its final name.
+    :return:    None.
+    """
+
+    self.tar.close()
+    self.file.close()
+    self.tar = None
+    self.file = None
+
+    utils.save_json(get_index_path(self.path), self.samples)
+    os.rename(self.path + constants.PARTIAL_SUFFIX, self.path)
+
+    self.finished += self.samples
+
+  def take_finished(self):
+    """
+    Take the samples of the shards finished since the last call, the videos are saved only once their shard has its
+    final name.
+    :return:    List of samples (see read_index) in the order they were added.
+    """
+
+    finished = self.finished
+    self.finished = []
+
+    return finished
+
+  def close(self):
+    """
+    Finish the current shard, if any.
+    :return:    None.
+    """
+
+    if self.tar is not None:
+      self.finish_shard()
+
+class SampleWriter:
+  """
+  Collects the frames of a video in memory and appends them to a shard once all of them were written, so that failed
+  videos leave nothing in the shard. Has the interface of the frames writers of video.video_to_jpgs.
+  """
+
+  def __init__(self, shard_writer, video_id, label):
+    """
+    :param shard_writer:  Writer of the shards.
+    :param video_id:      YouTube id of the video.
+    :param label:         Label of the video, None if unknown.
+    """
+
+    self.shard_writer = shard_writer
+    self.video_id = video_id
+    self.label = label
+    self.frames = {}
+
+  def write(self, index, data):
+    """
+    Add a frame.
+    :param index:   Number of the frame.
+    :param data:    JPEG bytes of the frame.
+    :return:        None.
+    """
+
+    self.frames[index] = data
+
+  def close(self, num_frames, width, height):
+    """
+    Append the video to the shard.
+    :param num_frames:  Number of frames.
+    :param width:       Width of the frames.
+    :param height:      Height of the frames.
+    :return:            None.
+    """
+
+    if sorted(self.frames.keys()) != list(range(num_frames)):
+      raise ValueError("Missing frames of {}.".format(self.video_id))
+
+    self.shard_writer.add_video(self.video_id, self.label, [self.frames[i] for i in range(num_frames)], width,
+                                height)
+    self.frames = {}
+
+  def abort(self):
+    """
+    Drop the frames.
+    :return:    None.
+    """
+
+    self.frames = {}
+
+def get_shard_prefix():
+  """
+  Get a shard name prefix unique to this process, so that workers, restarted workers and other machines never write
+  into the same shard.
+  :return:    The prefix.
+  """
+
+  return "{}-{:d}-{:d}".format(socket.gethostname(), int(time.time()), os.getpid())
+
+def is_stale(partial_path):
+  """
+  Check if a partial shard was left behind: it was written by a process of this machine that no longer runs.
+  :param partial_path:  Path to the partial shard.
+  :return:              True if the shard is stale, False if it might still be written (also by other machines).
+  """
+
+  name = os.path.basename(partial_path)
+  parts = name.rsplit("-", 3)
+
+  if len(parts) != 4 or parts[0] != socket.gethostname() or not parts[2].isdigit():
+    return False
+
+  try:
+    os.kill(int(parts[2]), 0)
+  except ProcessLookupError:
+    return True
+  except PermissionError:
+    pass
+
+  return False
+
+def remove_stale_shards(directory):
+  """
+  Remove the partial shards of a directory that are left behind by crashed workers of this machine (see is_stale),
+  together with their indexes if they were written before the crash.
+  :param directory:   The directory.
+  :return:            List of paths to the removed shards.
+  """
+
+  if not os.path.isdir(directory):
+    return []
+
+  removed = []
+
+  for name in os.listdir(directory):
+    path = os.path.join(directory, name)
+
+    if name.endswith(SHARD_SUFFIX + constants.PARTIAL_SUFFIX) and is_stale(path):
+      index_path = get_index_path(path[:-len(constants.PARTIAL_SUFFIX)])
+
+      if os.path.isfile(index_path):
+        os.remove(index_path)
+
+      os.remove(path)
+      removed.append(path)
+
+  return sorted(removed)
+
+def get_index_path(shard_path):
+  """
+  Get the path to the index sidecar of a shard.
+  :param shard_path:    Path to the shard.
+  :return:              Path to the index.
+  """
+
+  if shard_path.endswith(SHARD_SUFFIX):
+    shard_path = shard_path[:-len(SHARD_SUFFIX)]
+
+  return shard_path + INDEX_SUFFIX
+
+def read_index(shard_path):
+  """
+  Read the index of a shard.
+  :param shard_path:    Path to the shard.
+  :return:              List of samples: dictionaries with video_id, label, num_frames, width, height and the offset
+                        and size of the sample in the shard in bytes.
+  """
+
+  return utils.load_json(get_index_path(shard_path))
+
+def read_sample(shard_path, sample):
+  """
+  Read the files of a single video from a shard with one ranged read.
+  :param shard_path:    Path to the shard.
+  :param sample:        The video in the index of the shard (see read_index).
+  :return:              Dictionary of the file names of the sample and their bytes.
+  """
+
+  with open(shard_path, "rb") as file:
+    file.seek(sample["offset"])
+    data = file.read(sample["size"])
+
+  files = {}
+
+  with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tar:
+    for member in tar:
+      files[member.name] = tar.extractfile(member).read()
+
+  return files
+
+def find_shards(directory):
+  """
+  Find all finished shards in a directory.
+  :param directory:   The directory.
+  :return:            Sorted list of paths to the shards.
+  """
+
+  if not os.path.isdir(directory):
+    return []
+
+  return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SHARD_SUFFIX))
+
+def get_finished_ids(directory):
+  """
+  Collect the videos in the finished shards of a directory.
+  :param directory:   The directory.
+  :return:            Set of video ids.
+  """
+
+  return {sample["video_id"] for shard_path in find_shards(directory) for sample in read_index(shard_path)}
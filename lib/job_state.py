@@ -0,0 +1,257 @@
+import os, sqlite3, time
+
+import lib.constants as constants
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+# how many records to write in a single transaction
+COMMIT_EVERY = 100
+
+COLUMNS = ["video_id", "stage", "target", "status", "attempts", "error", "bytes", "duration", "updated"]
+
+class JobLedger:
+  """
+  SQLite database recording the state of each video in each processing stage. A stage can record a video separately
+  for each of its targets (e.g. the slices of a video that appears in several classes).
+  """
+
+  def __init__(self, path):
+    """
+    :param path:    Path to the database file, created if it does not exist.
+    """
+
+    directory = os.path.dirname(path)
+
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory, exist_ok=True)
+
+    self.path = path
+    self.connection = sqlite3.connect(path, timeout=60)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+
+    if len(columns) > 0 and "target" not in columns:
+      self.add_targets()
+
+    self.create_table()
+    self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, stage)")
+    self.connection.commit()
+
+  def create_table(self):
+    """
+    Create the table of job states if it does not exist. Stages that do not record targets use an empty target.
+    :return:    None.
+    """
+
+    self.connection.execute(
+      "CREATE TABLE IF NOT EXISTS jobs ("
+      "video_id TEXT NOT NULL, stage TEXT NOT NULL, target TEXT NOT NULL DEFAULT '', status TEXT NOT NULL, "
+      "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, bytes INTEGER, duration REAL, updated REAL, "
+      "PRIMARY KEY (video_id, stage, target))")
+
+  def add_targets(self):
+    """
+    Upgrade a database written before targets were recorded, its records get an empty target.
+    :return:    None.
+    """
+
+    old_columns = ", ".join(column for column in COLUMNS if column != "target")
+
+    self.connection.execute("ALTER TABLE jobs RENAME TO old_jobs")
+    self.connection.execute("DROP INDEX IF EXISTS jobs_status")
+    self.create_table()
+    self.connection.execute("INSERT INTO jobs ({0}) SELECT {0} FROM old_jobs".format(old_columns))
+    self.connection.execute("DROP TABLE old_jobs")
+    self.connection.commit()
+
+  def record(self, video_id, stage, status, error=None, num_bytes=None, duration=None, target=None, commit=True):
+    """
+    Record an attempt to process a video.
+    :param video_id:      YouTube ID of the video.
+    :param stage:         Processing stage (constants.STAGE_*).
+    :param status:        Outcome of the attempt (constants.JOB_STATUS_*).
+    :param error:         Class of the error if the attempt failed.
+    :param num_bytes:     Size of the produced file.
+    :param duration:      How long the attempt took in seconds.
+    :param target:        Target of the video in the stage (e.g. the path to a slice), None if the stage processes
+                          each video once.
+    :param commit:        Commit the transaction.
+    :return:              None.
+    """
+
+    self.connection.execute(
+      "INSERT INTO jobs (video_id, stage, target, status, attempts, error, bytes, duration, updated) "
+      "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?) "
+      "ON CONFLICT (video_id, stage, target) DO UPDATE SET status = excluded.status, attempts = attempts + 1, "
+      "error = excluded.error, bytes = excluded.bytes, duration = excluded.duration, updated = excluded.updated",
+      (video_id, stage, target or "", status, error, num_bytes, duration, time.time()))
+
+    if commit:
+      self.connection.commit()
+
+  def commit(self):
+    """
+    Commit recorded attempts.
+    :return:    None.
+    """
+
+    self.connection.commit()
+
+  def get(self, video_id, stage, target=None):
+    """
+    Get the state of a video in a processing stage.
+    :param video_id:    YouTube ID of the video.
+    :param stage:       Processing stage.
+    :param target:      Target of the video in the stage, None if the stage processes each video once.
+    :return:            Dictionary with the state of the video or None if the video was never processed.
+    """
+
+    row = self.connection.execute(
+      "SELECT status, attempts, error, bytes, duration, updated FROM jobs "
+      "WHERE video_id = ? AND stage = ? AND target = ?", (video_id, stage, target or "")).fetchone()
+
+    if row is None:
+      return None
+
+    return dict(zip(["status", "attempts", "error", "bytes", "duration", "updated"], row))
+
+  def finished_ids(self, final_stage, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Find videos that do not need to be processed again: videos that completed the final stage and videos that failed
+    permanently or too many times in any stage.
+    :param final_stage:     The last processing stage.
+    :param max_attempts:    Maximum number of failed attempts.
+    :return:                Set of video ids.
+    """
+
+    cursor = self.connection.execute(
+      "SELECT video_id FROM jobs WHERE (status = ? AND stage = ?) OR status = ? OR (status = ? AND attempts >= ?)",
+      (constants.JOB_STATUS_DONE, final_stage, constants.JOB_STATUS_PERMANENT, constants.JOB_STATUS_FAILED,
+       max_attempts))
+
+    return {row[0] for row in cursor}
+
+  def finished_targets(self, final_stage, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Find the targets that do not need to be processed again when the final stage records each target of a video:
+    targets that completed the final stage or failed in it permanently or too many times, and all targets of videos
+    that failed permanently or too many times in an earlier stage.
+    :param final_stage:     The last processing stage.
+    :param max_attempts:    Maximum number of failed attempts.
+    :return:                Tuple: set of (video id, target) tuples and set of ids of videos whose targets are all
+                            finished.
+    """
+
+    finished = (constants.JOB_STATUS_DONE, constants.JOB_STATUS_PERMANENT, constants.JOB_STATUS_FAILED, max_attempts)
+
+    cursor = self.connection.execute(
+      "SELECT video_id, target FROM jobs WHERE stage = ? AND target != '' "
+      "AND (status = ? OR status = ? OR (status = ? AND attempts >= ?))", (final_stage,) + finished)
+    targets = {(row[0], row[1]) for row in cursor}
+
+    # records of the final stage written before targets were recorded stand for all targets of the video
+    cursor = self.connection.execute(
+      "SELECT video_id FROM jobs WHERE (stage != ? OR target = '') "
+      "AND ((status = ? AND stage = ?) OR status = ? OR (status = ? AND attempts >= ?))",
+      (final_stage, constants.JOB_STATUS_DONE, final_stage) + finished[1:])
+    video_ids = {row[0] for row in cursor}
+
+    return targets, video_ids
+
+  def merge(self, path):
+    """
+    Add the records of another database (e.g. written by another shard). The newer record of a video wins.
+    :param path:    Path to the other database.
+    :return:        None.
+    """
+
+    # upgrade the other database if it was written before targets were recorded
+    JobLedger(path).close()
+
+    self.connection.commit()
+    self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+
+    try:
+      # the WHERE clause is required by the SQLite parser to disambiguate ON CONFLICT
+      self.connection.execute(
+        "INSERT INTO jobs ({0}) SELECT {0} FROM other.jobs WHERE true "
+        "ON CONFLICT (video_id, stage, target) DO UPDATE SET status = excluded.status, attempts = excluded.attempts, "
+        "error = excluded.error, bytes = excluded.bytes, duration = excluded.duration, updated = excluded.updated "
+        "WHERE excluded.updated > jobs.updated".format(", ".join(COLUMNS)))
+      self.connection.commit()
+    finally:
+      self.connection.execute("DETACH DATABASE other")
+
+  def count(self):
+    """
+    Count the records.
+    :return:    Number of (video, stage, target) records.
+    """
+
+    return self.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+  def close(self):
+    """
+    Close the database.
+    :return:    None.
+    """
+
+    self.connection.commit()
+    self.connection.close()
+
+def state_worker(state_queue, state_db):
+  """
+  Write job states into the database. A single writer process avoids lock contention between workers.
+  :param state_queue:     Queue of (video id, stage, status, error, bytes, duration, target) tuples.
+  :param state_db:        Path to the database.
+  :return:                None.
+  """
+
+  ledger = JobLedger(state_db)
+  uncommitted = 0
+
+  while True:
+    record = state_queue.get()
+
+    if record is None:
+      break
+
+    ledger.record(*record, commit=False)
+    uncommitted += 1
+
+    if uncommitted >= COMMIT_EVERY or state_queue.empty():
+      ledger.commit()
+      uncommitted = 0
+
+  ledger.close()
+
+def put_state(state_queue, video_id, stage, status, error=None, num_bytes=None, duration=None, target=None):
+  """
+  Send a job state to the job state writer.
+  :param state_queue:     Queue of job states, None if job states are not recorded.
+  :param video_id:        YouTube ID of the video.
+  :param stage:           Processing stage.
+  :param status:          Outcome of the attempt.
+  :param error:           Class of the error if the attempt failed.
+  :param num_bytes:       Size of the produced file.
+  :param duration:        How long the attempt took in seconds.
+  :param target:          Target of the video in the stage, None if the stage processes each video once.
+  :return:                None.
+  """
+
+  if state_queue is not None:
+    state_queue.put((video_id, stage, status, error, num_bytes, duration, target))
+
+def file_size(path):
+  """
+  Get the size of a file.
+  :param path:    Path to the file.
+  :return:        Size in bytes or None if the file does not exist.
+  """
+
+  if path is not None and os.path.isfile(path):
+    return os.path.getsize(path)
+
+  return None
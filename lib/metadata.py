@@ -1,10 +1,12 @@
 import os
 
+import lib.constants as constants
+
 
 def get_valid_videos(videos, root, class_dirs=True):
   """
   Go through a list of videos and find all downloaded videos.
-  :param videos:        The list of video metadata.
+  :param videos:        Dataset metadata (see metadata_cache.load).
   :param root:          Videos root.
   :param class_dirs:    Expect videos to be located in folders named after their classes (e.g. jogging/0123.mp4).
   :return:              List of valid video ids for each class.
@@ -12,10 +14,9 @@ def get_valid_videos(videos, root, class_dirs=True):
 
   valid_videos = {}
 
-  for video_id in videos.keys():
+  for video_id, cls, _, _ in videos:
 
     if class_dirs:
-      cls = videos[video_id]["annotations"]["label"]
       cls_path = cls.replace(" ", "_")
       video_path = os.path.join(root, cls_path, video_id + ".mp4")
     else:
@@ -32,8 +33,8 @@ def get_valid_videos(videos, root, class_dirs=True):
 
 def get_valid_frames(videos, root, class_dirs=True):
   """
-  Go through a list of videos and find all downloaded video frames.
-  :param videos:        The list of video metadata.
+  Go through a list of videos and find all videos with extracted frames.
+  :param videos:        Dataset metadata (see metadata_cache.load).
   :param root:          Video frames root.
   :param class_dirs:    Expect frames to be located in folders named after their classes
                         (e.g. jogging/0123/frame0.jpg ...).
@@ -42,16 +43,17 @@ def get_valid_frames(videos, root, class_dirs=True):
 
   valid_videos = {}
 
-  for video_id in videos.keys():
+  for video_id, cls, _, _ in videos:
     if class_dirs:
-      cls = videos[video_id]["annotations"]["label"]
       cls_path = cls.replace(" ", "_")
       video_path = os.path.join(root, cls_path, video_id)
     else:
       cls = ""
       video_path = os.path.join(root, video_id)
 
-    if os.path.isdir(video_path):
+    # only complete extractions have the marker or the pack file
+    if os.path.isfile(os.path.join(video_path, constants.FRAMES_MARKER)) or \
+        os.path.isfile(video_path + constants.FRAMES_PACK_SUFFIX):
       if cls in valid_videos:
         valid_videos[cls].append(video_id)
       else:
@@ -62,7 +64,7 @@ def get_valid_frames(videos, root, class_dirs=True):
 def get_valid_sound(videos, root, class_dirs=True):
   """
   Go through a list of videos and find all downloaded video sound tracks.
-  :param videos:    The list of video metadata.
+  :param videos:        Dataset metadata (see metadata_cache.load).
   :param root:          Video sounds root.
   :param class_dirs:    Expect sounds to be located in folders named after their classes (e.g. jogging/0123.mp3).
   :return:              List of valid video ids for each class.
@@ -70,9 +72,8 @@ def get_valid_sound(videos, root, class_dirs=True):
 
   valid_videos = {}
 
-  for video_id in videos.keys():
+  for video_id, cls, _, _ in videos:
     if class_dirs:
-      cls = videos[video_id]["annotations"]["label"]
       cls_path = cls.replace(" ", "_")
       video_path = os.path.join(root, cls_path, "{}.mp3".format(video_id))
     else:
@@ -87,6 +88,25 @@ def get_valid_sound(videos, root, class_dirs=True):
 
   return valid_videos
 
+def build_label_index(videos):
+  """
+  Group all video segments by their label in a single pass over the metadata.
+  :param videos:    Dataset metadata (see metadata_cache.load).
+  :return:          Dictionary with lower-cased labels as keys and lists of (video id, start, end) tuples as values.
+  """
+
+  label_index = {}
+
+  for video_id, label, start, end in videos:
+    label = label.lower()
+
+    if label in label_index:
+      label_index[label].append((video_id, start, end))
+    else:
+      label_index[label] = [(video_id, start, end)]
+
+  return label_index
+
 def class_keys_to_video_id_keys(videos):
   """
   Transform a dictionary with keys = classes, values = video lists to a dictionary where key = video id, value = class.
@@ -0,0 +1,229 @@
+import array, os, pickle
+
+import lib.utils as utils
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".cache"
+
+# metadata already loaded in this process, keyed by source path
+loaded_metadata = {}
+
+class CompactMetadata:
+  """
+  Columnar representation of Kinetics metadata: interned labels, float32 segments and a packed table of video ids.
+  """
+
+  def __init__(self, labels, label_ids, segments, video_ids_blob, video_ids_offsets):
+    """
+    :param labels:                List of unique labels.
+    :param label_ids:             Array of indices into labels, one per video.
+    :param segments:              Float32 array of interleaved segment starts and ends.
+    :param video_ids_blob:        All video ids concatenated into a single bytes object.
+    :param video_ids_offsets:     Array of video ids offsets into the blob (one more than the number of videos).
+    """
+
+    self.labels = labels
+    self.label_ids = label_ids
+    self.segments = segments
+    self.video_ids_blob = video_ids_blob
+    self.video_ids_offsets = video_ids_offsets
+
+    self.id_to_index = None
+
+  @classmethod
+  def from_json(cls, videos):
+    """
+    Convert Kinetics metadata loaded from JSON.
+    :param videos:    Dictionary of all videos.
+    :return:          Compact metadata.
+    """
+
+    labels = []
+    label_to_id = {}
+    label_ids = array.array("H")
+    segments = array.array("f")
+    video_ids = []
+    video_ids_offsets = array.array("I", [0])
+
+    for video_id, video_metadata in videos.items():
+      annotations = video_metadata["annotations"]
+      label = annotations.get("label", "")
+
+      if label not in label_to_id:
+        label_to_id[label] = len(labels)
+        labels.append(label)
+
+      encoded_id = video_id.encode()
+      video_ids.append(encoded_id)
+      video_ids_offsets.append(video_ids_offsets[-1] + len(encoded_id))
+
+      label_ids.append(label_to_id[label])
+      segments.append(annotations["segment"][0])
+      segments.append(annotations["segment"][1])
+
+    return cls(labels, label_ids, segments, b"".join(video_ids), video_ids_offsets)
+
+  def __len__(self):
+    return len(self.label_ids)
+
+  def __iter__(self):
+    """
+    Iterate over all videos.
+    :return:    Generator of (video id, label, start, end) tuples.
+    """
+
+    for i in range(len(self)):
+      yield self.video_id(i), self.labels[self.label_ids[i]], self.segments[2 * i], self.segments[2 * i + 1]
+
+  def __contains__(self, video_id):
+    return self.index(video_id) is not None
+
+  def video_id(self, i):
+    """
+    Get the id of the i-th video.
+    :param i:     Index of the video.
+    :return:      YouTube id of the video.
+    """
+
+    return self.video_ids_blob[self.video_ids_offsets[i]:self.video_ids_offsets[i + 1]].decode()
+
+  def keys(self):
+    """
+    Get the ids of all videos.
+    :return:    List of video ids.
+    """
+
+    return [self.video_id(i) for i in range(len(self))]
+
+  def index(self, video_id):
+    """
+    Find the position of a video (the lookup table is built on the first call).
+    :param video_id:    YouTube id of the video.
+    :return:            Index of the video or None if the video is not present.
+    """
+
+    if self.id_to_index is None:
+      self.id_to_index = {self.video_id(i): i for i in range(len(self))}
+
+    return self.id_to_index.get(video_id)
+
+  def label(self, video_id):
+    """
+    Get the label of a video.
+    :param video_id:    YouTube id of the video.
+    :return:            The label.
+    """
+
+    i = self.index(video_id)
+
+    if i is None:
+      raise KeyError(video_id)
+
+    return self.labels[self.label_ids[i]]
+
+  def to_state(self):
+    """
+    Transfer the columns to a dictionary that can be pickled cheaply.
+    :return:    The dictionary.
+    """
+
+    return {
+      "labels": self.labels,
+      "label_ids": self.label_ids.tobytes(),
+      "segments": self.segments.tobytes(),
+      "video_ids_blob": self.video_ids_blob,
+      "video_ids_offsets": self.video_ids_offsets.tobytes()
+    }
+
+  @classmethod
+  def from_state(cls, state):
+    """
+    Restore compact metadata from a dictionary created by to_state.
+    :param state:     The dictionary.
+    :return:          Compact metadata.
+    """
+
+    label_ids = array.array("H")
+    label_ids.frombytes(state["label_ids"])
+    segments = array.array("f")
+    segments.frombytes(state["segments"])
+    video_ids_offsets = array.array("I")
+    video_ids_offsets.frombytes(state["video_ids_offsets"])
+
+    return cls(state["labels"], label_ids, segments, state["video_ids_blob"], video_ids_offsets)
+
+def get_source_stamp(path):
+  """
+  Get a stamp that changes whenever the source JSON file changes.
+  :param path:    Path to the source file.
+  :return:        Tuple: modification time in nanoseconds and size of the file.
+  """
+
+  stat = os.stat(path)
+  return stat.st_mtime_ns, stat.st_size
+
+def read_cache(cache_path, stamp):
+  """
+  Read cached metadata.
+  :param cache_path:    Path to the cache file.
+  :param stamp:         Stamp of the source file.
+  :return:              Compact metadata or None if the cache is missing or stale.
+  """
+
+  if not os.path.isfile(cache_path):
+    return None
+
+  try:
+    with open(cache_path, "rb") as file:
+      cache = pickle.load(file)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    return None
+
+  if cache.get("version") != CACHE_VERSION or tuple(cache.get("stamp", ())) != stamp:
+    return None
+
+  return CompactMetadata.from_state(cache["metadata"])
+
+def write_cache(cache_path, stamp, compact):
+  """
+  Write metadata into a cache file. Failures are ignored, the cache is only an optimization.
+  :param cache_path:    Path to the cache file.
+  :param stamp:         Stamp of the source file.
+  :param compact:       Compact metadata.
+  :return:              None.
+  """
+
+  tmp_path = "{}.{:d}.tmp".format(cache_path, os.getpid())
+
+  try:
+    with open(tmp_path, "wb") as file:
+      pickle.dump({"version": CACHE_VERSION, "stamp": stamp, "metadata": compact.to_state()}, file,
+                  protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+  except OSError:
+    if os.path.isfile(tmp_path):
+      os.remove(tmp_path)
+
+def load(path):
+  """
+  Load Kinetics metadata. The parsed metadata are cached next to the source JSON file and reused until the source
+  changes. Each file is loaded only once per process.
+  :param path:    Path to a Kinetics metadata JSON file.
+  :return:        Compact metadata.
+  """
+
+  stamp = get_source_stamp(path)
+
+  if path in loaded_metadata and loaded_metadata[path][0] == stamp:
+    return loaded_metadata[path][1]
+
+  cache_path = path + CACHE_SUFFIX
+  compact = read_cache(cache_path, stamp)
+
+  if compact is None:
+    compact = CompactMetadata.from_json(utils.load_json(path))
+    write_cache(cache_path, stamp, compact)
+
+  loaded_metadata[path] = (stamp, compact)
+
+  return compact
@@ -0,0 +1,198 @@
+import os, random, shutil, subprocess, threading, time, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VIDEO_PATH_PREFIX = "/videos/"
+CHUNK_SIZE = 64 * 1024
+
+def generate_video(path, duration=20, width=640, height=360, frame_rate=25):
+  """
+  Generate a synthetic H.264 + AAC test video with ffmpeg.
+  :param path:          Where to save the video.
+  :param duration:      Duration of the video in seconds.
+  :param width:         Width of the video.
+  :param height:        Height of the video.
+  :param frame_rate:    Frame rate of the video.
+  :return:              None.
+  """
+
+  video_source = "testsrc=duration={:d}:size={:d}x{:d}:rate={:d}".format(duration, width, height, frame_rate)
+
+  subprocess.check_call(["ffmpeg", "-loglevel", "quiet", "-y", "-f", "lavfi", "-i", video_source,
+                         "-f", "lavfi", "-i", "sine=frequency=440:duration={:d}".format(duration),
+                         "-c:v", "libx264", "-c:a", "aac", "-shortest", path])
+
+class MockVideoService:
+  """
+  Local HTTP server that stands in for YouTube: every video id is served the same test video under /videos/<id>.mp4.
+  Latency, bandwidth and failures are configurable, so that the download pipeline can be measured without network
+  access (see downloader.HTTPFetcher).
+  """
+
+  def __init__(self, video_path, host="127.0.0.1", port=0, latency=0.0, bandwidth=None, failure_rate=0.0,
+               unavailable_rate=0.0, seed=None):
+    """
+    :param video_path:          Path to the video served for all ids.
+    :param host:                Address to listen on.
+    :param port:                Port to listen on, 0 picks a free port.
+    :param latency:             Delay before each response in seconds.
+    :param bandwidth:           Bandwidth of each response in bytes per second, None for no limit.
+    :param failure_rate:        Fraction of requests that fail with HTTP 503 (a transient error).
+    :param unavailable_rate:    Fraction of video ids that always fail with HTTP 404 (a permanent error). The same ids
+                                are unavailable in every run.
+    :param seed:                Random seed for the transient failures.
+    """
+
+    self.video_path = video_path
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.failure_rate = failure_rate
+    self.unavailable_rate = unavailable_rate
+
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    self.num_requests = 0
+    self.num_bytes = 0
+
+    self.server = ThreadingHTTPServer((host, port), MockVideoHandler)
+    self.server.daemon_threads = True
+    self.server.service = self
+    self.thread = None
+
+  @property
+  def base_url(self):
+    """
+    URL of the service (the argument of downloader.HTTPFetcher).
+    :return:    The URL.
+    """
+
+    host, port = self.server.server_address[:2]
+    return "http://{}:{:d}".format(host, port)
+
+  def is_unavailable(self, video_id):
+    """
+    Decide if a video is permanently unavailable, the decision depends only on the id.
+    :param video_id:    YouTube id of the video.
+    :return:            True if the video is unavailable.
+    """
+
+    return zlib.crc32(video_id.encode()) / 2 ** 32 < self.unavailable_rate
+
+  def should_fail(self):
+    """
+    Decide if the current request fails with a transient error.
+    :return:    True if the request should fail.
+    """
+
+    with self.lock:
+      return self.random.random() < self.failure_rate
+
+  def add_request(self):
+    """
+    Account for a received request.
+    :return:    None.
+    """
+
+    with self.lock:
+      self.num_requests += 1
+
+  def add_bytes(self, num_bytes):
+    """
+    Account for sent bytes.
+    :param num_bytes:   Number of bytes.
+    :return:            None.
+    """
+
+    with self.lock:
+      self.num_bytes += num_bytes
+
+  def start(self):
+    """
+    Serve requests in a background thread.
+    :return:    None.
+    """
+
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+
+  def serve_forever(self):
+    """
+    Serve requests in the current thread.
+    :return:    None.
+    """
+
+    self.server.serve_forever()
+
+  def stop(self):
+    """
+    Stop the server.
+    :return:    None.
+    """
+
+    self.server.shutdown()
+    self.server.server_close()
+
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+class MockVideoHandler(BaseHTTPRequestHandler):
+  """
+  Request handler of MockVideoService.
+  """
+
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+
+    service = self.server.service
+    service.add_request()
+
+    if not self.path.startswith(VIDEO_PATH_PREFIX):
+      self.send_error(400, "Unsupported URL")
+      return
+
+    video_id = os.path.splitext(self.path[len(VIDEO_PATH_PREFIX):])[0]
+
+    if service.latency > 0:
+      time.sleep(service.latency)
+
+    if service.is_unavailable(video_id):
+      self.send_error(404, "Video unavailable")
+      return
+
+    if service.should_fail():
+      self.send_error(503, "Service Unavailable")
+      return
+
+    size = os.path.getsize(service.video_path)
+
+    self.send_response(200)
+    self.send_header("Content-Type", "video/mp4")
+    self.send_header("Content-Length", str(size))
+    self.end_headers()
+
+    with open(service.video_path, "rb") as file:
+      if service.bandwidth is None:
+        shutil.copyfileobj(file, self.wfile)
+      else:
+        start_time = time.time()
+        sent = 0
+
+        while True:
+          chunk = file.read(CHUNK_SIZE)
+
+          if not chunk:
+            break
+
+          self.wfile.write(chunk)
+          sent += len(chunk)
+
+          # sleep until the sent bytes fit into the bandwidth
+          delay = sent / service.bandwidth - (time.time() - start_time)
+          if delay > 0:
+            time.sleep(delay)
+
+    service.add_bytes(size)
+
+  def log_message(self, format, *args):
+    pass
@@ -1,68 +1,181 @@
-import os
-from multiprocessing import Process, Queue
+import os, time
+from multiprocessing import Process, Queue, Value
 
+import lib.autotune as autotune
+import lib.batch_queue as batch_queue
+import lib.constants as constants
+import lib.disk_space as disk_space
 import lib.downloader as downloader
+import lib.job_state as job_state
+import lib.rate_limit as rate_limit
+import lib.sharding as sharding
+import lib.supervisor as supervisor
+import lib.work_plan as work_plan
+
+# downloads take seconds each, small batches keep the workers busy until the end of a run
+DEFAULT_MAX_BATCH_SIZE = 4
 
 class Pool:
   """
-  A pool of video downloaders.
+  A pool of video downloaders. Downloading (network-bound) and cutting (CPU-bound) are done by two separate groups of
+  workers connected by a bounded queue. All planned work is processed by the same workers and videos that appear in
+  multiple classes or splits are downloaded only once.
   """
 
-  def __init__(self, classes, videos_dict, directory, num_workers, failed_save_file, compress, verbose, skip,
-               log_file=None):
+  def __init__(self, groups, num_workers, failed_save_file, compress, verbose, skip,
+               log_file=None, cut_mode=constants.CUT_MODE_REENCODE, cut_log_file=None, num_cut_workers=None,
+               cut_queue_size=None, state_db=None, max_attempts=job_state.DEFAULT_MAX_ATTEMPTS, retries=0,
+               unavailable_file=None, max_requests_per_second=None, max_bandwidth=None,
+               fetcher=constants.FETCHER_SUBPROCESS, fetcher_url=None, target_resolution=None, audio_only=False,
+               download_timeout=None, cut_timeout=None, max_requeues=supervisor.DEFAULT_MAX_REQUEUES,
+               scratch_directory=None, min_free_space=None, schedule=constants.SCHEDULE_ROUND_ROBIN,
+               priority_classes=None, shortest_first=False, num_shards=1, shard_index=0,
+               max_batch_size=DEFAULT_MAX_BATCH_SIZE, autotune=False, autotune_interval=autotune.DEFAULT_INTERVAL,
+               threads_per_worker=None):
     """
-    :param classes:               List of classes to download.
-    :param videos_dict:           Dictionary of all videos.
-    :param directory:             Where to download to videos.
+    :param groups:                Planned work (see work_plan.plan_groups), each group needs a label index and
+                                  a target directory.
     :param num_workers:           How many videos to download in parallel.
     :param failed_save_file:      Where to save the failed videos ids.
     :param compress:              Whether to compress the videos using gzip.
+    :param verbose:               Print status.
+    :param skip:                  Skip classes that already have folders.
+    :param log_file:              Path to a log file for youtube-dl.
+    :param cut_mode:              How to cut out the sections of interest (see downloader.cut_video).
+    :param cut_log_file:          Path to a log file recording which cut path each video took.
+    :param num_cut_workers:       How many videos to cut in parallel, defaults to num_workers.
+    :param cut_queue_size:        How many downloaded videos can wait for cutting before downloads are paused,
+                                  defaults to twice the number of cut workers.
+    :param state_db:              Path to a job state database used to skip finished videos and record new attempts.
+    :param max_attempts:          Videos that failed this many times are not retried.
+    :param retries:               How many times to retry transient download failures (with exponential backoff).
+    :param unavailable_file:      Negative cache of videos that can never be downloaded (e.g. removed or private
+                                  videos). Videos in the file and in the files of all shards (see
+                                  sharding.find_shard_paths) are skipped, new unavailable videos are added to the file
+                                  of this shard.
+    :param max_requests_per_second:   Maximum number of downloads started per second by all workers together.
+    :param max_bandwidth:             Maximum aggregate download bandwidth of all workers in bytes per second.
+    :param fetcher:               How to download videos (see downloader.get_fetcher), each worker keeps its own
+                                  fetcher for all videos.
+    :param fetcher_url:           URL of the video server used by the HTTP fetcher (see mock_service).
+    :param target_resolution:     Download the smallest format whose shorter side has at least this many pixels,
+                                  None for the best format.
+    :param audio_only:            Download only sound tracks.
+    :param download_timeout:      Maximum time in seconds spent downloading a single video, the worker is killed and
+                                  the video requeued if it takes longer. None for no limit.
+    :param cut_timeout:           Maximum time in seconds spent cutting a single video.
+    :param max_requeues:          How many times to requeue a video whose worker died or timed out.
+    :param scratch_directory:     Where to save whole downloaded videos before they are cut (e.g. a tmpfs or a local
+                                  NVMe drive), defaults to the class directories.
+    :param min_free_space:        Downloads are paused while the scratch or any target volume has less free space in
+                                  bytes, None for no limit.
+    :param schedule:              Order of the downloads: constants.SCHEDULE_CLASSES downloads one class after another,
+                                  constants.SCHEDULE_ROUND_ROBIN takes one video of each class in turn, so that
+                                  a partial download is balanced.
+    :param priority_classes:      List of classes downloaded before all other classes (e.g. a subset), None for no
+                                  priority.
+    :param shortest_first:        Download the shortest sections of each class first.
+    :param num_shards:            Number of machines that split the work (see sharding.get_shard).
+    :param shard_index:           Index of the shard downloaded by this pool.
+    :param max_batch_size:        Maximum number of videos handed to a download worker at once (see
+                                  batch_queue.BatchQueue).
+    :param autotune:              Search for the number of download workers with the highest throughput, starting
+                                  with num_workers (see autotune.Autotuner).
+    :param autotune_interval:     How long each number of download workers is measured in seconds.
+    :param threads_per_worker:    Number of ffmpeg threads of each cut worker, defaults to an even share of the cores
+                                  with autotune and to the ffmpeg default without it.
     """
 
-    self.classes = classes
-    self.videos_dict = videos_dict
-    self.directory = directory
+    self.groups = groups
     self.num_workers = num_workers
     self.failed_save_file = failed_save_file
     self.compress = compress
     self.verbose = verbose
     self.skip = skip
     self.log_file = log_file
+    self.cut_mode = cut_mode
+    self.cut_log_file = cut_log_file
+    self.num_cut_workers = num_cut_workers if num_cut_workers is not None else num_workers
+    self.cut_queue_size = cut_queue_size if cut_queue_size is not None else 2 * self.num_cut_workers
+    self.state_db = state_db
+    self.max_attempts = max_attempts
+    self.retries = retries
+    self.unavailable_file = unavailable_file
+    self.unavailable_shard_file = sharding.shard_path(unavailable_file, num_shards, shard_index)
+    self.fetcher = fetcher
+    self.fetcher_url = fetcher_url
+    self.target_resolution = target_resolution
+    self.audio_only = audio_only
+    self.download_timeout = download_timeout
+    self.cut_timeout = cut_timeout
+    self.max_requeues = max_requeues
+    self.scratch_directory = scratch_directory
+    self.schedule = schedule
+    self.priority_classes = priority_classes
+    self.shortest_first = shortest_first
+    self.num_shards = num_shards
+    self.shard_index = shard_index
+    self.autotune = autotune
+    self.autotune_interval = autotune_interval
+    self.threads_per_worker = threads_per_worker
+    self.cut_threads = Value("i", 0)
+
+    self.disk_guard = None
+    if min_free_space is not None:
+      paths = [group.target_directory for group in groups]
+      if scratch_directory is not None:
+        paths.append(scratch_directory)
+      self.disk_guard = disk_space.DiskSpaceGuard(paths, min_free_space)
+
+    self.rate_limiter = None
+    if max_requests_per_second is not None or max_bandwidth is not None:
+      self.rate_limiter = rate_limit.RateLimiter(max_requests_per_second=max_requests_per_second,
+                                                 max_bandwidth=max_bandwidth)
 
-    self.videos_queue = Queue(100)
+    self.videos_queue = batch_queue.BatchQueue(num_consumers=num_workers, max_batch_size=max_batch_size)
+    self.cut_queue = Queue(self.cut_queue_size)
     self.failed_queue = Queue(100)
+    self.state_queue = Queue(100) if state_db is not None else None
+    self.unavailable_queue = Queue(100) if unavailable_file is not None else None
+    self.results_queue = Queue(100)
 
-    self.workers = []
+    self.result_counter = work_plan.ResultCounter(self.results_queue)
+
+    self.download_supervisor = None
+    self.cut_supervisor = None
+    self.autotuner = None
     self.failed_save_worker = None
+    self.state_worker = None
+    self.unavailable_worker = None
 
     if verbose:
       print("downloading:")
-      if self.classes is not None:
-        for cls in self.classes:
-          print(cls)
-        print()
+      for group in self.groups:
+        print(group.name)
+      print()
 
-  def feed_videos(self):
+  def plan_videos(self):
     """
-    Feed video ids into the download queue.
-    :return:    None.
+    Plan the download requests of all groups (see plan_requests). Skipped videos are counted right away.
+    :return:    List of download requests (see group_requests) in the order of the schedule.
     """
 
-    if self.classes is None:
-      downloader.download_class_parallel(None, self.videos_dict, self.directory, self.videos_queue)
-    else:
-      for class_name in self.classes:
-
-        if self.verbose:
-          print(class_name)
+    return plan_requests(self.groups, self.result_counter, skip=self.skip, state_db=self.state_db,
+                         max_attempts=self.max_attempts, unavailable_file=self.unavailable_file,
+                         schedule=self.schedule, priority_classes=self.priority_classes,
+                         shortest_first=self.shortest_first, num_shards=self.num_shards, shard_index=self.shard_index,
+                         verbose=self.verbose)
 
-        class_path = os.path.join(self.directory, class_name.replace(" ", "_"))
+  def feed_videos(self):
+    """
+    Feed the planned videos into the download queue.
+    :return:    None.
+    """
 
-        if not self.skip or not os.path.isdir(class_path):
-          downloader.download_class_parallel(class_name, self.videos_dict, self.directory, self.videos_queue)
+    self.videos_queue.put_many(self.plan_videos())
 
-      if self.verbose:
-        print("done")
+    if self.verbose:
+      print("done")
 
   def start_workers(self):
     """
@@ -70,56 +183,509 @@ class Pool:
     :return:    None.
     """
 
+    self.result_counter.start()
+
+    if self.scratch_directory is not None:
+      os.makedirs(self.scratch_directory, exist_ok=True)
+
+    if self.threads_per_worker is not None:
+      self.cut_threads.value = self.threads_per_worker
+    elif self.autotune:
+      self.cut_threads.value = autotune.get_threads_per_worker(self.num_cut_workers)
+
     # start failed videos saver
     if self.failed_save_file is not None:
       self.failed_save_worker = Process(target=write_failed_worker, args=(self.failed_queue, self.failed_save_file))
       self.failed_save_worker.start()
 
+    # start unavailable videos saver
+    if self.unavailable_file is not None:
+      self.unavailable_worker = Process(target=write_failed_worker, args=(self.unavailable_queue,
+                                                                          self.unavailable_shard_file))
+      self.unavailable_worker.start()
+
+    # start job state writer
+    if self.state_db is not None:
+      self.state_worker = Process(target=job_state.state_worker, args=(self.state_queue, self.state_db))
+      self.state_worker.start()
+
+    # start cut workers
+    self.cut_supervisor = supervisor.Supervisor(
+      "cut", cut_worker, (self.cut_queue, self.failed_queue, self.results_queue, self.state_queue, self.compress,
+                          self.cut_mode, self.cut_log_file, self.cut_threads),
+      self.num_cut_workers, self.cut_queue, timeout=self.cut_timeout, cleanup=self.cleanup_cut,
+      give_up=self.give_up_cut, max_requeues=self.max_requeues, results_queue=self.results_queue)
+    self.cut_supervisor.start()
+
     # start download workers
-    for _ in range(self.num_workers):
-      worker = Process(target=video_worker, args=(self.videos_queue, self.failed_queue, self.compress, self.log_file))
-      worker.start()
-      self.workers.append(worker)
+    self.download_supervisor = supervisor.Supervisor(
+      "download", video_worker, (self.videos_queue, self.cut_queue, self.failed_queue, self.results_queue,
+                                 self.unavailable_queue, self.state_queue, self.log_file, self.retries,
+                                 self.rate_limiter, self.fetcher, self.fetcher_url, self.target_resolution,
+                                 self.audio_only, self.scratch_directory, self.disk_guard),
+      self.num_workers, self.videos_queue, timeout=self.download_timeout, cleanup=self.cleanup_download,
+      give_up=self.give_up_download, max_requeues=self.max_requeues, results_queue=self.results_queue)
+    self.download_supervisor.start()
+
+    if self.autotune:
+      # downloads are network-bound, only their number is tuned and the cut workers keep their threads
+      self.autotuner = autotune.Autotuner("download", self.download_supervisor, self.result_counter,
+                                          interval=self.autotune_interval)
+      self.autotuner.start()
 
   def stop_workers(self):
     """
     Stop all workers.
-    :return:    None.
+    :return:    Number of videos with each status for each work group (see work_plan.ResultCounter).
     """
 
-    # send end signal to all download workers
-    for _ in range(len(self.workers)):
-      self.videos_queue.put(None)
+    if self.autotuner is not None:
+      self.autotuner.stop()
+
+    # send end signal to all download workers and wait for them to finish
+    self.download_supervisor.stop()
+
+    if self.rate_limiter is not None:
+      print(self.rate_limiter.report())
+
+    # all downloaded videos are in the cut queue now, stop the cut workers
+    self.cut_supervisor.stop()
+
+    for worker_supervisor in [self.download_supervisor, self.cut_supervisor]:
+      if worker_supervisor.num_restarts > 0 or self.verbose:
+        print(worker_supervisor.report())
 
-    # wait for the processes to finish
-    for worker in self.workers:
-      worker.join()
+    counts = self.result_counter.stop()
 
     # end failed videos saver
     if self.failed_save_worker is not None:
       self.failed_queue.put(None)
       self.failed_save_worker.join()
 
-def video_worker(videos_queue, failed_queue, compress, log_file):
+    # end unavailable videos saver
+    if self.unavailable_worker is not None:
+      self.unavailable_queue.put(None)
+      self.unavailable_worker.join()
+
+    # end job state writer
+    if self.state_worker is not None:
+      self.state_queue.put(None)
+      self.state_worker.join()
+
+    return counts
+
+  def cleanup_download(self, request):
+    """
+    Remove partial downloads of a video whose download worker died.
+    :param request:   The download request.
+    :return:          None.
+    """
+
+    video_id, targets = request
+    raw_directory = self.scratch_directory if self.scratch_directory is not None else targets[0][0]
+
+    for path in downloader.get_raw_paths(video_id, raw_directory):
+      if os.path.isfile(path):
+        os.remove(path)
+
+  def give_up_download(self, request):
+    """
+    Record a video that repeatedly killed or hung its download worker.
+    :param request:   The download request.
+    :return:          None.
+    """
+
+    video_id, targets = request
+
+    self.failed_queue.put(video_id)
+    job_state.put_state(self.state_queue, video_id, constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED,
+                        error=constants.ERROR_TIMEOUT)
+
+    self.results_queue.put([work_plan.Result(target[-1], constants.JOB_STATUS_FAILED, video_id)
+                            for target in targets])
+
+  def cleanup_cut(self, request):
+    """
+    Remove partial slices of a video whose cut worker died, all sections are cut again.
+    :param request:   The cut request.
+    :return:          None.
+    """
+
+    for slice_path, _, _, _ in request[2]:
+      if os.path.isfile(slice_path):
+        os.remove(slice_path)
+
+  def give_up_cut(self, request):
+    """
+    Record a video that repeatedly killed or hung its cut worker.
+    :param request:   The cut request.
+    :return:          None.
+    """
+
+    video_id, download_path, cuts = request
+
+    if os.path.isfile(download_path):
+      os.remove(download_path)
+
+    self.failed_queue.put(video_id)
+    for slice_path, _, _, _ in cuts:
+      job_state.put_state(self.state_queue, video_id, constants.STAGE_CUT, constants.JOB_STATUS_FAILED,
+                          error=constants.ERROR_TIMEOUT, target=slice_path)
+
+    self.results_queue.put([work_plan.Result(cut[-1], constants.JOB_STATUS_FAILED, video_id) for cut in cuts])
+
+def video_worker(videos_queue, cut_queue, failed_queue, results_queue, unavailable_queue, state_queue, log_file,
+                 retries, rate_limiter, fetcher_name, fetcher_url, target_resolution, audio_only, scratch_directory,
+                 disk_guard, slot):
   """
-  Downloads videos pass in the videos queue.
-  :param videos_queue:      Queue for metadata of videos to be download.
+  Downloads videos pass in the videos queue and hands them over to the cut workers.
+  :param videos_queue:      Batch queue of videos to be downloaded.
+  :param cut_queue:         Queue of downloaded videos to be cut.
   :param failed_queue:      Queue of failed video ids.
-  :param compress:          Whether to compress the videos using gzip.
+  :param results_queue:     Queue of lists of results (see work_plan.Result).
+  :param unavailable_queue: Queue of ids of permanently unavailable videos, None if they are not recorded.
+  :param state_queue:       Queue of job states, None if job states are not recorded.
   :param log_file:          Path to a log file for youtube-dl.
+  :param retries:           How many times to retry transient download failures.
+  :param rate_limiter:      Rate limiter shared by all download workers, None if downloads are not limited.
+  :param fetcher_name:      Name of the video fetcher.
+  :param fetcher_url:       URL of the video server used by the HTTP fetcher.
+  :param target_resolution: Minimum length of the shorter side of downloaded videos, None for the best format.
+  :param audio_only:        Download only sound tracks.
+  :param scratch_directory: Where to save whole downloaded videos, None for the class directories.
+  :param disk_guard:        Pauses downloads while there is not enough free space, None for no limit.
+  :param slot:              Slot for reporting the current video to the supervisor.
+  :return:                  None.
+  """
+
+  fetcher = downloader.get_fetcher(fetcher_name, url=fetcher_url)
+  results = batch_queue.BatchWriter(results_queue, slot=slot)
+  requests = batch_queue.BatchReader(videos_queue, before_wait=results.flush, slot=slot)
+
+  while True:
+    slot.idle()
+
+    if disk_guard is not None:
+      # wait before taking another video, so that the paused videos stay in the queue
+      disk_guard.wait()
+
+    request = requests.get()
+
+    if request is None:
+      fetcher.close()
+      break
+
+    slot.begin(request)
+
+    video_results, cut_request = download_request(request, failed_queue, unavailable_queue, state_queue, log_file,
+                                                  retries, rate_limiter, fetcher, target_resolution, audio_only,
+                                                  scratch_directory)
+
+    for result in video_results:
+      results.put(result)
+
+    if cut_request is not None:
+      # blocks if the cut workers cannot keep up, waiting does not count towards the timeout
+      slot.idle()
+      cut_queue.put(cut_request)
+
+def cut_worker(cut_queue, failed_queue, results_queue, state_queue, compress, cut_mode, cut_log_file, cut_threads,
+               slot):
+  """
+  Cuts out sections of interest from downloaded videos.
+  :param cut_queue:         Queue of downloaded videos to be cut.
+  :param failed_queue:      Queue of failed video ids.
+  :param results_queue:     Queue of lists of results (see work_plan.Result).
+  :param state_queue:       Queue of job states, None if job states are not recorded.
+  :param compress:          Whether to compress the videos using gzip.
+  :param cut_mode:          How to cut out the sections of interest.
+  :param cut_log_file:      Path to a log file recording which cut path each video took.
+  :param cut_threads:       Shared number of ffmpeg threads of the worker, 0 for the ffmpeg default.
+  :param slot:              Slot for reporting the current video to the supervisor.
   :return:                  None.
   """
 
   while True:
-    request = videos_queue.get()
+    slot.idle()
+    request = cut_queue.get()
 
     if request is None:
       break
 
-    video_id, directory, start, end = request
+    slot.begin(request)
+    autotune.set_worker_threads(cut_threads.value)
+
+    video_id, download_path, cuts = request
+
+    durations = downloader.cut_sections(video_id, download_path, cuts, compress=compress, cut_mode=cut_mode,
+                                        cut_log_file=cut_log_file)
+
+    # the sections of a video are reported together
+    results_queue.put(report_cuts(video_id, cuts, durations, failed_queue, state_queue))
+
+def download_request(request, failed_queue, unavailable_queue, state_queue, log_file, retries, rate_limiter, fetcher,
+                     target_resolution, audio_only, scratch_directory, cancelled=None):
+  """
+  Download the whole video of a download request once for all its sections, sections that were cut before are not
+  cut again. Used by the download workers and by async_download.AsyncPool.
+  :param request:           Download request (see group_requests).
+  :param failed_queue:      Queue of failed video ids.
+  :param unavailable_queue: Queue of ids of permanently unavailable videos, None if they are not recorded.
+  :param state_queue:       Queue of job states, None if job states are not recorded.
+  :param log_file:          Path to a log file for youtube-dl.
+  :param retries:           How many times to retry transient download failures.
+  :param rate_limiter:      Rate limiter shared by all downloads, None if downloads are not limited.
+  :param fetcher:           Video fetcher (see downloader.get_fetcher).
+  :param target_resolution: Minimum length of the shorter side of downloaded videos, None for the best format.
+  :param audio_only:        Download only sound tracks.
+  :param scratch_directory: Where to save whole downloaded videos, None for the class directories.
+  :param cancelled:         Event that stops retrying once it is set (see downloader.download_video).
+  :return:                  Tuple: list of results (see work_plan.Result) and the cut request (the video id, the path
+                            to the downloaded video and the list of (slice path, start, end, group name) cuts), None
+                            if there is nothing to cut.
+  """
+
+  video_id, targets = request
+  results = []
+
+  # sections that were processed before are not cut again
+  cuts = []
+  for directory, start, end, group_name in targets:
+    slice_path = downloader.get_slice_path(video_id, directory)
+
+    if os.path.isfile(slice_path):
+      job_state.put_state(state_queue, video_id, constants.STAGE_CUT, constants.JOB_STATUS_DONE,
+                          num_bytes=job_state.file_size(slice_path), target=slice_path)
+      results.append(work_plan.Result(group_name, constants.JOB_STATUS_DONE, video_id))
+    else:
+      cuts.append((slice_path, start, end, group_name))
+
+  if len(cuts) == 0:
+    return results, None
+
+  # the class directories are not created when planning
+  for slice_path, _, _, _ in cuts:
+    os.makedirs(os.path.dirname(slice_path), exist_ok=True)
+
+  # the video is downloaded only once for all its sections
+  start_time = time.time()
+  success, download_path, error = downloader.download_raw_video(video_id, os.path.dirname(cuts[0][0]),
+                                                                log_file=log_file, retries=retries,
+                                                                rate_limiter=rate_limiter, fetcher=fetcher,
+                                                                target_resolution=target_resolution,
+                                                                audio_only=audio_only,
+                                                                scratch_directory=scratch_directory,
+                                                                cancelled=cancelled)
+  duration = time.time() - start_time
 
-    if not downloader.process_video(video_id, directory, start, end, compress=compress, log_file=log_file):
+  if not success:
+    failed_queue.put(video_id)
+
+    if error == constants.ERROR_PERMANENT:
+      if unavailable_queue is not None:
+        unavailable_queue.put(video_id)
+      status = constants.JOB_STATUS_PERMANENT
+    else:
+      status = constants.JOB_STATUS_FAILED
+
+    job_state.put_state(state_queue, video_id, constants.STAGE_DOWNLOAD, status, error=error, duration=duration)
+
+    results += [work_plan.Result(cut[-1], status, video_id) for cut in cuts]
+    return results, None
+
+  if download_path is None:
+    # the first section was processed in the meantime (e.g. by another run), the rest is left for the next run
+    job_state.put_state(state_queue, video_id, constants.STAGE_CUT, constants.JOB_STATUS_DONE,
+                        num_bytes=job_state.file_size(cuts[0][0]), target=cuts[0][0])
+    results.append(work_plan.Result(cuts[0][-1], constants.JOB_STATUS_DONE, video_id))
+
+    for cut in cuts[1:]:
       failed_queue.put(video_id)
+      results.append(work_plan.Result(cut[-1], constants.JOB_STATUS_FAILED, video_id))
+
+    return results, None
+
+  job_state.put_state(state_queue, video_id, constants.STAGE_DOWNLOAD, constants.JOB_STATUS_DONE,
+                      num_bytes=job_state.file_size(download_path), duration=duration)
+
+  return results, (video_id, download_path, cuts)
+
+def report_cuts(video_id, cuts, durations, failed_queue, state_queue):
+  """
+  Record the outcome of cutting out the sections of a video. Used by the cut workers and by
+  async_download.AsyncPool.
+  :param video_id:      YouTube ID of the video.
+  :param cuts:          List of (slice path, start, end, group name) cuts.
+  :param durations:     List of (success, duration in seconds) tuples, one for each cut (see
+                        downloader.cut_sections).
+  :param failed_queue:  Queue of failed video ids.
+  :param state_queue:   Queue of job states, None if job states are not recorded.
+  :return:              List of results (see work_plan.Result), one for each cut.
+  """
+
+  results = []
+
+  for (slice_path, _, _, group_name), (success, duration) in zip(cuts, durations):
+    if success:
+      job_state.put_state(state_queue, video_id, constants.STAGE_CUT, constants.JOB_STATUS_DONE,
+                          num_bytes=job_state.file_size(slice_path), duration=duration, target=slice_path)
+      results.append(work_plan.Result(group_name, constants.JOB_STATUS_DONE, video_id))
+    else:
+      failed_queue.put(video_id)
+      job_state.put_state(state_queue, video_id, constants.STAGE_CUT, constants.JOB_STATUS_FAILED,
+                          duration=duration, target=slice_path)
+      results.append(work_plan.Result(group_name, constants.JOB_STATUS_FAILED, video_id))
+
+  return results
+
+def plan_requests(groups, result_counter, skip=False, state_db=None, max_attempts=job_state.DEFAULT_MAX_ATTEMPTS,
+                  unavailable_file=None, schedule=constants.SCHEDULE_ROUND_ROBIN, priority_classes=None,
+                  shortest_first=False, num_shards=1, shard_index=0, verbose=False):
+  """
+  Plan the download requests of all groups without creating any directories (e.g. on a coordinator host), the
+  download workers create the class directories. The options are the same as those of Pool.
+  :param groups:            Planned work, each group needs a label index and a target directory.
+  :param result_counter:    Counter of the results (see work_plan.ResultCounter), skipped videos are counted right away.
+  :param skip:              Skip classes that already have folders.
+  :param state_db:          Path to a job state database used to skip finished videos, None to skip nothing.
+  :param max_attempts:      Videos that failed this many times are skipped.
+  :param unavailable_file:  Negative cache of videos that can never be downloaded, None for no cache.
+  :param schedule:          Order of the downloads (see schedule_requests).
+  :param priority_classes:  List of classes downloaded before all other classes, None for no priority.
+  :param shortest_first:    Download the shortest sections of each class first.
+  :param num_shards:        Number of machines that split the work.
+  :param shard_index:       Index of the shard to plan.
+  :param verbose:           Print status.
+  :return:                  List of download requests (see group_requests) in the order of the schedule.
+  """
+
+  # a single query instead of checking each video on the disk, a video is cut separately for each of its slices
+  finished_slices = set()
+  finished_ids = set()
+  if state_db is not None:
+    ledger = job_state.JobLedger(state_db)
+    finished_slices, finished_ids = ledger.finished_targets(constants.STAGE_CUT, max_attempts=max_attempts)
+    ledger.close()
+
+  # do not spend workers on videos that are known to be unavailable, whichever shard found them
+  for path in [unavailable_file] + sharding.find_shard_paths(unavailable_file):
+    finished_ids |= read_ids(path)
+
+  if verbose:
+    print("skipping {:d} finished slices and {:d} finished or unavailable videos".format(len(finished_slices),
+                                                                                         len(finished_ids)))
+
+  segments = []
+
+  for group in groups:
+    class_names = group.classes if group.classes is not None else [None]
+
+    for class_name in class_names:
+
+      if verbose and class_name is not None:
+        print(group.name, class_name)
+
+      if class_name is not None and skip and \
+          os.path.isdir(os.path.join(group.target_directory, class_name.replace(" ", "_"))):
+        continue
+
+      planned, num_skipped = downloader.plan_class_parallel(class_name, group.label_index, group.target_directory,
+                                                            skip_ids=finished_ids, skip_slices=finished_slices)
+      # videos of other shards are downloaded by other machines
+      segments += [(video_id, class_dir, start, end, group.name) for video_id, class_dir, start, end in planned
+                   if sharding.in_shard(video_id, num_shards, shard_index)]
+
+      if num_skipped > 0:
+        result_counter.add(group.name, constants.JOB_STATUS_SKIPPED, num_skipped)
+
+  requests, duplicates = group_requests(segments)
+
+  for group_name, num_duplicates in duplicates.items():
+    result_counter.add(group_name, constants.JOB_STATUS_SKIPPED, num_duplicates)
+
+  if verbose:
+    print("{:d} segments of {:d} unique videos".format(len(segments), len(requests)))
+
+  return schedule_requests(requests, schedule=schedule, priority_classes=priority_classes,
+                           shortest_first=shortest_first)
+
+def group_requests(segments):
+  """
+  Group the planned sections by YouTube id, so that each video is downloaded only once even if it appears in multiple
+  classes or splits.
+  :param segments:    List of (video id, class directory, start, end, group name) tuples.
+  :return:            Tuple: list of download requests, each a (video id, targets) tuple with a list of
+                      (class directory, start, end, group name) targets, and the number of dropped duplicate
+                      sections for each group. A video can have only one section in each class directory.
+  """
+
+  targets_by_id = {}
+  duplicates = {}
+
+  for video_id, class_dir, start, end, group_name in segments:
+    targets = targets_by_id.setdefault(video_id, [])
+
+    if any(target[0] == class_dir for target in targets):
+      duplicates[group_name] = duplicates.get(group_name, 0) + 1
+      continue
+
+    targets.append((class_dir, start, end, group_name))
+
+  return list(targets_by_id.items()), duplicates
+
+def count_results(request):
+  """
+  Count the results reported for a download request, one for each target.
+  :param request:     Download request (see group_requests).
+  :return:            Number of results.
+  """
+
+  return len(request[1])
+
+def schedule_requests(requests, schedule=constants.SCHEDULE_ROUND_ROBIN, priority_classes=None,
+                      shortest_first=False):
+  """
+  Order download requests. A request belongs to the class directory of its first target.
+  :param requests:          List of download requests (see group_requests).
+  :param schedule:          constants.SCHEDULE_CLASSES keeps the classes one after another,
+                            constants.SCHEDULE_ROUND_ROBIN takes one request of each class in turn.
+  :param priority_classes:  List of classes scheduled before all other classes, None for no priority.
+  :param shortest_first:    Order the requests of each class by the length of their first section.
+  :return:                  List of download requests.
+  """
+
+  if schedule not in [constants.SCHEDULE_CLASSES, constants.SCHEDULE_ROUND_ROBIN]:
+    raise ValueError("Invalid schedule: {}.".format(schedule))
+
+  # the test set has no class directories, all its videos form a single class
+  buckets = {}
+  for request in requests:
+    buckets.setdefault(request[1][0][0], []).append(request)
+
+  if shortest_first:
+    for bucket in buckets.values():
+      bucket.sort(key=lambda request: request[1][0][2] - request[1][0][1])
+
+  priority_dirs = set()
+  if priority_classes is not None:
+    priority_dirs = {cls.replace(" ", "_").lower() for cls in priority_classes}
+
+  tiers = [[], []]
+  for class_dir, bucket in buckets.items():
+    is_priority = os.path.basename(class_dir).lower() in priority_dirs
+    tiers[0 if is_priority else 1].append(bucket)
+
+  scheduled = []
+
+  for tier in tiers:
+    if schedule == constants.SCHEDULE_CLASSES:
+      for bucket in tier:
+        scheduled += bucket
+    else:
+      for i in range(max([len(bucket) for bucket in tier], default=0)):
+        scheduled += [bucket[i] for bucket in tier if i < len(bucket)]
+
+  return scheduled
 
 def write_failed_worker(failed_queue, failed_save_file):
   """
@@ -140,3 +706,16 @@ def write_failed_worker(failed_queue, failed_save_file):
     file.write("{}\n".format(video_id))
 
   file.close()
+
+def read_ids(path):
+  """
+  Read a list of video ids written by write_failed_worker.
+  :param path:    Path to the file, can be None.
+  :return:        Set of video ids.
+  """
+
+  if path is None or not os.path.isfile(path):
+    return set()
+
+  with open(path, "r") as file:
+    return {line.strip() for line in file if line.strip()}
@@ -1,64 +1,92 @@
-import os
-from multiprocessing import Process, Queue
-
+import os, time
+from multiprocessing import Process, Queue, Value
+
+import lib.autotune as autotune
+import lib.batch_queue as batch_queue
+import lib.constants as constants
+import lib.job_state as job_state
+import lib.sharding as sharding
+import lib.supervisor as supervisor
 import lib.video as video
+import lib.work_plan as work_plan
+
+ERROR_NO_SOUND = "no_sound"
 
 class Pool:
   """
   A pool of video downloaders.
   """
 
-  def __init__(self, classes, source_directory, target_directory, num_workers, failed_save_file, no_sound_save_file):
-    self.classes = classes
-    self.source_directory = source_directory
-    self.target_directory = target_directory
+  def __init__(self, groups, num_workers, failed_save_file, no_sound_save_file, state_db=None,
+               max_attempts=job_state.DEFAULT_MAX_ATTEMPTS, timeout=None, max_requeues=supervisor.DEFAULT_MAX_REQUEUES,
+               num_shards=1, shard_index=0, max_batch_size=batch_queue.DEFAULT_MAX_BATCH_SIZE, autotune=False,
+               autotune_interval=autotune.DEFAULT_INTERVAL, threads_per_worker=None):
+    """
+    :param groups:                Planned work (see work_plan.plan_groups), each group needs a source directory with
+                                  videos and a target directory for the sound tracks.
+    :param num_workers:           Number of worker processes.
+    :param failed_save_file:      Where to save the failed videos ids.
+    :param no_sound_save_file:    Where to save ids of videos without sound.
+    :param state_db:              Path to a job state database used to skip finished videos and record new attempts.
+    :param max_attempts:          Videos that failed this many times are not retried.
+    :param timeout:               Maximum time in seconds spent on a single video, the worker is killed and the video
+                                  requeued if it takes longer. None for no limit.
+    :param max_requeues:          How many times to requeue a video whose worker died or timed out.
+    :param num_shards:            Number of machines that split the work (see sharding.get_shard).
+    :param shard_index:           Index of the shard processed by this pool.
+    :param max_batch_size:        Maximum number of videos handed to a worker at once (see batch_queue.BatchQueue).
+    :param autotune:              Search for the number of workers with the highest throughput, starting with
+                                  num_workers (see autotune.Autotuner).
+    :param autotune_interval:     How long each number of workers is measured in seconds.
+    :param threads_per_worker:    Number of threads of ffmpeg and OpenCV in each worker, defaults to an even share of
+                                  the cores with autotune and to the library defaults without it.
+    """
+
+    self.groups = groups
     self.num_workers = num_workers
     self.failed_save_file = failed_save_file
     self.no_sound_save_file = no_sound_save_file
-
-    self.videos_queue = Queue(100)
+    self.state_db = state_db
+    self.max_attempts = max_attempts
+    self.timeout = timeout
+    self.max_requeues = max_requeues
+    self.num_shards = num_shards
+    self.shard_index = shard_index
+    self.autotune = autotune
+    self.autotune_interval = autotune_interval
+    self.threads_per_worker = threads_per_worker
+    self.worker_threads = Value("i", 0)
+
+    self.videos_queue = batch_queue.BatchQueue(num_consumers=num_workers, max_batch_size=max_batch_size)
     self.no_sound_queue = Queue(100)
     self.failed_queue = Queue(100)
+    self.state_queue = Queue(100) if state_db is not None else None
+    self.results_queue = Queue(100)
 
-    self.workers = []
+    self.result_counter = work_plan.ResultCounter(self.results_queue)
+
+    self.supervisor = None
+    self.autotuner = None
     self.failed_save_worker = None
     self.no_sound_worker = None
+    self.state_worker = None
 
-  def feed_videos(self):
+  def plan_videos(self):
     """
-    Feed videos to a queue for workers.
-    :return:      None.
+    Plan the videos of all groups (see plan_requests). Skipped videos are counted right away.
+    :return:      List of requests for the workers.
     """
 
-    if self.classes is None:
-      videos = os.listdir(self.source_directory)
-
-      for filename in videos:
-        video_path = os.path.join(self.source_directory, filename)
-        video_id = ".".join(filename.split(".")[:-1])
-        target_path = os.path.join(self.target_directory, "{}.mp3".format(video_id))
-        self.videos_queue.put((video_id, video_path, self.target_directory, target_path))
-    else:
-      for class_name in self.classes:
-        source_class_dir = os.path.join(self.source_directory, class_name.replace(" ", "_"))
-        target_class_dir = os.path.join(self.target_directory, class_name.replace(" ", "_"))
-
-        if os.path.isdir(source_class_dir):
-
-          if not os.path.isdir(target_class_dir):
-            # when using multiple processes, the folder might have been already created (after the if was evaluated)
-            try:
-              os.makedirs(target_class_dir)
-            except FileExistsError:
-              pass
+    return plan_requests(self.groups, self.result_counter, state_db=self.state_db, max_attempts=self.max_attempts,
+                         num_shards=self.num_shards, shard_index=self.shard_index)
 
-          videos = os.listdir(source_class_dir)
+  def feed_videos(self):
+    """
+    Feed the planned videos to a queue for workers.
+    :return:      None.
+    """
 
-          for filename in videos:
-            video_path = os.path.join(source_class_dir, filename)
-            video_id = ".".join(filename.split(".")[:-1])
-            target_path = os.path.join(target_class_dir, "{}.mp3".format(video_id))
-            self.videos_queue.put((video_id, video_path, target_class_dir, target_path))
+    self.videos_queue.put_many(self.plan_videos())
 
   def start_workers(self):
     """
@@ -66,6 +94,13 @@ class Pool:
     :return:    None.
     """
 
+    self.result_counter.start()
+
+    if self.threads_per_worker is not None:
+      self.worker_threads.value = self.threads_per_worker
+    elif self.autotune:
+      self.worker_threads.value = autotune.get_threads_per_worker(self.num_workers)
+
     # start failed conversions logger
     if self.failed_save_file is not None:
       self.failed_save_worker = Process(target=write_failed_worker, args=(self.failed_queue, self.failed_save_file))
@@ -76,60 +111,218 @@ class Pool:
       self.no_sound_worker = Process(target=write_failed_worker, args=(self.no_sound_queue, self.no_sound_save_file))
       self.no_sound_worker.start()
 
-    # start download workers
-    for _ in range(self.num_workers):
-      worker = Process(target=sound_worker, args=(self.videos_queue, self.failed_queue, self.no_sound_queue))
-      worker.start()
-      self.workers.append(worker)
+    # start job state writer
+    if self.state_db is not None:
+      self.state_worker = Process(target=job_state.state_worker, args=(self.state_queue, self.state_db))
+      self.state_worker.start()
+
+    # start extraction workers
+    self.supervisor = supervisor.Supervisor(
+      "sound", sound_worker, (self.videos_queue, self.failed_queue, self.no_sound_queue, self.results_queue,
+                              self.state_queue, self.worker_threads),
+      self.num_workers, self.videos_queue, timeout=self.timeout, cleanup=self.cleanup, give_up=self.give_up,
+      max_requeues=self.max_requeues, results_queue=self.results_queue)
+    self.supervisor.start()
+
+    if self.autotune:
+      # the tuner pins the threads to the share of each worker unless they were given
+      self.autotuner = autotune.Autotuner(
+        "sound", self.supervisor, self.result_counter,
+        worker_threads=self.worker_threads if self.threads_per_worker is None else None,
+        interval=self.autotune_interval)
+      self.autotuner.start()
 
   def stop_workers(self):
     """
     Stop all workers.
-    :return:    None.
+    :return:    Number of videos with each status for each work group (see work_plan.ResultCounter).
     """
 
-    # send end signal to all download workers
-    for _ in range(len(self.workers)):
-      self.videos_queue.put(None)
+    if self.autotuner is not None:
+      self.autotuner.stop()
+
+    # send end signal to all workers and wait for them to finish
+    self.supervisor.stop()
 
-    # wait for the processes to finish
-    for worker in self.workers:
-      worker.join()
+    if self.supervisor.num_restarts > 0:
+      print(self.supervisor.report())
+
+    counts = self.result_counter.stop()
 
     # end failed videos saver
     if self.failed_save_worker is not None:
       self.failed_queue.put(None)
       self.failed_save_worker.join()
 
-def sound_worker(videos_queue, failed_queue, no_sound_queue):
+    # end no sound logger
+    if self.no_sound_worker is not None:
+      self.no_sound_queue.put(None)
+      self.no_sound_worker.join()
+
+    # end job state writer
+    if self.state_worker is not None:
+      self.state_queue.put(None)
+      self.state_worker.join()
+
+    return counts
+
+  def cleanup(self, request):
+    """
+    Remove a partial sound track of a video whose worker died, so that it is not mistaken for a finished one.
+    :param request:   The request of the worker.
+    :return:          None.
+    """
+
+    target_path = request[3]
+
+    if os.path.isfile(target_path):
+      os.remove(target_path)
+
+  def give_up(self, request):
+    """
+    Record a video that repeatedly killed or hung its worker.
+    :param request:   The request of the worker.
+    :return:          None.
+    """
+
+    video_id, group_name = request[0], request[-1]
+
+    self.failed_queue.put(video_id)
+    job_state.put_state(self.state_queue, video_id, constants.STAGE_SOUND, constants.JOB_STATUS_FAILED,
+                        error=constants.ERROR_TIMEOUT)
+    self.results_queue.put([work_plan.Result(group_name, constants.JOB_STATUS_FAILED, video_id)])
+
+def plan_requests(groups, result_counter, state_db=None, max_attempts=job_state.DEFAULT_MAX_ATTEMPTS, num_shards=1,
+                  shard_index=0):
+  """
+  Plan the videos of all groups without creating any directories (e.g. on a coordinator host), the workers create
+  the class directories. The options are the same as those of Pool.
+  :param groups:            Planned work, each group needs a source and a target directory.
+  :param result_counter:    Counter of the results (see work_plan.ResultCounter), skipped videos are counted right away.
+  :param state_db:          Path to a job state database used to skip finished videos, None to skip nothing.
+  :param max_attempts:      Videos that failed this many times are skipped.
+  :param num_shards:        Number of machines that split the work.
+  :param shard_index:       Index of the shard to plan.
+  :return:                  List of requests for the workers.
+  """
+
+  finished_ids = set()
+  if state_db is not None:
+    ledger = job_state.JobLedger(state_db)
+    finished_ids = ledger.finished_ids(constants.STAGE_SOUND, max_attempts=max_attempts)
+    ledger.close()
+
+  requests = []
+
+  for group in groups:
+    if group.classes is None:
+      requests += plan_directory(group.source_directory, group.target_directory, group.name, finished_ids,
+                                 result_counter, num_shards, shard_index)
+    else:
+      for class_name in group.classes:
+        source_class_dir = os.path.join(group.source_directory, class_name.replace(" ", "_"))
+        target_class_dir = os.path.join(group.target_directory, class_name.replace(" ", "_"))
+
+        if os.path.isdir(source_class_dir):
+          requests += plan_directory(source_class_dir, target_class_dir, group.name, finished_ids, result_counter,
+                                     num_shards, shard_index)
+
+  return requests
+
+def plan_directory(source_directory, target_directory, group_name, finished_ids, result_counter, num_shards,
+                   shard_index):
+  """
+  Plan all videos in a directory.
+  :param source_directory:    Directory with videos.
+  :param target_directory:    Where to save the results.
+  :param group_name:          Name of the work group the videos are accounted to.
+  :param finished_ids:        Set of video ids that should be skipped.
+  :param result_counter:      Counter of the results, skipped videos are counted right away.
+  :param num_shards:          Number of machines that split the work.
+  :param shard_index:         Index of the shard to plan.
+  :return:                    List of requests for the workers.
+  """
+
+  requests = []
+  num_skipped = 0
+
+  for filename in os.listdir(source_directory):
+    video_path = os.path.join(source_directory, filename)
+    video_id = ".".join(filename.split(".")[:-1])
+
+    if not sharding.in_shard(video_id, num_shards, shard_index):
+      # processed by another machine
+      continue
+
+    if video_id in finished_ids:
+      num_skipped += 1
+      continue
+
+    target_path = os.path.join(target_directory, "{}.mp3".format(video_id))
+    requests.append((video_id, video_path, target_directory, target_path, group_name))
+
+  if num_skipped > 0:
+    result_counter.add(group_name, constants.JOB_STATUS_SKIPPED, num_skipped)
+
+  return requests
+
+def sound_worker(videos_queue, failed_queue, no_sound_queue, results_queue, state_queue, worker_threads, slot):
   """
   Process video files.
-  :param videos_queue:        Queue of video paths.
+  :param videos_queue:        Batch queue of videos.
   :param failed_queue:        Queue for failed videos.
   :param no_sound_queue:      Queue for videos with no sound.
+  :param results_queue:       Queue of lists of results (see work_plan.Result).
+  :param state_queue:         Queue of job states, None if job states are not recorded.
+  :param worker_threads:      Shared number of threads of ffmpeg and OpenCV in the worker, 0 for the defaults.
+  :param slot:                Slot for reporting the current video to the supervisor.
   :return:                    None.
   """
 
+  results = batch_queue.BatchWriter(results_queue, slot=slot)
+  requests = batch_queue.BatchReader(videos_queue, before_wait=results.flush, slot=slot)
+
   while True:
-    request = videos_queue.get()
+    slot.idle()
+    request = requests.get()
 
     if request is None:
       break
 
-    video_id, video_path, target_class_dir, target_path = request
+    slot.begin(request)
+    autotune.set_worker_threads(worker_threads.value)
+
+    video_id, video_path, target_class_dir, target_path, group_name = request
 
     if os.path.isfile(target_path):
+      job_state.put_state(state_queue, video_id, constants.STAGE_SOUND, constants.JOB_STATUS_DONE,
+                          num_bytes=job_state.file_size(target_path))
+      results.put(work_plan.Result(group_name, constants.JOB_STATUS_DONE, video_id))
       continue
 
-    if not os.path.isdir(target_class_dir):
-      os.makedirs(target_class_dir)
+    # the class directories are not created when planning
+    os.makedirs(target_class_dir, exist_ok=True)
 
     if not video.video_has_sound(video_path):
       no_sound_queue.put(video_id)
-      return
+      job_state.put_state(state_queue, video_id, constants.STAGE_SOUND, constants.JOB_STATUS_PERMANENT,
+                          error=ERROR_NO_SOUND)
+      results.put(work_plan.Result(group_name, constants.JOB_STATUS_PERMANENT, video_id))
+      continue
 
-    if not video.video_to_sound(video_path, target_path):
+    start_time = time.time()
+    success = video.video_to_sound(video_path, target_path)
+    duration = time.time() - start_time
+
+    if success:
+      job_state.put_state(state_queue, video_id, constants.STAGE_SOUND, constants.JOB_STATUS_DONE,
+                          num_bytes=job_state.file_size(target_path), duration=duration)
+      results.put(work_plan.Result(group_name, constants.JOB_STATUS_DONE, video_id))
+    else:
       failed_queue.put(video_id)
+      job_state.put_state(state_queue, video_id, constants.STAGE_SOUND, constants.JOB_STATUS_FAILED,
+                          duration=duration)
+      results.put(work_plan.Result(group_name, constants.JOB_STATUS_FAILED, video_id))
 
 def write_failed_worker(failed_queue, failed_save_file):
   """
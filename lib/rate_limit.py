@@ -0,0 +1,146 @@
+import time
+from multiprocessing import Lock, Value
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+class TokenBucket:
+  """
+  Token bucket shared by multiple processes. Tokens are reserved before waiting, so concurrent callers queue up fairly
+  and the bucket may go into debt (e.g. when bytes are charged after a download finishes).
+  """
+
+  def __init__(self, rate, capacity=None):
+    """
+    :param rate:        Number of tokens added per second.
+    :param capacity:    Maximum number of tokens (burst size), defaults to one second worth of tokens.
+    """
+
+    self.rate = rate
+    self.capacity = capacity if capacity is not None else rate
+
+    self.lock = Lock()
+    self.tokens = Value("d", self.capacity, lock=False)
+    self.timestamp = Value("d", time.time(), lock=False)
+
+  def reserve(self, amount):
+    """
+    Take tokens from the bucket without waiting.
+    :param amount:    Number of tokens.
+    :return:          How long the caller has to wait until the tokens are actually available, in seconds.
+    """
+
+    with self.lock:
+      now = time.time()
+      self.tokens.value = min(self.capacity, self.tokens.value + (now - self.timestamp.value) * self.rate)
+      self.timestamp.value = now
+      self.tokens.value -= amount
+
+      if self.tokens.value >= 0:
+        return 0.0
+
+      return -self.tokens.value / self.rate
+
+  def acquire(self, amount=1):
+    """
+    Take tokens from the bucket and wait until they are available.
+    :param amount:    Number of tokens, 0 only waits until the bucket is out of debt.
+    :return:          Time spent waiting in seconds.
+    """
+
+    wait = self.reserve(amount)
+
+    if wait > 0:
+      time.sleep(wait)
+
+    return wait
+
+class RateLimiter:
+  """
+  Limits the number of requests per second and the aggregate bandwidth of all download workers.
+  """
+
+  def __init__(self, max_requests_per_second=None, max_bandwidth=None):
+    """
+    :param max_requests_per_second:   Maximum number of started downloads per second, None for no limit.
+    :param max_bandwidth:             Maximum aggregate bandwidth in bytes per second, None for no limit.
+    """
+
+    self.requests = TokenBucket(max_requests_per_second) if max_requests_per_second is not None else None
+    self.bandwidth = TokenBucket(max_bandwidth) if max_bandwidth is not None else None
+
+    self.lock = Lock()
+    self.total_wait = Value("d", 0.0, lock=False)
+    self.num_acquired = Value("i", 0, lock=False)
+    self.num_waited = Value("i", 0, lock=False)
+
+  def acquire(self):
+    """
+    Wait until a download can be started.
+    :return:    Time spent waiting in seconds.
+    """
+
+    wait = self.reserve()
+
+    if wait > 0:
+      time.sleep(wait)
+
+    return wait
+
+  def reserve(self):
+    """
+    Reserve the start of a download without waiting (e.g. for callers that wait asynchronously).
+    :return:    How long the caller has to wait before starting the download, in seconds.
+    """
+
+    wait = 0.0
+
+    if self.bandwidth is not None:
+      # wait until the bytes downloaded by previous requests are paid off
+      wait = max(wait, self.bandwidth.reserve(0))
+
+    if self.requests is not None:
+      wait = max(wait, self.requests.reserve(1))
+
+    with self.lock:
+      self.total_wait.value += wait
+      self.num_acquired.value += 1
+
+      if wait > 0:
+        self.num_waited.value += 1
+
+    return wait
+
+  def charge_bytes(self, num_bytes):
+    """
+    Account for downloaded bytes.
+    :param num_bytes:   Number of downloaded bytes.
+    :return:            None.
+    """
+
+    if self.bandwidth is not None and num_bytes is not None:
+      self.bandwidth.reserve(num_bytes)
+
+  def report(self):
+    """
+    Summarize how long the workers waited for the rate limiter.
+    :return:    Report string.
+    """
+
+    num_acquired = max(self.num_acquired.value, 1)
+
+    return "rate limiter: {:d} / {:d} downloads waited, {:.1f}s in total, {:.2f}s per download".format(
+      self.num_waited.value, self.num_acquired.value, self.total_wait.value, self.total_wait.value / num_acquired)
+
+def parse_size(size):
+  """
+  Parse a size with an optional K, M or G suffix (e.g. 10M).
+  :param size:    Size string.
+  :return:        Size in bytes.
+  """
+
+  size = size.strip().upper()
+
+  if size and size[-1] in SIZE_SUFFIXES:
+    return float(size[:-1]) * SIZE_SUFFIXES[size[-1]]
+
+  return float(size)
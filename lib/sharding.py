@@ -0,0 +1,104 @@
+import glob, os, zlib
+
+import lib.job_state as job_state
+
+def get_shard(video_id, num_shards):
+  """
+  Assign a video to a shard. The assignment depends only on the video id, so all machines agree on it without
+  communicating.
+  :param video_id:      YouTube ID of the video.
+  :param num_shards:    Number of shards.
+  :return:              Index of the shard.
+  """
+
+  return zlib.crc32(video_id.encode("utf-8")) % num_shards
+
+def in_shard(video_id, num_shards, shard_index):
+  """
+  Check if a video belongs to a shard.
+  :param video_id:      YouTube ID of the video.
+  :param num_shards:    Number of shards.
+  :param shard_index:   Index of the shard.
+  :return:              True if the video belongs to the shard.
+  """
+
+  return num_shards <= 1 or get_shard(video_id, num_shards) == shard_index
+
+def shard_path(path, num_shards, shard_index):
+  """
+  Get the path of a log or a database of a shard, e.g. dataset/failed.txt becomes dataset/failed.shard-2-of-8.txt.
+  :param path:          Path used without sharding, can be None.
+  :param num_shards:    Number of shards.
+  :param shard_index:   Index of the shard.
+  :return:              Path of the shard, the same path if there is only one shard.
+  """
+
+  if path is None or num_shards <= 1:
+    return path
+
+  root, extension = os.path.splitext(path)
+
+  return "{}.shard-{:d}-of-{:d}{}".format(root, shard_index, num_shards, extension)
+
+def find_shard_paths(path):
+  """
+  Find the logs or databases written by all shards of any number of shards (see shard_path).
+  :param path:    Path used without sharding, can be None.
+  :return:        Sorted list of existing paths of shards.
+  """
+
+  if path is None:
+    return []
+
+  root, extension = os.path.splitext(path)
+
+  return sorted(glob.glob("{}.shard-*-of-*{}".format(glob.escape(root), glob.escape(extension))))
+
+def merge_id_logs(paths, output_path):
+  """
+  Combine logs of video ids (e.g. failed or unavailable videos) written by multiple shards. Ids already in the output
+  file are kept and each id is written only once.
+  :param paths:         Paths to the logs, missing logs are skipped.
+  :param output_path:   Where to save the combined log.
+  :return:              Number of ids in the combined log.
+  """
+
+  video_ids = []
+  seen = set()
+
+  for path in [output_path] + list(paths):
+    if not os.path.isfile(path):
+      continue
+
+    with open(path, "r") as file:
+      for line in file:
+        video_id = line.strip()
+
+        if video_id and video_id not in seen:
+          seen.add(video_id)
+          video_ids.append(video_id)
+
+  with open(output_path, "w") as file:
+    for video_id in video_ids:
+      file.write("{}\n".format(video_id))
+
+  return len(video_ids)
+
+def merge_state_dbs(paths, output_path):
+  """
+  Combine job state databases written by multiple shards (see job_state.JobLedger.merge).
+  :param paths:         Paths to the databases, missing databases are skipped.
+  :param output_path:   Path to the combined database, created if it does not exist.
+  :return:              Number of records in the combined database.
+  """
+
+  ledger = job_state.JobLedger(output_path)
+
+  for path in paths:
+    if os.path.isfile(path):
+      ledger.merge(path)
+
+  num_records = ledger.count()
+  ledger.close()
+
+  return num_records
@@ -0,0 +1,457 @@
+import io, os, pickle, signal, threading, time
+from multiprocessing import Array, Process, Value
+
+# maximum size of a pickled work item that can be requeued
+SLOT_SIZE = 4096
+# maximum size of a pickled batch of work items and of the pickled results a worker has not sent yet
+BATCH_SLOT_SIZE = 65536
+
+DEFAULT_CHECK_INTERVAL = 1.0
+DEFAULT_MAX_REQUEUES = 1
+
+class WorkerSlot:
+  """
+  Shared memory through which a worker tells its supervisor what it is working on and since when.
+  """
+
+  def __init__(self):
+
+    self.started = Value("d", 0.0)
+    self.length = Value("i", 0, lock=False)
+    self.data = Array("c", SLOT_SIZE, lock=False)
+    self.retired = Value("b", 0, lock=False)
+    # written only by the worker and read by the supervisor after the worker died
+    self.batch_length = Value("i", 0, lock=False)
+    self.batch_position = Value("i", 0, lock=False)
+    self.batch_data = Array("c", BATCH_SLOT_SIZE, lock=False)
+    self.results_length = Value("i", 0, lock=False)
+    self.results_data = Array("c", BATCH_SLOT_SIZE, lock=False)
+    self.unfinished_length = Value("i", 0, lock=False)
+    self.unfinished_data = Array("c", BATCH_SLOT_SIZE, lock=False)
+
+  def begin(self, item):
+    """
+    Mark the start of work on an item.
+    :param item:    The work item taken from the queue.
+    :return:        None.
+    """
+
+    data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with self.started.get_lock():
+      if len(data) <= SLOT_SIZE:
+        self.data[:len(data)] = data
+        self.length.value = len(data)
+      else:
+        # too large to requeue, the supervisor still enforces the timeout
+        self.length.value = 0
+
+      self.started.value = time.time()
+
+  def idle(self):
+    """
+    Mark that the worker is waiting for work.
+    :return:    None.
+    """
+
+    with self.started.get_lock():
+      self.started.value = 0.0
+      self.length.value = 0
+
+  def is_idle(self):
+    """
+    Check if the worker is waiting for work.
+    :return:    True if the worker is idle.
+    """
+
+    return self.started.value <= 0
+
+  def retire(self):
+    """
+    Ask the worker to exit before it waits for more work (see batch_queue.BatchReader).
+    :return:    None.
+    """
+
+    self.retired.value = 1
+
+  def is_retired(self):
+    """
+    Check if the worker was asked to exit.
+    :return:    True if the worker is retired.
+    """
+
+    return self.retired.value != 0
+
+  def busy_for(self, now):
+    """
+    How long the worker has been working on its current item.
+    :param now:     Current time.
+    :return:        Time in seconds, 0 if the worker is idle.
+    """
+
+    started = self.started.value
+    return now - started if started > 0 else 0.0
+
+  def take(self):
+    """
+    Get the item of a dead worker. The lock is not used, the worker might have died while holding it.
+    :return:    Tuple: the item (None if the worker was idle) and its pickled form.
+    """
+
+    if self.started.value <= 0 or self.length.value <= 0:
+      return None, None
+
+    data = self.data[:self.length.value]
+
+    return pickle.loads(data), data
+
+  def hold(self, items):
+    """
+    Record a batch of items taken by the worker (see batch_queue.BatchReader), so that the items it did not start are
+    requeued if it dies.
+    :param items:   List of items.
+    :return:        None.
+    """
+
+    data = pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if len(data) <= BATCH_SLOT_SIZE:
+      self.batch_data[:len(data)] = data
+      self.batch_length.value = len(data)
+    else:
+      # too large to requeue, the rest of the batch is lost if the worker dies
+      self.batch_length.value = 0
+
+    self.batch_position.value = 0
+
+  def advance(self):
+    """
+    Mark that the worker took the next item of its batch.
+    :return:    None.
+    """
+
+    self.batch_position.value += 1
+
+  def add_result(self, record):
+    """
+    Record a result the worker has not sent yet (see batch_queue.BatchWriter).
+    :param record:    The result.
+    :return:          None.
+    """
+
+    data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    start = self.results_length.value
+
+    if start + len(data) <= BATCH_SLOT_SIZE:
+      self.results_data[start:start + len(data)] = data
+      self.results_length.value = start + len(data)
+
+  def clear_results(self):
+    """
+    Mark that the worker sent all its results.
+    :return:    None.
+    """
+
+    self.results_length.value = 0
+
+  def hold_unfinished(self, items):
+    """
+    Record the items the worker processed but whose output is not saved yet (e.g. videos in a tar shard that is still
+    open), so that they are requeued if it dies.
+    :param items:   List of items, empty once the output is saved.
+    :return:        None.
+    """
+
+    data = pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL) if len(items) > 0 else b""
+
+    if len(data) <= BATCH_SLOT_SIZE:
+      self.unfinished_data[:len(data)] = data
+      self.unfinished_length.value = len(data)
+    else:
+      # too large to requeue, the items are processed again in the next run
+      self.unfinished_length.value = 0
+
+  def take_batch(self):
+    """
+    Get the items a dead worker took from the queue but did not start or did not finish (see hold_unfinished) and the
+    results it did not send.
+    :return:    Tuple: list of items and list of results.
+    """
+
+    items = []
+    if self.unfinished_length.value > 0:
+      items += pickle.loads(self.unfinished_data[:self.unfinished_length.value])
+    if self.batch_length.value > 0:
+      items += pickle.loads(self.batch_data[:self.batch_length.value])[self.batch_position.value:]
+
+    results = []
+    stream = io.BytesIO(self.results_data[:self.results_length.value])
+
+    while stream.tell() < self.results_length.value:
+      results.append(pickle.load(stream))
+
+    return items, results
+
+class Supervisor:
+  """
+  Keeps a fixed number of worker processes alive. Workers that die are respawned, workers that spend more than the
+  timeout on a single item are killed together with their subprocesses (e.g. a hung youtube-dl or ffmpeg). The item a
+  dead worker was working on is requeued a limited number of times and then given up.
+
+  Workers are called as target(*args, slot) and have to call slot.begin(item) after taking an item from the queue and
+  slot.idle() before waiting for the next one. Workers that read batches and send their results in batches pass the
+  slot to batch_queue.BatchReader and BatchWriter: the rest of the batch of a dead worker is requeued without counting
+  against the limit and the results it did not send are put into the results queue. The same goes for the items whose
+  output was not saved yet (see WorkerSlot.hold_unfinished).
+  """
+
+  def __init__(self, name, target, args, num_workers, queue, timeout=None, cleanup=None, give_up=None,
+               max_requeues=DEFAULT_MAX_REQUEUES, check_interval=DEFAULT_CHECK_INTERVAL, results_queue=None):
+    """
+    :param name:              Name of the workers used in reports.
+    :param target:            Worker function.
+    :param args:              Arguments of the worker function (without the slot).
+    :param num_workers:       Number of workers.
+    :param queue:             Input queue of the workers, None is their end signal.
+    :param timeout:           Maximum time in seconds spent on a single item, None for no limit.
+    :param cleanup:           Called with the item of a dead worker, e.g. to remove partial output.
+    :param give_up:           Called with an item that was requeued too many times.
+    :param max_requeues:      How many times to requeue an item whose worker died.
+    :param check_interval:    How often to check the workers in seconds.
+    :param results_queue:     Queue of lists of results, where the unsent results of dead workers go.
+    """
+
+    self.name = name
+    self.target = target
+    self.args = args
+    self.num_workers = num_workers
+    self.queue = queue
+    self.timeout = timeout
+    self.cleanup = cleanup
+    self.give_up = give_up
+    self.max_requeues = max_requeues
+    self.check_interval = check_interval
+    self.results_queue = results_queue
+
+    self.workers = []
+    self.requeues = {}
+    self.stopping = False
+    self.lock = threading.Lock()
+    self.monitor_thread = None
+
+    self.num_crashed = 0
+    self.num_timed_out = 0
+    self.num_given_up = 0
+
+  def spawn(self):
+    """
+    Start a new worker.
+    :return:        Tuple: the process and its slot.
+    """
+
+    slot = WorkerSlot()
+    worker = Process(target=self.target, args=tuple(self.args) + (slot,))
+    worker.start()
+
+    return worker, slot
+
+  def start(self):
+    """
+    Start all workers and the monitor.
+    :return:    None.
+    """
+
+    for _ in range(self.num_workers):
+      self.workers.append(self.spawn())
+
+    self.monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+    self.monitor_thread.start()
+
+  def monitor(self):
+    """
+    Check the workers until all of them finished after the end signal.
+    :return:    None.
+    """
+
+    while True:
+      with self.lock:
+        self.check()
+
+        if self.stopping and len(self.workers) == 0:
+          break
+
+      time.sleep(self.check_interval)
+
+  def check(self):
+    """
+    Replace dead and hung workers.
+    :return:    None.
+    """
+
+    now = time.time()
+    workers = []
+
+    for worker, slot in self.workers:
+
+      if worker.is_alive():
+        if self.timeout is None or slot.busy_for(now) <= self.timeout:
+          workers.append((worker, slot))
+          continue
+
+        kill_process_tree(worker.pid)
+        worker.join()
+        self.num_timed_out += 1
+        print("{} worker {:d} timed out, restarting".format(self.name, worker.pid))
+      else:
+        worker.join()
+
+        if (self.stopping or slot.is_retired()) and worker.exitcode == 0 and slot.is_idle():
+          # the worker received the end signal or was retired
+          continue
+
+        self.num_crashed += 1
+        print("{} worker {:d} died with exit code {}, restarting".format(self.name, worker.pid, worker.exitcode))
+
+      requeued = self.handle_item(slot)
+
+      if not slot.is_retired():
+        workers.append(self.spawn())
+
+      if requeued and self.stopping:
+        # the end signals are already in the queue, the requeued item needs one more worker behind them
+        self.queue.put(None)
+        workers.append(self.spawn())
+
+    self.workers = workers
+
+  def handle_item(self, slot):
+    """
+    Requeue or give up the item of a dead worker.
+    :param slot:    Slot of the dead worker.
+    :return:        True if any items were requeued.
+    """
+
+    pending, unsent = slot.take_batch()
+    item, key = slot.take()
+
+    if len(unsent) > 0 and self.results_queue is not None:
+      self.results_queue.put(unsent)
+
+    if len(pending) > 0:
+      # the worker did not get to these items or lost their output, they are not to blame
+      self.queue.put_many(pending)
+
+    if item is None:
+      return len(pending) > 0
+
+    if self.cleanup is not None:
+      self.cleanup(item)
+
+    num_requeues = self.requeues.get(key, 0)
+
+    if num_requeues >= self.max_requeues:
+      self.num_given_up += 1
+
+      if self.give_up is not None:
+        self.give_up(item)
+
+      return len(pending) > 0
+
+    self.requeues[key] = num_requeues + 1
+    self.queue.put(item)
+
+    return True
+
+  def resize(self, num_workers):
+    """
+    Change the number of workers. New workers are started right away, surplus workers are retired and exit before
+    they wait for more work.
+    :param num_workers:   Number of workers.
+    :return:              None.
+    """
+
+    with self.lock:
+      if self.stopping:
+        return
+
+      active = [(worker, slot) for worker, slot in self.workers if not slot.is_retired()]
+
+      for _ in range(num_workers - len(active)):
+        self.workers.append(self.spawn())
+
+      for _, slot in active[num_workers:]:
+        slot.retire()
+
+      self.num_workers = num_workers
+
+  def stop(self):
+    """
+    Send the end signal to all workers and wait for them to finish. Workers that die in the meantime are still
+    replaced, so that all items in the queue are processed.
+    :return:    None.
+    """
+
+    with self.lock:
+      self.stopping = True
+      num_workers = len(self.workers)
+
+    # dead workers are replaced one for one, so each worker still gets exactly one end signal
+    for _ in range(num_workers):
+      self.queue.put(None)
+
+    if self.monitor_thread is not None:
+      self.monitor_thread.join()
+      self.monitor_thread = None
+
+  @property
+  def num_restarts(self):
+    return self.num_crashed + self.num_timed_out
+
+  def report(self):
+    """
+    Summarize worker restarts.
+    :return:    Report string.
+    """
+
+    return "{} workers: {:d} restarts ({:d} died, {:d} timed out), {:d} items given up".format(
+      self.name, self.num_restarts, self.num_crashed, self.num_timed_out, self.num_given_up)
+
+def kill_process_tree(pid):
+  """
+  Kill a process and all its descendants (e.g. youtube-dl or ffmpeg started by a worker).
+  Descendants are found through /proc, only the process itself is killed where it is not available.
+  :param pid:     Process id.
+  :return:        None.
+  """
+
+  for descendant in [pid] + get_descendants(pid):
+    try:
+      os.kill(descendant, signal.SIGKILL)
+    except OSError:
+      pass
+
+def get_descendants(pid):
+  """
+  Find all descendants of a process.
+  :param pid:     Process id.
+  :return:        List of process ids.
+  """
+
+  descendants = []
+  task_dir = "/proc/{:d}/task".format(pid)
+
+  if not os.path.isdir(task_dir):
+    return descendants
+
+  for task in os.listdir(task_dir):
+    try:
+      with open(os.path.join(task_dir, task, "children"), "r") as file:
+        children = [int(child) for child in file.read().split()]
+    except (OSError, ValueError):
+      continue
+
+    for child in children:
+      descendants.append(child)
+      descendants += get_descendants(child)
+
+  return descendants
@@ -1,35 +1,607 @@
-import cv2, os, subprocess
+import cv2, json, os, queue, shutil, subprocess, threading
+import numpy as np
 
-def video_to_jpgs(video_path, save_path, do_resize=True, shorter_side=256):
+import lib.autotune as autotune
+import lib.constants as constants
+import lib.frame_pack as frame_pack
+import lib.utils as utils
+
+JPEG_QUALITY = 75
+# resize and encode threads of the OpenCV engine if the worker threads are not pinned
+DEFAULT_ENCODE_THREADS = 2
+# decoded frames waiting for each encode thread, bounds the memory used by a video
+FRAMES_PER_ENCODE_THREAD = 4
+# ffmpeg JPEG quantizer scale that gives about the same file sizes as JPEG_QUALITY in OpenCV
+FFMPEG_JPEG_QSCALE = 8
+# how much of the ffmpeg output is read at once when the frames are piped
+PIPE_READ_SIZE = 1024 * 1024
+
+# codecs whose decoders can downscale by up to 2^n while decoding (the ffmpeg lowres option)
+MAX_LOWRES = {
+  "mjpeg": 3,
+  "mpeg1video": 3,
+  "mpeg2video": 3,
+  "mpeg4": 3,
+  "h263": 3,
+  "msmpeg4v3": 3
+}
+
+def extract_frames(video_path, target_dir, output_format=constants.FRAMES_FORMAT_JPGS, **kwargs):
+  """
+  Extract the frames of a video so that the output either does not exist or holds all frames: the frames are written
+  into a sibling that is renamed once the extraction succeeded.
+  :param video_path:      Path to the video file.
+  :param target_dir:      Where the directory with the frames should be, packed frames are saved next to it (see
+                          get_output_path).
+  :param output_format:   constants.FRAMES_FORMAT_JPGS or constants.FRAMES_FORMAT_PACKED (see video_to_jpgs).
+  :param kwargs:          Options of video_to_jpgs.
+  :return:                True if extraction successful, otherwise false.
+  """
+
+  output_path = get_output_path(target_dir, output_format)
+  partial_path = get_partial_path(output_path)
+
+  # left over by a crashed extraction
+  remove_path(partial_path)
+
+  if output_format == constants.FRAMES_FORMAT_JPGS:
+    os.makedirs(partial_path)
+  else:
+    os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+
+  if not video_to_jpgs(video_path, partial_path, output_format=output_format, **kwargs):
+    remove_path(partial_path)
+    return False
+
+  # a directory without the marker, e.g. written before the marker existed, cannot be trusted
+  remove_path(output_path)
+  os.rename(partial_path, output_path)
+
+  return True
+
+def get_output_path(target_dir, output_format=constants.FRAMES_FORMAT_JPGS):
+  """
+  Get where the frames of a video are saved.
+  :param target_dir:      Directory with the frames of the video.
+  :param output_format:   constants.FRAMES_FORMAT_JPGS or constants.FRAMES_FORMAT_PACKED.
+  :return:                The directory itself for JPEG files, a pack file with the same name for packed frames.
+  """
+
+  if output_format == constants.FRAMES_FORMAT_PACKED:
+    return os.path.normpath(target_dir) + constants.FRAMES_PACK_SUFFIX
+  elif output_format != constants.FRAMES_FORMAT_JPGS:
+    raise ValueError("Invalid frames output format.")
+
+  return target_dir
+
+def get_partial_path(output_path):
+  """
+  Get where the frames are extracted before they are complete (see extract_frames).
+  :param output_path:   Where the finished frames are saved (see get_output_path).
+  :return:              Path to the partial output.
+  """
+
+  return os.path.normpath(output_path) + constants.PARTIAL_SUFFIX
+
+def is_extracted(target_dir, output_format=constants.FRAMES_FORMAT_JPGS):
+  """
+  Check if all frames of a video were extracted, costs a single stat.
+  :param target_dir:      Directory with the frames.
+  :param output_format:   constants.FRAMES_FORMAT_JPGS or constants.FRAMES_FORMAT_PACKED.
+  :return:                True if the completion marker or the pack file exists.
+  """
+
+  if output_format == constants.FRAMES_FORMAT_PACKED:
+    return os.path.isfile(get_output_path(target_dir, output_format))
+
+  return os.path.isfile(os.path.join(target_dir, constants.FRAMES_MARKER))
+
+def read_frames_marker(target_dir):
+  """
+  Read the completion marker of extracted frames.
+  :param target_dir:    Directory with the frames.
+  :return:              Dictionary with num_frames, width and height, None if the frames are not complete.
+  """
+
+  if not is_extracted(target_dir):
+    return None
+
+  return utils.load_json(os.path.join(target_dir, constants.FRAMES_MARKER))
+
+def write_frames_marker(save_path, num_frames, width, height):
+  """
+  Record that all frames were written.
+  :param save_path:     Directory with the frames.
+  :param num_frames:    Number of frames.
+  :param width:         Width of the frames.
+  :param height:        Height of the frames.
+  :return:              None.
+  """
+
+  marker = {"num_frames": num_frames, "width": width, "height": height}
+  utils.save_json(os.path.join(save_path, constants.FRAMES_MARKER), marker)
+
+def get_frame_paths(target_dir):
+  """
+  List the JPEG files of a video in order.
+  :param target_dir:    Directory with the frames.
+  :return:              List of paths to the frames, empty if the frames are not complete.
+  """
+
+  marker = read_frames_marker(target_dir)
+
+  if marker is None:
+    return []
+
+  return [os.path.join(target_dir, "frame{:d}.jpg".format(i)) for i in range(marker["num_frames"])]
+
+def read_frames(target_dir):
+  """
+  Read the JPEG bytes of all frames of a video in order, in either output format.
+  :param target_dir:    Directory with the frames.
+  :return:              Generator of bytes, empty if the frames are not complete.
+  """
+
+  if is_extracted(target_dir, constants.FRAMES_FORMAT_PACKED):
+    with frame_pack.PackReader(get_output_path(target_dir, constants.FRAMES_FORMAT_PACKED)) as reader:
+      for i in range(len(reader)):
+        yield reader.read_frame(i)
+  else:
+    for frame_path in get_frame_paths(target_dir):
+      with open(frame_path, "rb") as file:
+        yield file.read()
+
+def load_frames(target_dir):
+  """
+  Load all frames of a video in order, in either output format.
+  :param target_dir:    Directory with the frames.
+  :return:              Generator of BGR frames, empty if the frames are not complete.
+  """
+
+  for data in read_frames(target_dir):
+    yield cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def remove_path(path):
+  """
+  Remove a file or a directory tree if it exists.
+  :param path:    The path.
+  :return:        None.
+  """
+
+  if os.path.isdir(path):
+    shutil.rmtree(path)
+  elif os.path.isfile(path):
+    os.remove(path)
+
+class JpgWriter:
+  """
+  Writes each frame of a video into its own JPEG file and the completion marker after the last one.
+  """
+
+  def __init__(self, save_path):
+    """
+    :param save_path:   Directory for the frames.
+    """
+
+    self.save_path = save_path
+
+  def write(self, index, data):
+    """
+    Save a frame.
+    :param index:   Number of the frame.
+    :param data:    JPEG bytes of the frame.
+    :return:        None.
+    """
+
+    with open(os.path.join(self.save_path, "frame{:d}.jpg".format(index)), "wb") as file:
+      file.write(data)
+
+  def close(self, num_frames, width, height):
+    """
+    Write the completion marker.
+    :param num_frames:  Number of frames.
+    :param width:       Width of the frames.
+    :param height:      Height of the frames.
+    :return:            None.
+    """
+
+    write_frames_marker(self.save_path, num_frames, width, height)
+
+  def abort(self):
+    """
+    Stop without the completion marker.
+    :return:    None.
+    """
+
+    pass
+
+def open_frames_writer(save_path, output_format):
+  """
+  Create a writer of the frames of a video.
+  :param save_path:       Directory for JPEG files, file for packed frames.
+  :param output_format:   constants.FRAMES_FORMAT_JPGS or constants.FRAMES_FORMAT_PACKED.
+  :return:                JpgWriter or frame_pack.PackWriter.
+  """
+
+  if output_format == constants.FRAMES_FORMAT_JPGS:
+    return JpgWriter(save_path)
+  elif output_format == constants.FRAMES_FORMAT_PACKED:
+    return frame_pack.PackWriter(save_path)
+  else:
+    raise ValueError("Invalid frames output format.")
+
+def video_to_jpgs(video_path, save_path, do_resize=True, shorter_side=256, engine=constants.FRAMES_ENGINE_OPENCV,
+                  num_threads=None, output_format=constants.FRAMES_FORMAT_JPGS, writer=None):
   """
-  Extract individual frames from a video.
+  Extract individual frames from a video, the completion marker (see write_frames_marker) or the index of the pack is
+  written last. Use extract_frames to get either all frames or none.
   :param video_path:          Path to the video file.
-  :param save_path:           Path to a directory where to save the video frames.
+  :param save_path:           Path to a directory where to save the video frames, or to the pack file.
   :param do_resize:           Resize the frames.
   :param shorter_side:        If do_resize, shorter side will be resized to this value.
+  :param engine:              constants.FRAMES_ENGINE_OPENCV decodes the frames with OpenCV while a few threads resize
+                              and encode them, constants.FRAMES_ENGINE_FFMPEG does all of it in a single ffmpeg process
+                              (see video_to_jpgs_ffmpeg).
+  :param num_threads:         Number of resize and encode threads of the OpenCV engine, defaults to the pinned worker
+                              threads (see autotune.set_worker_threads) or DEFAULT_ENCODE_THREADS.
+  :param output_format:       constants.FRAMES_FORMAT_JPGS saves each frame into its own file, FRAMES_FORMAT_PACKED
+                              saves all frames into one file with an index (see frame_pack).
+  :param writer:              Writer of the frames (e.g. frame_shards.SampleWriter), replaces save_path and
+                              output_format.
   :return:                    True if extraction successful, otherwise false.
   """
 
+  if engine not in [constants.FRAMES_ENGINE_OPENCV, constants.FRAMES_ENGINE_FFMPEG]:
+    raise ValueError("Invalid frame extraction engine.")
+
+  if writer is None:
+    writer = open_frames_writer(save_path, output_format)
+
+  if engine == constants.FRAMES_ENGINE_FFMPEG:
+    return video_to_jpgs_ffmpeg(video_path, save_path, do_resize=do_resize, shorter_side=shorter_side, writer=writer)
+
   cap = cv2.VideoCapture(video_path)
 
   if not cap.isOpened():
+    writer.abort()
     return False
 
-  i = 0
-  res, frame = cap.read()
+  if num_threads is None:
+    num_threads = autotune.worker_threads or DEFAULT_ENCODE_THREADS
+
+  num_threads = max(num_threads, 1)
 
-  while res:
-    if do_resize:
-      frame = resize(frame, shorter_side=shorter_side)
+  # OpenCV releases the GIL while decoding, resizing and encoding, so this thread decodes the next frames while the
+  # encode threads work on the previous ones
+  frames_queue = queue.Queue(num_threads * FRAMES_PER_ENCODE_THREAD)
+  failures = []
+  threads = [threading.Thread(target=encode_frames, args=(frames_queue, writer, do_resize, shorter_side, failures))
+             for _ in range(num_threads)]
 
-    cv2.imwrite(os.path.join(save_path, "frame{:d}.jpg".format(i)), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 75])
+  for thread in threads:
+    thread.start()
+
+  i = 0
+  width, height = None, None
+
+  try:
     res, frame = cap.read()
-    i += 1
 
-  num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-  num_images = len(os.listdir(save_path))
+    if res:
+      height, width = frame.shape[:2]
+
+      if do_resize:
+        width, height = get_resized_size(width, height, shorter_side)
+
+    while res and len(failures) == 0:
+      # the frame number is assigned here, so the file names do not depend on the order of the encode threads
+      frames_queue.put((i, frame))
+      res, frame = cap.read()
+      i += 1
+  finally:
+    for _ in threads:
+      frames_queue.put(None)
+
+    for thread in threads:
+      thread.join()
+
+  # every decoded frame was written, unless an encode thread failed
+  if len(failures) > 0 or i == 0 or i != int(cap.get(cv2.CAP_PROP_FRAME_COUNT)):
+    writer.abort()
+    return False
+
+  writer.close(i, width, height)
+
+  return True
+
+def encode_frames(frames_queue, writer, do_resize, shorter_side, failures):
+  """
+  Resize, encode and write frames until the end signal, used by the encode threads of video_to_jpgs.
+  :param frames_queue:    Queue of (frame number, frame) tuples, None is the end signal.
+  :param writer:          Writer of the frames (see open_frames_writer).
+  :param do_resize:       Resize the frames.
+  :param shorter_side:    If do_resize, shorter side will be resized to this value.
+  :param failures:        List shared by the threads, the numbers of frames that could not be written are appended.
+  :return:                None.
+  """
+
+  while True:
+    item = frames_queue.get()
+
+    if item is None:
+      break
+
+    i, frame = item
 
-  return num_frames == num_images
+    # keep taking frames after a failure, so that the decode thread never blocks on a full queue
+    if len(failures) > 0:
+      continue
+
+    try:
+      if do_resize:
+        frame = resize(frame, shorter_side=shorter_side)
+
+      encoded, data = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+
+      if encoded:
+        writer.write(i, data.tobytes())
+    except (cv2.error, OSError):
+      encoded = False
+
+    if not encoded:
+      failures.append(i)
+
+def video_to_jpgs_ffmpeg(video_path, save_path, do_resize=True, shorter_side=256, writer=None):
+  """
+  Extract individual frames from a video with a single ffmpeg process that decodes, scales and encodes the frames.
+  Frames are named and sized as by the OpenCV engine. Codecs that support it are downscaled already by the decoder.
+  :param video_path:          Path to the video file.
+  :param save_path:           Path to a directory where to save the video frames, or to the pack file.
+  :param do_resize:           Resize the frames.
+  :param shorter_side:        If do_resize, shorter side will be resized to this value.
+  :param writer:              Writer of the frames (see open_frames_writer), defaults to JPEG files in save_path. ffmpeg
+                              writes JPEG files itself, the frames are piped into other writers.
+  :return:                    True if extraction successful, otherwise false.
+  """
+
+  probe = probe_video(video_path)
+  cmd = ["ffmpeg", "-loglevel", "error", "-nostats", "-y"] + autotune.ffmpeg_threads()
+
+  if do_resize and probe is not None:
+    codec, width, height, _ = probe
+    lowres = get_lowres(codec, width, height, shorter_side)
+
+    if lowres > 0:
+      cmd += ["-lowres", str(lowres)]
+
+  cmd += ["-i", video_path, "-map", "0:v:0", "-vsync", "0"]
+
+  if do_resize:
+    # the same size and interpolation as resize: the shorter side is scaled to shorter_side, the longer side is
+    # rounded down
+    cmd += ["-vf", "scale=w='if(gt(ih,iw),{0:d},trunc(iw*{0:d}/ih))':h='if(gt(ih,iw),trunc(ih*{0:d}/iw),{0:d})'"
+                   ":flags=bilinear".format(shorter_side)]
+
+  cmd += ["-q:v", str(FFMPEG_JPEG_QSCALE)] + autotune.ffmpeg_threads()
+
+  if writer is None:
+    writer = JpgWriter(save_path)
+
+  if isinstance(writer, JpgWriter):
+    # the progress report on stdout counts the written frames
+    process = subprocess.run(cmd + ["-progress", "pipe:1", "-start_number", "0",
+                                    os.path.join(writer.save_path, "frame%d.jpg")], stdout=subprocess.PIPE)
+    success = process.returncode == 0
+    num_images = get_progress_frames(process.stdout.decode())
+    first_frame = None
+
+    if success and num_images > 0:
+      with open(os.path.join(writer.save_path, "frame0.jpg"), "rb") as file:
+        first_frame = file.read()
+  else:
+    success, num_images, first_frame = pipe_frames(cmd, writer)
+
+  if not success or num_images == 0 or (probe is not None and probe[3] is not None and num_images != probe[3]):
+    # a container that does not record the number of frames is trusted with any non-zero count
+    writer.abort()
+    return False
+
+  size = get_jpeg_size(first_frame)
+
+  if size is None:
+    writer.abort()
+    return False
+
+  writer.close(num_images, size[0], size[1])
+
+  return True
+
+def pipe_frames(cmd, writer):
+  """
+  Run ffmpeg with its JPEG frames piped to stdout and split them into frames.
+  :param cmd:       The ffmpeg command without the output.
+  :param writer:    Writer of the frames (see open_frames_writer).
+  :return:          Tuple: success, number of frames and the bytes of the first frame.
+  """
+
+  process = subprocess.Popen(cmd + ["-f", "image2pipe", "-c:v", "mjpeg", "pipe:1"], stdout=subprocess.PIPE)
+  buffer = bytearray()
+  num_frames = 0
+  first_frame = None
+
+  try:
+    while True:
+      chunk = process.stdout.read(PIPE_READ_SIZE)
+
+      if len(chunk) == 0:
+        break
+
+      buffer += chunk
+      end = find_jpeg_end(buffer)
+
+      while end > 0:
+        data = bytes(buffer[:end])
+        del buffer[:end]
+
+        if first_frame is None:
+          first_frame = data
+
+        writer.write(num_frames, data)
+        num_frames += 1
+        end = find_jpeg_end(buffer)
+  except ValueError:
+    process.kill()
+    process.wait()
+    return False, num_frames, first_frame
+  finally:
+    process.stdout.close()
+
+  # an incomplete frame at the end means ffmpeg failed
+  success = process.wait() == 0 and len(buffer) == 0
+
+  return success, num_frames, first_frame
+
+def find_jpeg_end(data):
+  """
+  Find the end of the first JPEG image in a stream of concatenated images.
+  :param data:    The stream, starts with an image.
+  :return:        Position after the end of image marker, -1 if the stream does not have the whole image yet.
+  """
+
+  if len(data) < 2:
+    return -1
+
+  if data[0] != 0xFF or data[1] != 0xD8:
+    raise ValueError("Not a JPEG image.")
+
+  pos = 2
+
+  while pos + 1 < len(data):
+    if data[pos] != 0xFF:
+      raise ValueError("Invalid JPEG marker.")
+
+    marker = data[pos + 1]
+
+    if marker == 0xD9:
+      return pos + 2
+
+    if marker == 0xFF:
+      # fill byte
+      pos += 1
+      continue
+
+    if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+      # markers without a segment
+      pos += 2
+      continue
+
+    if pos + 4 > len(data):
+      return -1
+
+    pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+
+    if marker == 0xDA:
+      # entropy coded data ends at the first marker that is not a stuffed byte or a restart marker
+      while True:
+        pos = data.find(b"\xff", pos)
+
+        if pos < 0 or pos + 1 >= len(data):
+          return -1
+
+        if data[pos + 1] == 0x00 or 0xD0 <= data[pos + 1] <= 0xD7:
+          pos += 2
+        else:
+          break
+
+  return -1
+
+def get_jpeg_size(data):
+  """
+  Read the size of a JPEG image from its frame header.
+  :param data:    Bytes of the image.
+  :return:        Tuple: width and height, None if the image has no frame header.
+  """
+
+  if data is None or len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+    return None
+
+  pos = 2
+
+  while pos + 9 <= len(data) and data[pos] == 0xFF:
+    marker = data[pos + 1]
+
+    if marker == 0xFF:
+      pos += 1
+      continue
+
+    # start of frame markers, except the ones for Huffman tables, arithmetic coding conditioning and restarts
+    if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+      return (data[pos + 7] << 8) | data[pos + 8], (data[pos + 5] << 8) | data[pos + 6]
+
+    if marker == 0xDA or marker == 0xD9:
+      return None
+
+    pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+
+  return None
+
+def get_progress_frames(progress):
+  """
+  Read the number of written frames from the ffmpeg progress report (the -progress option).
+  :param progress:    The report.
+  :return:            Number of frames, 0 if the report has none.
+  """
+
+  num_frames = 0
+
+  for line in progress.splitlines():
+    key, _, value = line.partition("=")
+
+    if key.strip() == "frame" and value.strip().isdigit():
+      num_frames = int(value.strip())
+
+  return num_frames
+
+def probe_video(video_path):
+  """
+  Read the codec, size and number of frames of the first video stream.
+  :param video_path:    Path to the video file.
+  :return:              Tuple: codec name, width, height and number of frames (None if the container does not record
+                        it). None if probing failed.
+  """
+
+  try:
+    output = subprocess.check_output(["ffprobe", "-loglevel", "quiet", "-print_format", "json", "-select_streams",
+                                      "v:0", "-show_entries", "stream=codec_name,width,height,nb_frames", video_path])
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+  streams = json.loads(output.decode()).get("streams", [])
+
+  if len(streams) == 0 or "width" not in streams[0] or "height" not in streams[0]:
+    return None
+
+  stream = streams[0]
+  num_frames = int(stream["nb_frames"]) if stream.get("nb_frames", "N/A").isdigit() else None
+
+  return stream.get("codec_name"), int(stream["width"]), int(stream["height"]), num_frames
+
+def get_lowres(codec, width, height, shorter_side):
+  """
+  Choose how much a decoder should downscale a video, so that its shorter side stays at least shorter_side.
+  :param codec:           Name of the codec.
+  :param width:           Width of the video.
+  :param height:          Height of the video.
+  :param shorter_side:    Target size of the shorter side.
+  :return:                The ffmpeg lowres value: the decoder halves both sides this many times, 0 for no downscaling.
+  """
+
+  lowres = 0
+
+  while lowres < MAX_LOWRES.get(codec, 0) and min(width, height) >> (lowres + 1) >= shorter_side:
+    lowres += 1
+
+  return lowres
 
 def video_has_sound(source):
   """
@@ -66,7 +638,7 @@ def video_to_sound(source, target):
   """
 
   # convert video to sound
-  cmd2 = ["ffmpeg", "-i", source, target]
+  cmd2 = ["ffmpeg"] + autotune.ffmpeg_threads() + ["-i", source] + autotune.ffmpeg_threads() + [target]
 
   try:
     subprocess.check_call(cmd2)
@@ -84,18 +656,19 @@ def resize(frame, shorter_side=256):
   :return:                Resized frame.
   """
 
-  if frame.shape[0] > frame.shape[1]:
-    long = frame.shape[0]
-    short = frame.shape[1]
-  else:
-    short = frame.shape[0]
-    long = frame.shape[1]
+  return cv2.resize(frame, get_resized_size(frame.shape[1], frame.shape[0], shorter_side=shorter_side))
 
-  fract = shorter_side / short
-  target_long = int(long * fract)
+def get_resized_size(width, height, shorter_side=256):
+  """
+  Compute the size of a resized frame (see resize).
+  :param width:           Width of the frame.
+  :param height:          Height of the frame.
+  :param shorter_side:    Size of the target shorter side.
+  :return:                Tuple: target width and height.
+  """
 
-  if frame.shape[0] > frame.shape[1]:
-    return cv2.resize(frame, (shorter_side, target_long))
+  if height > width:
+    return shorter_side, int(height * (shorter_side / width))
   else:
-    return cv2.resize(frame, (target_long, shorter_side))
+    return int(width * (shorter_side / height)), shorter_side
 
@@ -0,0 +1,191 @@
+import collections, json, threading
+
+import lib.config as config
+
+class WorkGroup:
+  """
+  A part of the planned work (e.g. one category of one split) that is accounted for separately.
+  """
+
+  def __init__(self, split, category, classes, target_directory, source_directory=None, label_index=None):
+    """
+    :param split:               Name of the split (constants.TRAIN, VALID or TEST).
+    :param category:            Name of the category, None if the classes were selected directly.
+    :param classes:             List of classes, None if the videos are not in class directories (the test set).
+    :param target_directory:    Where to save the results.
+    :param source_directory:    Directory with videos, None for downloads.
+    :param label_index:         Videos indexed by labels (see metadata.build_label_index), only for downloads.
+    """
+
+    self.split = split
+    self.category = category
+    self.classes = classes
+    self.target_directory = target_directory
+    self.source_directory = source_directory
+    self.label_index = label_index
+
+  @property
+  def name(self):
+    """
+    Name of the group used in the results.
+    :return:    The name.
+    """
+
+    if self.category is None:
+      return self.split
+
+    return "{}/{}".format(self.split, self.category)
+
+def get_categories(names=None):
+  """
+  Load the classes of categories.
+  :param names:     List of category names, None for all categories.
+  :return:          List of (category, classes) tuples.
+  """
+
+  with open(config.CATEGORIES_PATH, "r") as file:
+    categories = json.load(file)
+
+  if names is None:
+    names = list(categories.keys())
+
+  for name in names:
+    if name not in categories:
+      raise ValueError("Category {} not found.".format(name))
+
+  return [(name, categories[name]) for name in names]
+
+def plan_groups(categories, splits):
+  """
+  Plan the work of a whole run up front. Each class is planned only once even if it belongs to multiple categories.
+  :param categories:    List of (category, classes) tuples, the category can be None.
+  :param splits:        List of (split, source directory, target directory, label index) tuples.
+  :return:              List of work groups.
+  """
+
+  groups = []
+
+  for split, source_directory, target_directory, label_index in splits:
+    seen = set()
+
+    for category, classes in categories:
+      unique = []
+
+      for cls in classes:
+        if cls.lower() not in seen:
+          seen.add(cls.lower())
+          unique.append(cls)
+
+      if len(unique) > 0:
+        groups.append(WorkGroup(split, category, unique, target_directory, source_directory=source_directory,
+                                label_index=label_index))
+
+  return groups
+
+# result of one video (or one section of it) reported by a worker
+Result = collections.namedtuple("Result", ["group_name", "status", "video_id"])
+
+class ResultCounter:
+  """
+  Counts the results of all workers of a pool by work group. Workers put lists of results into the results queue
+  (see batch_queue.BatchWriter) and a thread in the main process collects them.
+  """
+
+  def __init__(self, results_queue, listener=None):
+    """
+    :param results_queue:     Queue of lists of results.
+    :param listener:          Called with the group name, status and video id of each collected result (e.g. to report
+                              finished videos to a coordinator), None for no listener.
+    """
+
+    self.results_queue = results_queue
+    self.listener = listener
+    self.counts = {}
+    self.num_collected = 0
+    self.lock = threading.Lock()
+    self.thread = None
+
+  def add(self, group_name, status, count=1):
+    """
+    Count a result.
+    :param group_name:    Name of the work group.
+    :param status:        Status of the video (constants.JOB_STATUS_*).
+    :param count:         Number of videos.
+    :return:              None.
+    """
+
+    with self.lock:
+      group_counts = self.counts.setdefault(group_name, {})
+      group_counts[status] = group_counts.get(status, 0) + count
+
+  def collect(self):
+    """
+    Collect results until the end signal.
+    :return:    None.
+    """
+
+    while True:
+      results = self.results_queue.get()
+
+      if results is None:
+        break
+
+      self.num_collected += len(results)
+
+      for group_name, status, video_id in results:
+        self.add(group_name, status)
+
+        if self.listener is not None:
+          self.listener(group_name, status, video_id)
+
+  def start(self):
+    """
+    Start collecting results.
+    :return:    None.
+    """
+
+    self.thread = threading.Thread(target=self.collect, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    """
+    Collect the remaining results and stop.
+    :return:    Dictionary with group names as keys and dictionaries of status counts as values.
+    """
+
+    if self.thread is not None:
+      self.results_queue.put(None)
+      self.thread.join()
+      self.thread = None
+
+    return self.counts
+
+def format_summary(counts):
+  """
+  Format the results of a pool.
+  :param counts:    Result counts returned by ResultCounter.stop.
+  :return:          Summary string, one line per group and a total.
+  """
+
+  lines = []
+  total = {}
+
+  for group_name in sorted(counts.keys()):
+    group_counts = counts[group_name]
+    lines.append("{}: {}".format(group_name, format_counts(group_counts)))
+
+    for status, count in group_counts.items():
+      total[status] = total.get(status, 0) + count
+
+  lines.append("total: {}".format(format_counts(total)))
+
+  return "\n".join(lines)
+
+def format_counts(counts):
+  """
+  Format status counts.
+  :param counts:    Dictionary of status counts.
+  :return:          String.
+  """
+
+  return ", ".join("{:d} {}".format(counts[status], status) for status in sorted(counts.keys()))
@@ -0,0 +1,29 @@
+import argparse
+
+import lib.sharding as sharding
+
+def main(args):
+
+  for path in args.logs:
+    shard_paths = [sharding.shard_path(path, args.num_shards, index) for index in range(args.num_shards)]
+    num_ids = sharding.merge_id_logs(shard_paths, path)
+    print("{}: {:d} videos".format(path, num_ids))
+
+  for path in args.state_dbs:
+    shard_paths = [sharding.shard_path(path, args.num_shards, index) for index in range(args.num_shards)]
+    num_records = sharding.merge_state_dbs(shard_paths, path)
+    print("{}: {:d} records".format(path, num_records))
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Combine the logs and job state databases written by shards of a run.")
+
+  parser.add_argument("--num-shards", type=int, required=True, help="number of shards of the run")
+  parser.add_argument("--logs", nargs="+", default=[],
+                      help="logs of video ids as passed to the scripts (e.g. dataset/failed.txt), the logs of all "
+                           "shards are combined into them")
+  parser.add_argument("--state-dbs", nargs="+", default=[],
+                      help="job state databases as passed to the scripts (e.g. dataset/state.db)")
+
+  parsed = parser.parse_args()
+  main(parsed)
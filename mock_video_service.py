@@ -0,0 +1,47 @@
+import argparse, os
+
+import lib.mock_service as mock_service
+import lib.rate_limit as rate_limit
+
+def main(args):
+
+  if not os.path.isfile(args.video):
+    print("generating {}".format(args.video))
+    mock_service.generate_video(args.video, duration=args.video_duration)
+
+  bandwidth = rate_limit.parse_size(args.bandwidth) if args.bandwidth is not None else None
+
+  service = mock_service.MockVideoService(args.video, host=args.host, port=args.port, latency=args.latency,
+                                          bandwidth=bandwidth, failure_rate=args.failure_rate,
+                                          unavailable_rate=args.unavailable_rate, seed=args.seed)
+
+  print("serving on {}".format(service.base_url))
+
+  try:
+    service.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    print("{:d} requests, {:d} bytes sent".format(service.num_requests, service.num_bytes))
+    service.server.server_close()
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser("Serve a test video under any YouTube id, use with download.py --fetcher http.")
+
+  parser.add_argument("--video", default="dataset/mock_video.mp4",
+                      help="video to serve, a synthetic video is generated if the file does not exist")
+  parser.add_argument("--video-duration", type=int, default=20, help="duration of the generated video in seconds")
+  parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+  parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+  parser.add_argument("--latency", type=float, default=0.0, help="delay before each response in seconds")
+  parser.add_argument("--bandwidth", help="bandwidth of each response in bytes per second, K, M and G suffixes are "
+                                          "supported (e.g. 2M)")
+  parser.add_argument("--failure-rate", type=float, default=0.0,
+                      help="fraction of requests that fail with HTTP 503 (transient error)")
+  parser.add_argument("--unavailable-rate", type=float, default=0.0,
+                      help="fraction of video ids that always fail with HTTP 404 (permanent error)")
+  parser.add_argument("--seed", type=int, help="random seed of the transient failures")
+
+  parsed = parser.parse_args()
+  main(parsed)
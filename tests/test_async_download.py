@@ -0,0 +1,113 @@
+import os, shutil, tempfile, time, unittest
+from unittest import mock
+
+import lib.async_download as async_download
+import lib.constants as constants
+import lib.job_state as job_state
+import lib.mock_service as mock_service
+import lib.parallel_download as parallel_download
+import lib.work_plan as work_plan
+
+class TestAsyncDownload(unittest.TestCase):
+
+  def setUp(self):
+
+    self.dir = tempfile.mkdtemp()
+    self.video_path = os.path.join(self.dir, "source.mp4")
+
+    with open(self.video_path, "wb") as file:
+      file.write(os.urandom(600 * 1024))
+
+    self.target_dir = os.path.join(self.dir, "train")
+    label_index = {"jogging": [("a", 0, 10), ("b", 0, 10), ("c", 0, 10)]}
+    self.groups = [work_plan.WorkGroup(constants.TRAIN, None, ["jogging"], self.target_dir, label_index=label_index)]
+
+  def tearDown(self):
+
+    shutil.rmtree(self.dir)
+
+  def start_service(self, **kwargs):
+
+    service = mock_service.MockVideoService(self.video_path, **kwargs)
+    service.start()
+    self.addCleanup(service.stop)
+
+    return service
+
+  def create_pool(self, service, num_workers=2, **kwargs):
+
+    return async_download.AsyncPool(self.groups, num_workers, os.path.join(self.dir, "failed.txt"), False, False,
+                                    False, fetcher=constants.FETCHER_HTTP, fetcher_url=service.base_url, **kwargs)
+
+  def test_unavailable_videos(self):
+
+    service = self.start_service(unavailable_rate=1.0)
+    state_db = os.path.join(self.dir, "state.db")
+    unavailable_file = os.path.join(self.dir, "unavailable.txt")
+
+    counts = self.create_pool(service, state_db=state_db, unavailable_file=unavailable_file).run()
+
+    self.assertEqual(counts, {constants.TRAIN: {constants.JOB_STATUS_PERMANENT: 3}})
+
+    # the writer threads recorded every video
+    self.assertEqual(sorted(parallel_download.read_ids(unavailable_file)), ["a", "b", "c"])
+    self.assertEqual(sorted(parallel_download.read_ids(os.path.join(self.dir, "failed.txt"))), ["a", "b", "c"])
+
+    ledger = job_state.JobLedger(state_db)
+    self.assertEqual(ledger.get("a", constants.STAGE_DOWNLOAD)["status"], constants.JOB_STATUS_PERMANENT)
+    ledger.close()
+
+  def test_errors_fail_only_their_video(self):
+
+    service = self.start_service(unavailable_rate=1.0)
+    download_request = parallel_download.download_request
+
+    def fail_b(request, *args, **kwargs):
+      if request[0] == "b":
+        raise OSError("disk error")
+      return download_request(request, *args, **kwargs)
+
+    with mock.patch.object(parallel_download, "download_request", side_effect=fail_b):
+      counts = self.create_pool(service).run()
+
+    self.assertEqual(counts, {constants.TRAIN: {constants.JOB_STATUS_PERMANENT: 2, constants.JOB_STATUS_FAILED: 1}})
+
+  def test_download_timeout(self):
+
+    service = self.start_service(latency=5.0)
+    state_db = os.path.join(self.dir, "state.db")
+
+    start_time = time.time()
+    counts = self.create_pool(service, state_db=state_db, download_timeout=0.2).run()
+
+    # the downloads are cancelled instead of waiting for the response
+    self.assertLess(time.time() - start_time, 5.0)
+    self.assertEqual(counts, {constants.TRAIN: {constants.JOB_STATUS_FAILED: 3}})
+    self.assertEqual(os.listdir(os.path.join(self.target_dir, "jogging")), [])
+
+    # only the timeout is recorded
+    self.assertEqual(sorted(parallel_download.read_ids(os.path.join(self.dir, "failed.txt"))), ["a", "b", "c"])
+
+    ledger = job_state.JobLedger(state_db)
+    state = ledger.get("a", constants.STAGE_DOWNLOAD)
+    ledger.close()
+
+    self.assertEqual((state["status"], state["error"], state["attempts"]),
+                     (constants.JOB_STATUS_FAILED, constants.ERROR_TIMEOUT, 1))
+
+  def test_timeout_starts_with_download(self):
+
+    service = self.start_service(latency=0.3, unavailable_rate=1.0)
+
+    # each download takes less than the timeout, but waiting for the single thread takes longer
+    counts = self.create_pool(service, num_workers=1, download_timeout=0.6).run()
+
+    self.assertEqual(counts, {constants.TRAIN: {constants.JOB_STATUS_PERMANENT: 3}})
+
+  def test_unsupported_options(self):
+
+    service = self.start_service()
+
+    for kwargs in [{"cut_timeout": 60}, {"max_requeues": 0}, {"autotune": True}]:
+      with self.assertRaises(ValueError):
+        self.create_pool(service, **kwargs)
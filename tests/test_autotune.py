@@ -0,0 +1,80 @@
+import time, unittest
+from multiprocessing import Queue
+
+import lib.autotune as autotune
+import lib.batch_queue as batch_queue
+import lib.supervisor as supervisor
+
+class FakeSupervisor:
+
+  def __init__(self, num_workers):
+
+    self.num_workers = num_workers
+
+def echo_worker(items_queue, output_queue, slot):
+
+  requests = batch_queue.BatchReader(items_queue, slot=slot)
+
+  while True:
+    slot.idle()
+    item = requests.get()
+
+    if item is None:
+      break
+
+    slot.begin(item)
+    output_queue.put(item)
+
+class TestAutotune(unittest.TestCase):
+
+  def test_search_converges_on_best_configuration(self):
+
+    tuner = autotune.Autotuner("test", FakeSupervisor(4), None, max_workers=16)
+
+    # throughput grows up to 10 workers and drops after that
+    def throughput(num_workers):
+      return num_workers if num_workers <= 10 else 20 - num_workers
+
+    num_workers = 4
+    tried = []
+
+    while not tuner.converged:
+      tried.append(num_workers)
+      num_workers = tuner.choose(num_workers, throughput(num_workers))
+
+    self.assertEqual(num_workers, 10)
+    self.assertEqual(len(tried), len(set(tried)))
+    self.assertTrue(all(1 <= tried_workers <= 16 for tried_workers in tried))
+
+  def test_threads_are_pinned(self):
+
+    self.addCleanup(autotune.set_worker_threads, None)
+
+    autotune.set_worker_threads(2)
+    self.assertEqual(autotune.ffmpeg_threads(), ["-threads", "2"])
+
+    autotune.set_worker_threads(0)
+    self.assertEqual(autotune.ffmpeg_threads(), [])
+
+  def test_supervisor_resize(self):
+
+    items_queue = batch_queue.BatchQueue(max_batches=10)
+    output_queue = Queue()
+
+    worker_supervisor = supervisor.Supervisor("test", echo_worker, (items_queue, output_queue), 3, items_queue,
+                                              check_interval=0.05)
+    worker_supervisor.start()
+
+    worker_supervisor.resize(1)
+    items_queue.put_many(["a", "b", "c"])
+    worker_supervisor.resize(2)
+    time.sleep(0.3)
+
+    # retired workers exit after their next batch and are not replaced
+    active = [slot for _, slot in worker_supervisor.workers if not slot.is_retired()]
+    self.assertEqual(len(active), 2)
+    self.assertEqual(sorted(output_queue.get(timeout=1) for _ in range(3)), ["a", "b", "c"])
+
+    worker_supervisor.stop()
+    self.assertEqual(worker_supervisor.num_crashed, 0)
+    self.assertEqual(worker_supervisor.workers, [])
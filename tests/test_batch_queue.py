@@ -0,0 +1,154 @@
+import os, threading, time, unittest
+from multiprocessing import Queue
+
+import lib.batch_queue as batch_queue
+import lib.supervisor as supervisor
+
+def batch_worker(items_queue, output_queue, slot):
+  """
+  Crashes on "crash" and echoes all other items, the echoes are sent in batches.
+  """
+
+  results = batch_queue.BatchWriter(output_queue, slot=slot)
+  requests = batch_queue.BatchReader(items_queue, before_wait=results.flush, slot=slot)
+
+  while True:
+    slot.idle()
+    item = requests.get()
+
+    if item is None:
+      break
+
+    slot.begin(item)
+
+    if item == "crash":
+      os._exit(1)
+
+    results.put(item)
+
+def buffering_worker(items_queue, output_queue, slot):
+  """
+  Crashes on "crash" and echoes all other items once it receives the end signal, like a worker that saves its output
+  at the end.
+  """
+
+  results = batch_queue.BatchWriter(output_queue, slot=slot)
+  requests = batch_queue.BatchReader(items_queue, slot=slot)
+  unfinished = []
+
+  while True:
+    slot.idle()
+    item = requests.get()
+
+    if item is None:
+      break
+
+    slot.begin(item)
+
+    if item == "crash":
+      os._exit(1)
+
+    unfinished.append(item)
+    slot.hold_unfinished(unfinished)
+
+  for item in unfinished:
+    results.put(item)
+
+  results.flush()
+
+def collect(output_queue):
+
+  items = []
+
+  while not output_queue.empty():
+    items += output_queue.get()
+
+  return items
+
+class TestBatchQueue(unittest.TestCase):
+
+  def test_batch_size_adapts(self):
+
+    items_queue = batch_queue.BatchQueue(max_batches=2, max_batch_size=8)
+    items_queue.put_batch(["a"])
+    items_queue.put_batch(["b"])
+
+    # the queue is full, the consumer is behind and gets larger batches
+    consumer = threading.Timer(0.1, items_queue.get_batch)
+    consumer.start()
+    items_queue.put_batch(["c"])
+    consumer.join()
+    self.assertEqual(items_queue.batch_size, 2)
+
+    # the consumer emptied the queue and is waiting for more
+    items_queue.get_batch()
+    items_queue.get_batch()
+    items_queue.put_batch(["d"])
+    self.assertEqual(items_queue.batch_size, 1)
+
+  def test_last_items_are_shared(self):
+
+    items_queue = batch_queue.BatchQueue(num_consumers=2, max_batches=10)
+    items_queue.batch_size = 8
+
+    items_queue.put_many(list("abcde"))
+
+    batches = [items_queue.get_batch() for _ in range(4)]
+    self.assertEqual(batches, [["a", "b"], ["c"], ["d"], ["e"]])
+
+  def test_reader_and_writer(self):
+
+    items_queue = batch_queue.BatchQueue(max_batches=10)
+    output_queue = Queue()
+    results = batch_queue.BatchWriter(output_queue, max_batch_size=3, max_delay=60)
+    requests = batch_queue.BatchReader(items_queue, before_wait=results.flush)
+
+    items_queue.put_batch(["a", "b"])
+    items_queue.put(None)
+
+    self.assertEqual(requests.get(), "a")
+    self.assertEqual(list(requests.items), ["b"])
+    results.put("a")
+    self.assertEqual(requests.get(), "b")
+    results.put("b")
+    self.assertEqual(results.records, ["a", "b"])
+
+    # the results are sent before the reader waits for the next batch
+    self.assertIsNone(requests.get())
+    self.assertEqual(output_queue.get(timeout=1), ["a", "b"])
+
+  def test_crashed_worker_loses_no_items(self):
+
+    items_queue = batch_queue.BatchQueue(max_batches=10)
+    output_queue = Queue()
+
+    worker_supervisor = supervisor.Supervisor("test", batch_worker, (items_queue, output_queue), 1, items_queue,
+                                              max_requeues=0, check_interval=0.05, results_queue=output_queue)
+    worker_supervisor.start()
+
+    items_queue.put_batch(["a", "b", "crash", "c", "d"])
+    worker_supervisor.stop()
+    time.sleep(0.1)
+
+    # the results sent before the crash and the items after it are not lost
+    self.assertEqual(sorted(collect(output_queue)), ["a", "b", "c", "d"])
+    self.assertEqual(worker_supervisor.num_crashed, 1)
+    self.assertEqual(worker_supervisor.num_given_up, 1)
+
+  def test_crashed_worker_requeues_unfinished_items(self):
+
+    items_queue = batch_queue.BatchQueue(max_batches=10)
+    output_queue = Queue()
+
+    worker_supervisor = supervisor.Supervisor("test", buffering_worker, (items_queue, output_queue), 1, items_queue,
+                                              max_requeues=0, check_interval=0.05, results_queue=output_queue)
+    worker_supervisor.start()
+
+    items_queue.put_batch(["a", "b", "crash", "c"])
+    worker_supervisor.stop()
+    time.sleep(0.1)
+
+    # the items processed before the crash lost their output and are processed again
+    self.assertEqual(sorted(collect(output_queue)), ["a", "b", "c"])
+    self.assertEqual(worker_supervisor.num_crashed, 1)
+    self.assertEqual(worker_supervisor.num_given_up, 1)
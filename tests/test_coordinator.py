@@ -0,0 +1,150 @@
+import queue, threading, time, unittest
+
+import lib.batch_queue as batch_queue
+import lib.constants as constants
+import lib.coordinator as coordinator
+import lib.work_plan as work_plan
+
+class FakePool:
+  """
+  Stands in for a started pool: a thread processes the leased items and reports one result per target.
+  """
+
+  def __init__(self, fail_ids=()):
+
+    self.videos_queue = batch_queue.BatchQueue(max_batches=5)
+    self.results_queue = queue.Queue()
+    self.result_counter = work_plan.ResultCounter(self.results_queue)
+    self.fail_ids = set(fail_ids)
+    self.processed = []
+
+    self.result_counter.start()
+    self.thread = threading.Thread(target=self.work, daemon=True)
+    self.thread.start()
+
+  def work(self):
+
+    results = batch_queue.BatchWriter(self.results_queue)
+    requests = batch_queue.BatchReader(self.videos_queue, before_wait=results.flush)
+
+    while True:
+      request = requests.get()
+
+      if request is None:
+        break
+
+      video_id, targets = request
+      self.processed.append(video_id)
+      status = constants.JOB_STATUS_FAILED if video_id in self.fail_ids else constants.JOB_STATUS_DONE
+
+      for target in targets:
+        results.put(work_plan.Result(target[-1], status, video_id))
+
+  def stop(self):
+
+    self.videos_queue.put(None)
+    self.thread.join()
+
+    return self.result_counter.stop()
+
+def get_items(num_items):
+
+  return [["vid{:d}".format(i), [["train/a", 0, 10, "train"], ["valid/a", 0, 10, "valid"]]] for i in range(num_items)]
+
+class TestCoordinator(unittest.TestCase):
+
+  def test_expired_leases_are_requeued(self):
+
+    work_coordinator = coordinator.WorkCoordinator(get_items(5), lease_timeout=0.05)
+
+    lease_id, items = work_coordinator.lease("worker", 3)
+    self.assertEqual([item[0] for item in items], ["vid0", "vid1", "vid2"])
+
+    time.sleep(0.1)
+
+    # the expired lease cannot be renewed or completed, its items are handed out again
+    self.assertFalse(work_coordinator.heartbeat(lease_id))
+    self.assertFalse(work_coordinator.complete(lease_id, {"vid0": constants.JOB_STATUS_DONE}))
+    self.assertEqual(work_coordinator.status()["pending"], 5)
+
+  def test_tracker_drops_expired_leases(self):
+
+    work_coordinator = coordinator.WorkCoordinator(get_items(2), lease_timeout=0.05)
+    # the coordinator has the interface of the client
+    tracker = coordinator.LeaseTracker(work_coordinator, heartbeat_interval=0.01)
+
+    first_id, items = work_coordinator.lease("worker", 2)
+    tracker.add(first_id, items)
+    time.sleep(0.1)
+
+    # vid0 is leased again, the expired lease is no longer tracked
+    second_id, items = work_coordinator.lease("worker", 1)
+    self.assertEqual([item[0] for item in items], ["vid0"])
+    tracker.add(second_id, items)
+    self.assertEqual(list(tracker.leases.keys()), [second_id])
+
+    # a late result of vid1 from the first lease is ignored, vid0 completes the second lease
+    tracker.on_result("train", constants.JOB_STATUS_DONE, "vid1")
+    tracker.on_result("train", constants.JOB_STATUS_DONE, "vid0")
+    self.assertEqual(tracker.leases, {})
+    self.assertEqual(work_coordinator.status()["results"], {constants.JOB_STATUS_DONE: 1})
+
+    # a lease that cannot be renewed any more is dropped by the heartbeat thread
+    third_id, items = work_coordinator.lease("worker", 1)
+    tracker.add(third_id, items)
+    time.sleep(0.1)
+    tracker.start()
+
+    deadline = time.time() + 5
+    while len(tracker.leases) > 0 and time.time() < deadline:
+      time.sleep(0.01)
+
+    tracker.stop()
+    self.assertEqual(tracker.leases, {})
+    self.assertEqual(tracker.lease_by_id, {})
+
+  def test_items_without_results_are_requeued(self):
+
+    work_coordinator = coordinator.WorkCoordinator(get_items(2))
+
+    lease_id, _ = work_coordinator.lease("worker", 2)
+    self.assertTrue(work_coordinator.heartbeat(lease_id))
+    self.assertTrue(work_coordinator.complete(lease_id, {"vid0": constants.JOB_STATUS_DONE}))
+
+    status = work_coordinator.status()
+    self.assertEqual(status["pending"], 1)
+    self.assertEqual(status["results"], {constants.JOB_STATUS_DONE: 1})
+    self.assertFalse(work_coordinator.is_finished())
+
+  def test_workers_on_localhost(self):
+
+    work_coordinator = coordinator.WorkCoordinator(get_items(23))
+    server = coordinator.CoordinatorServer(work_coordinator)
+    server.start()
+    self.addCleanup(server.stop)
+
+    pools = [FakePool(fail_ids=["vid3"]), FakePool(fail_ids=["vid3"])]
+    threads = []
+
+    for index, pool in enumerate(pools):
+      client = coordinator.CoordinatorClient(server.url, "worker{:d}".format(index))
+      thread = threading.Thread(target=coordinator.feed_pool, args=(pool, client),
+                                kwargs={"lease_size": 4, "num_results": lambda item: len(item[1]),
+                                        "poll_interval": 0.05})
+      thread.start()
+      threads.append(thread)
+
+    for thread in threads:
+      thread.join(timeout=10)
+      self.assertFalse(thread.is_alive())
+
+    # every video was processed exactly once and returned with its worst status
+    processed = sorted(pools[0].processed + pools[1].processed)
+    self.assertEqual(processed, sorted("vid{:d}".format(i) for i in range(23)))
+
+    status = coordinator.CoordinatorClient(server.url, "observer").status()
+    self.assertTrue(status["finished"])
+    self.assertEqual(status["results"], {constants.JOB_STATUS_DONE: 22, constants.JOB_STATUS_FAILED: 1})
+
+    counts = [pool.stop() for pool in pools]
+    self.assertEqual(sum(count["train"].get(constants.JOB_STATUS_DONE, 0) for count in counts), 22)
@@ -0,0 +1,30 @@
+import os, shutil, tempfile, unittest
+
+import lib.disk_space as disk_space
+
+class TestDiskSpace(unittest.TestCase):
+
+  def setUp(self):
+
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+
+    shutil.rmtree(self.dir)
+
+  def test_free_space_of_missing_directory(self):
+
+    missing = os.path.join(self.dir, "a", "b")
+
+    self.assertGreater(disk_space.get_free_space(missing), 0)
+
+  def test_guard(self):
+
+    free_space = disk_space.get_free_space(self.dir)
+
+    guard = disk_space.DiskSpaceGuard([self.dir, self.dir], 1)
+    self.assertIsNone(guard.find_full_volume())
+    self.assertEqual(guard.wait(), 0.0)
+
+    guard = disk_space.DiskSpaceGuard([self.dir], free_space * 1000)
+    self.assertEqual(guard.find_full_volume()[0], self.dir)
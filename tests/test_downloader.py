@@ -0,0 +1,220 @@
+import json, os, shutil, sys, tempfile, threading, time, types, unittest
+from unittest import mock
+
+import lib.constants as constants
+import lib.downloader as downloader
+
+class TestDownloader(unittest.TestCase):
+
+  def test_classify_permanent_failures(self):
+
+    for stderr in ["ERROR: Video unavailable", "ERROR: Private video\nSign in if you've been granted access",
+                   "ERROR: This video has been removed by the user",
+                   "ERROR: This video is not available in your country"]:
+      self.assertEqual(downloader.classify_failure(1, stderr), constants.ERROR_PERMANENT)
+
+  def test_classify_transient_failures(self):
+
+    for stderr in ["ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests",
+                   "ERROR: unable to download video data: HTTP Error 503: Service Unavailable",
+                   "ERROR: Unable to download webpage: <urlopen error [Errno -3] Temporary failure in name resolution>"]:
+      self.assertEqual(downloader.classify_failure(1, stderr), constants.ERROR_TRANSIENT)
+
+    self.assertEqual(downloader.classify_failure(-9, ""), constants.ERROR_TRANSIENT)
+
+  def test_classify_unknown_failures(self):
+
+    self.assertEqual(downloader.classify_failure(1, "ERROR: something unexpected"), constants.ERROR_UNKNOWN)
+
+  def test_backoff_delay(self):
+
+    for attempt in range(10):
+      delay = downloader.backoff_delay(attempt, 2.0, 60.0)
+      expected = min(60.0, 2.0 * 2 ** attempt)
+
+      self.assertGreaterEqual(delay, 0.5 * expected)
+      self.assertLessEqual(delay, 1.5 * expected)
+
+  def test_get_fetcher(self):
+
+    self.assertIsInstance(downloader.get_fetcher(constants.FETCHER_SUBPROCESS), downloader.SubprocessFetcher)
+
+    with self.assertRaises(ValueError):
+      downloader.get_fetcher("invalid")
+
+  def test_cancel_kills_subprocess(self):
+
+    with tempfile.TemporaryDirectory() as directory:
+      # a youtube-dl that hangs
+      with open(os.path.join(directory, "youtube-dl"), "w") as file:
+        file.write("#!/bin/sh\nsleep 60\n")
+
+      os.chmod(os.path.join(directory, "youtube-dl"), 0o755)
+
+      fetcher = downloader.SubprocessFetcher()
+      cancelled = threading.Event()
+      outcome = []
+
+      def download():
+        outcome.append(downloader.download_video("abc", os.path.join(directory, "abc.mp4"), retries=3,
+                                                 fetcher=fetcher, cancelled=cancelled))
+
+      with mock.patch.dict(os.environ, {"PATH": directory + os.pathsep + os.environ["PATH"]}):
+        thread = threading.Thread(target=download)
+        start_time = time.time()
+        thread.start()
+        time.sleep(0.5)
+
+        cancelled.set()
+        fetcher.cancel()
+        thread.join(10)
+
+      # the download is not retried and later downloads fail right away
+      self.assertLess(time.time() - start_time, 10)
+      self.assertEqual(outcome, [(False, constants.ERROR_UNKNOWN)])
+      self.assertEqual(fetcher.fetch("def", os.path.join(directory, "def.mp4"), "best"),
+                       (1, downloader.CANCELLED_ERROR))
+
+  def test_library_fetcher_selects_format(self):
+
+    downloads = []
+
+    class YoutubeDL:
+      # like yt-dlp, the format selector is parsed once when the instance is created
+
+      def __init__(self, params):
+        self.params = params
+        self.format_selector = self.build_format_selector(params.get("format", "best"))
+
+      def build_format_selector(self, format_spec):
+        return "selector({})".format(format_spec)
+
+      def download(self, urls):
+        downloads.append((self.format_selector, self.params["outtmpl"]["default"]))
+        return 0
+
+    library = types.SimpleNamespace(YoutubeDL=YoutubeDL, utils=types.SimpleNamespace(DownloadError=Exception))
+
+    with mock.patch.dict(sys.modules, {"yt_dlp": library}):
+      fetcher = downloader.get_fetcher(constants.FETCHER_API)
+
+    audio_spec = downloader.get_format_spec(audio_only=True)
+    video_spec = downloader.get_format_spec(target_resolution=256)
+
+    self.assertEqual(fetcher.fetch("abc", "abc.m4a", audio_spec), (0, ""))
+    self.assertEqual(fetcher.fetch("def", "def.mp4", video_spec), (0, ""))
+    self.assertEqual(downloads, [("selector({})".format(audio_spec), "abc.m4a"),
+                                 ("selector({})".format(video_spec), "def.mp4")])
+
+  def test_download_video_retries_with_fetcher(self):
+
+    class FlakyFetcher:
+
+      def __init__(self):
+        self.calls = 0
+
+      def fetch(self, video_id, download_path, format_spec):
+        self.calls += 1
+
+        if self.calls < 3:
+          return 1, "ERROR: HTTP Error 503: Service Unavailable"
+
+        return 0, ""
+
+    fetcher = FlakyFetcher()
+    success, error = downloader.download_video("abc", "abc.mp4", retries=2, backoff_base=0.0, fetcher=fetcher)
+
+    self.assertTrue(success)
+    self.assertIsNone(error)
+    self.assertEqual(fetcher.calls, 3)
+
+  def test_format_spec(self):
+
+    self.assertEqual(downloader.get_format_spec("mp4"), "bestvideo[ext=mp4]+bestaudio/best")
+    self.assertTrue(downloader.get_format_spec("mp4", audio_only=True).startswith("bestaudio"))
+
+    alternatives = downloader.get_format_spec("mp4", target_resolution=256).split("/")
+
+    # the smallest format that meets the target is preferred, the best format is the last resort
+    self.assertEqual(alternatives[0], "worstvideo[height>=256][width>=256][ext=mp4]+bestaudio")
+    self.assertEqual(alternatives[-1], "best")
+
+class TestFastCut(unittest.TestCase):
+
+  VIDEO_STREAM = {"codec_type": "video", "codec_name": "h264", "avg_frame_rate": "25/1", "profile": "High",
+                  "level": 40, "pix_fmt": "yuv420p", "width": 640, "height": 360}
+  AUDIO_STREAM = {"codec_type": "audio", "codec_name": "aac"}
+
+  def setUp(self):
+
+    self.dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.dir)
+    self.slice_path = os.path.join(self.dir, "slice.mp4")
+
+    # commands run by ffmpeg_slice and splice_video
+    self.commands = []
+    patcher = mock.patch("subprocess.call", side_effect=lambda cmd: self.commands.append(cmd) or 0)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def cut(self, keyframes, head_stream=None):
+
+    probe = (self.VIDEO_STREAM, "aac", 25.0, keyframes)
+    head_streams = [head_stream or self.VIDEO_STREAM, self.AUDIO_STREAM]
+
+    with mock.patch("lib.downloader.probe_keyframes", return_value=probe), \
+        mock.patch("lib.downloader.probe_streams", return_value=head_streams):
+      return downloader.cut_video_fast("raw.mp4", self.slice_path, 10.0, 20.0)
+
+  def test_probe_keyframes(self):
+
+    packets = {"packets": [{"pts_time": "12.000000", "flags": "K_"}, {"pts_time": "10.000000", "flags": "K_"},
+                           {"pts_time": "10.040000", "flags": "__"}]}
+    streams = {"streams": [self.VIDEO_STREAM, self.AUDIO_STREAM]}
+
+    with mock.patch("subprocess.check_output", side_effect=[json.dumps(packets).encode(),
+                                                            json.dumps(streams).encode()]) as check_output:
+      self.assertEqual(downloader.probe_keyframes("raw.mp4", 10.0, 20.0),
+                       (self.VIDEO_STREAM, "aac", 25.0, [10.0, 12.0]))
+
+    # only the packets of the section are read
+    self.assertIn("10.000000%20.000000", check_output.call_args_list[0][0][0])
+
+  def test_cut_on_keyframe_copies(self):
+
+    self.assertEqual(self.cut([10.0, 12.0]), (True, constants.CUT_PATH_COPY))
+    self.assertEqual(len(self.commands), 1)
+    self.assertIn("copy", self.commands[0])
+
+  def test_cut_between_keyframes_splices(self):
+
+    self.assertEqual(self.cut([8.0, 12.0]), (True, constants.CUT_PATH_SPLICE))
+
+    head, tail, concat = self.commands
+
+    # the head is re-encoded with the parameters of the video up to the keyframe
+    self.assertEqual(head[head.index("-t") + 1], "2.0")
+    self.assertEqual(head[head.index("-profile:v") + 1:head.index("-profile:v") + 6],
+                     ["high", "-level", "40", "-pix_fmt", "yuv420p"])
+    self.assertEqual(tail[tail.index("-ss") + 1], "12.0")
+    self.assertIn("copy", tail)
+    self.assertIn("concat", concat)
+    self.assertEqual(concat[-1], self.slice_path)
+    self.assertEqual(os.listdir(self.dir), [])
+
+  def test_mismatched_head_is_reencoded(self):
+
+    head_stream = dict(self.VIDEO_STREAM, profile="High 4:4:4 Predictive", pix_fmt="yuv444p")
+
+    self.assertEqual(self.cut([8.0, 12.0], head_stream=head_stream), (True, constants.CUT_PATH_REENCODE))
+
+    # the head is dropped and the whole section is re-encoded
+    self.assertEqual(len(self.commands), 2)
+    self.assertEqual(self.commands[-1][self.commands[-1].index("-t") + 1], "10.0")
+    self.assertNotIn("copy", self.commands[-1])
+
+  def test_cut_without_keyframe_is_reencoded(self):
+
+    self.assertEqual(self.cut([8.0]), (True, constants.CUT_PATH_REENCODE))
+    self.assertEqual(len(self.commands), 1)
+    self.assertNotIn("copy", self.commands[0])
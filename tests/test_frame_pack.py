@@ -0,0 +1,57 @@
+import os, shutil, tempfile, unittest
+
+import lib.frame_pack as frame_pack
+
+class TestFramePack(unittest.TestCase):
+
+  def setUp(self):
+
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, "video.frames")
+    self.frames = [os.urandom(size) for size in [10, 0, 300, 7]]
+
+  def tearDown(self):
+
+    shutil.rmtree(self.dir)
+
+  def write_pack(self):
+
+    writer = frame_pack.PackWriter(self.path)
+
+    # frames from several encode threads arrive out of order
+    for i in [2, 0, 3, 1]:
+      writer.write(i, self.frames[i])
+
+    writer.close(len(self.frames), 64, 48)
+
+  def test_read_frames(self):
+
+    self.write_pack()
+
+    for use_mmap in [False, True]:
+      with frame_pack.PackReader(self.path, use_mmap=use_mmap) as reader:
+        self.assertEqual((len(reader), reader.width, reader.height), (4, 64, 48))
+        self.assertEqual([bytes(reader.read_frame(i)) for i in [3, 0, 2, 1]],
+                         [self.frames[i] for i in [3, 0, 2, 1]])
+
+        with self.assertRaises(IndexError):
+          reader.read_frame(4)
+
+  def test_missing_frame(self):
+
+    writer = frame_pack.PackWriter(self.path)
+    writer.write(0, self.frames[0])
+    writer.write(2, self.frames[2])
+
+    with self.assertRaises(ValueError):
+      writer.close(3, 64, 48)
+
+  def test_truncated_pack(self):
+
+    self.write_pack()
+
+    with open(self.path, "r+b") as file:
+      file.truncate(os.path.getsize(self.path) - 1)
+
+    with self.assertRaises(ValueError):
+      frame_pack.PackReader(self.path)
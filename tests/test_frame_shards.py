@@ -0,0 +1,98 @@
+import json, os, shutil, subprocess, sys, tarfile, tempfile, unittest
+
+import lib.frame_shards as frame_shards
+
+class TestFrameShards(unittest.TestCase):
+
+  def setUp(self):
+
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+
+    shutil.rmtree(self.dir)
+
+  def test_shards_roll_over(self):
+
+    writer = frame_shards.ShardWriter(self.dir, "test", max_size=20000)
+
+    for i in range(5):
+      sample = frame_shards.SampleWriter(writer, "video{:d}".format(i), "jogging")
+
+      for j in [1, 0, 2]:
+        sample.write(j, os.urandom(3000))
+
+      sample.close(3, 64, 48)
+
+    writer.close()
+
+    # the samples of each shard are handed out once, after it was finished
+    self.assertEqual([sample["video_id"] for sample in writer.take_finished()],
+                     ["video{:d}".format(i) for i in range(5)])
+    self.assertEqual(writer.take_finished(), [])
+
+    # each shard is finished as soon as it is larger than the maximum size
+    shard_paths = frame_shards.find_shards(self.dir)
+    self.assertEqual([os.path.basename(path) for path in shard_paths],
+                     ["test-000000.tar", "test-000001.tar", "test-000002.tar"])
+    self.assertEqual(frame_shards.get_finished_ids(self.dir), {"video{:d}".format(i) for i in range(5)})
+    self.assertFalse(any(name.endswith(".partial") for name in os.listdir(self.dir)))
+
+    with tarfile.open(shard_paths[0]) as tar:
+      self.assertEqual(tar.getnames()[:4], ["video0.json", "video0.frame000000.jpg", "video0.frame000001.jpg",
+                                            "video0.frame000002.jpg"])
+
+    sample = frame_shards.read_index(shard_paths[0])[1]
+    files = frame_shards.read_sample(shard_paths[0], sample)
+
+    self.assertEqual(sorted(files.keys()), ["video1.frame000000.jpg", "video1.frame000001.jpg",
+                                            "video1.frame000002.jpg", "video1.json"])
+    self.assertEqual(json.loads(files["video1.json"].decode()),
+                     {"video_id": "video1", "label": "jogging", "num_frames": 3, "width": 64, "height": 48})
+
+  def test_failed_video_is_not_written(self):
+
+    writer = frame_shards.ShardWriter(self.dir, "test")
+
+    sample = frame_shards.SampleWriter(writer, "failed", None)
+    sample.write(0, b"frame")
+    sample.abort()
+
+    sample = frame_shards.SampleWriter(writer, "missing", None)
+    sample.write(1, b"frame")
+
+    with self.assertRaises(ValueError):
+      sample.close(2, 64, 48)
+
+    sample = frame_shards.SampleWriter(writer, "done", None)
+    sample.write(0, b"frame")
+    sample.close(1, 64, 48)
+
+    # the shard is not finished yet
+    self.assertEqual(frame_shards.find_shards(self.dir), [])
+
+    writer.close()
+    self.assertEqual(frame_shards.get_finished_ids(self.dir), {"done"})
+
+  def test_stale_shards_are_removed(self):
+
+    # a crashed run of this machine and shards that might still be written
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    crashed_prefix = "{}-{:d}".format(frame_shards.get_shard_prefix().rsplit("-", 1)[0], process.pid)
+    live_prefix = frame_shards.get_shard_prefix()
+
+    for prefix in [crashed_prefix, live_prefix, "other-host-1-1"]:
+      writer = frame_shards.ShardWriter(self.dir, prefix)
+      sample = frame_shards.SampleWriter(writer, "video", None)
+      sample.write(0, b"frame")
+      sample.close(1, 64, 48)
+      writer.file.close()
+
+    crashed_path = os.path.join(self.dir, "{}-000000.tar.partial".format(crashed_prefix))
+
+    self.assertEqual(frame_shards.get_finished_ids(self.dir), set())
+    self.assertEqual(frame_shards.remove_stale_shards(self.dir), [crashed_path])
+    self.assertEqual(sorted(os.listdir(self.dir)), sorted(["{}-000000.tar.partial".format(prefix)
+                                                           for prefix in [live_prefix, "other-host-1-1"]]))
@@ -0,0 +1,88 @@
+import os, sqlite3, tempfile, unittest
+
+import lib.constants as constants
+import lib.job_state as job_state
+
+class TestJobState(unittest.TestCase):
+
+  def setUp(self):
+
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.ledger = job_state.JobLedger(os.path.join(self.tmp_dir.name, "state.db"))
+
+  def tearDown(self):
+
+    self.ledger.close()
+    self.tmp_dir.cleanup()
+
+  def test_attempts_are_counted(self):
+
+    self.ledger.record("vid1", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED, duration=1.5)
+    self.ledger.record("vid1", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_DONE, num_bytes=1000, duration=2.0)
+
+    state = self.ledger.get("vid1", constants.STAGE_DOWNLOAD)
+
+    self.assertEqual(state["status"], constants.JOB_STATUS_DONE)
+    self.assertEqual(state["attempts"], 2)
+    self.assertEqual(state["bytes"], 1000)
+    self.assertIsNone(self.ledger.get("vid1", constants.STAGE_CUT))
+
+  def test_finished_ids(self):
+
+    # finished
+    self.ledger.record("vid1", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_DONE)
+    self.ledger.record("vid1", constants.STAGE_CUT, constants.JOB_STATUS_DONE)
+    # downloaded but not cut
+    self.ledger.record("vid2", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_DONE)
+    # failed once
+    self.ledger.record("vid3", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED)
+    # failed too many times
+    self.ledger.record("vid4", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED)
+    self.ledger.record("vid4", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_FAILED)
+    # failed permanently
+    self.ledger.record("vid5", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_PERMANENT, error="unavailable")
+
+    finished_ids = self.ledger.finished_ids(constants.STAGE_CUT, max_attempts=2)
+
+    self.assertEqual(finished_ids, {"vid1", "vid4", "vid5"})
+
+  def test_finished_targets(self):
+
+    # a video in two classes, one slice was cut
+    self.ledger.record("vid1", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_DONE)
+    self.ledger.record("vid1", constants.STAGE_CUT, constants.JOB_STATUS_DONE, target="a/vid1.mp4")
+    self.ledger.record("vid1", constants.STAGE_CUT, constants.JOB_STATUS_FAILED, target="b/vid1.mp4")
+    # failed permanently
+    self.ledger.record("vid2", constants.STAGE_DOWNLOAD, constants.JOB_STATUS_PERMANENT, error="unavailable")
+
+    self.assertEqual(self.ledger.get("vid1", constants.STAGE_CUT, target="b/vid1.mp4")["status"],
+                     constants.JOB_STATUS_FAILED)
+    self.assertEqual(self.ledger.finished_targets(constants.STAGE_CUT, max_attempts=2),
+                     ({("vid1", "a/vid1.mp4")}, {"vid2"}))
+
+    # the other slice failed too many times
+    self.ledger.record("vid1", constants.STAGE_CUT, constants.JOB_STATUS_FAILED, target="b/vid1.mp4")
+
+    self.assertEqual(self.ledger.finished_targets(constants.STAGE_CUT, max_attempts=2),
+                     ({("vid1", "a/vid1.mp4"), ("vid1", "b/vid1.mp4")}, {"vid2"}))
+
+  def test_old_database_is_upgraded(self):
+
+    path = os.path.join(self.tmp_dir.name, "old.db")
+
+    connection = sqlite3.connect(path)
+    connection.execute(
+      "CREATE TABLE jobs (video_id TEXT NOT NULL, stage TEXT NOT NULL, status TEXT NOT NULL, "
+      "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, bytes INTEGER, duration REAL, updated REAL, "
+      "PRIMARY KEY (video_id, stage))")
+    connection.execute("INSERT INTO jobs VALUES ('vid1', ?, ?, 1, NULL, NULL, NULL, 0)",
+                       (constants.STAGE_CUT, constants.JOB_STATUS_DONE))
+    connection.commit()
+    connection.close()
+
+    ledger = job_state.JobLedger(path)
+    ledger.record("vid2", constants.STAGE_CUT, constants.JOB_STATUS_DONE, target="a/vid2.mp4")
+
+    # a cut recorded without a target stands for all slices of the video
+    self.assertEqual(ledger.finished_targets(constants.STAGE_CUT), ({("vid2", "a/vid2.mp4")}, {"vid1"}))
+    ledger.close()
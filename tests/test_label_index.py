@@ -0,0 +1,20 @@
+import unittest
+
+import lib.metadata as metadata
+import lib.metadata_cache as metadata_cache
+
+class TestLabelIndex(unittest.TestCase):
+
+  VIDEOS = {
+    "vid1": {"annotations": {"label": "pole vault", "segment": [1.0, 11.0]}},
+    "vid2": {"annotations": {"label": "Pole Vault", "segment": [5.0, 15.0]}},
+    "vid3": {"annotations": {"label": "blowing glass", "segment": [0.0, 10.0]}}
+  }
+
+  def test_build_label_index(self):
+
+    label_index = metadata.build_label_index(metadata_cache.CompactMetadata.from_json(self.VIDEOS))
+
+    self.assertEqual(sorted(label_index.keys()), ["blowing glass", "pole vault"])
+    self.assertEqual(label_index["pole vault"], [("vid1", 1.0, 11.0), ("vid2", 5.0, 15.0)])
+    self.assertEqual(label_index["blowing glass"], [("vid3", 0.0, 10.0)])
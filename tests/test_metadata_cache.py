@@ -0,0 +1,66 @@
+import json, os, tempfile, unittest
+
+import lib.metadata_cache as metadata_cache
+
+class TestMetadataCache(unittest.TestCase):
+
+  VIDEOS = {
+    "vid1": {"annotations": {"label": "pole vault", "segment": [1.5, 11.5]}},
+    "vid2": {"annotations": {"label": "blowing glass", "segment": [0.0, 10.0]}},
+    "vid3": {"annotations": {"label": "pole vault", "segment": [20.0, 30.0]}}
+  }
+
+  def setUp(self):
+
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp_dir.name, "kinetics_train.json")
+
+    with open(self.path, "w") as file:
+      json.dump(self.VIDEOS, file)
+
+    metadata_cache.loaded_metadata.clear()
+
+  def tearDown(self):
+
+    metadata_cache.loaded_metadata.clear()
+    self.tmp_dir.cleanup()
+
+  def test_compact_metadata(self):
+
+    compact = metadata_cache.CompactMetadata.from_json(self.VIDEOS)
+
+    self.assertEqual(len(compact), 3)
+    self.assertEqual(compact.labels, ["pole vault", "blowing glass"])
+    self.assertEqual(list(compact), [("vid1", "pole vault", 1.5, 11.5), ("vid2", "blowing glass", 0.0, 10.0),
+                                     ("vid3", "pole vault", 20.0, 30.0)])
+    self.assertEqual(compact.label("vid2"), "blowing glass")
+    self.assertIn("vid3", compact)
+    self.assertNotIn("vid4", compact)
+
+  def test_cache_is_written_and_reused(self):
+
+    compact = metadata_cache.load(self.path)
+
+    self.assertTrue(os.path.isfile(self.path + metadata_cache.CACHE_SUFFIX))
+
+    metadata_cache.loaded_metadata.clear()
+    cached = metadata_cache.read_cache(self.path + metadata_cache.CACHE_SUFFIX,
+                                       metadata_cache.get_source_stamp(self.path))
+
+    self.assertIsNotNone(cached)
+    self.assertEqual(list(cached), list(compact))
+
+  def test_cache_invalidated_by_source_change(self):
+
+    metadata_cache.load(self.path)
+
+    videos = dict(self.VIDEOS)
+    videos["vid4"] = {"annotations": {"label": "abseiling", "segment": [5.0, 15.0]}}
+
+    with open(self.path, "w") as file:
+      json.dump(videos, file)
+
+    compact = metadata_cache.load(self.path)
+
+    self.assertEqual(len(compact), 4)
+    self.assertEqual(compact.label("vid4"), "abseiling")
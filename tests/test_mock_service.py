@@ -0,0 +1,98 @@
+import os, shutil, tempfile, unittest
+
+import lib.constants as constants
+import lib.downloader as downloader
+import lib.mock_service as mock_service
+
+class TestMockService(unittest.TestCase):
+
+  def setUp(self):
+
+    self.dir = tempfile.mkdtemp()
+    self.video_path = os.path.join(self.dir, "source.mp4")
+
+    with open(self.video_path, "wb") as file:
+      file.write(os.urandom(200 * 1024))
+
+  def tearDown(self):
+
+    shutil.rmtree(self.dir)
+
+  def start_service(self, **kwargs):
+
+    service = mock_service.MockVideoService(self.video_path, **kwargs)
+    service.start()
+    self.addCleanup(service.stop)
+
+    return service
+
+  def test_download(self):
+
+    service = self.start_service()
+    fetcher = downloader.get_fetcher(constants.FETCHER_HTTP, url=service.base_url)
+    download_path = os.path.join(self.dir, "abc_raw.mp4")
+
+    # the connection is reused for the second video
+    for _ in range(2):
+      success, error = downloader.download_video("abc", download_path, fetcher=fetcher)
+      self.assertTrue(success)
+      self.assertIsNone(error)
+
+    fetcher.close()
+
+    with open(self.video_path, "rb") as source, open(download_path, "rb") as downloaded:
+      self.assertEqual(source.read(), downloaded.read())
+
+    self.assertEqual(service.num_requests, 2)
+
+  def test_unavailable(self):
+
+    service = self.start_service(unavailable_rate=1.0)
+    fetcher = downloader.get_fetcher(constants.FETCHER_HTTP, url=service.base_url)
+
+    success, error = downloader.download_video("abc", os.path.join(self.dir, "abc_raw.mp4"), retries=2,
+                                               fetcher=fetcher)
+    fetcher.close()
+
+    self.assertFalse(success)
+    self.assertEqual(error, constants.ERROR_PERMANENT)
+
+  def test_transient_failure(self):
+
+    service = self.start_service(failure_rate=1.0)
+    fetcher = downloader.get_fetcher(constants.FETCHER_HTTP, url=service.base_url)
+
+    success, error = downloader.download_video("abc", os.path.join(self.dir, "abc_raw.mp4"), retries=2,
+                                               backoff_base=0.0, fetcher=fetcher)
+    fetcher.close()
+
+    self.assertFalse(success)
+    self.assertEqual(error, constants.ERROR_TRANSIENT)
+    self.assertEqual(service.num_requests, 3)
+
+  def test_connection_refused(self):
+
+    service = self.start_service()
+    url = service.base_url
+    service.stop()
+
+    fetcher = downloader.get_fetcher(constants.FETCHER_HTTP, url=url)
+    success, error = downloader.download_video("abc", os.path.join(self.dir, "abc_raw.mp4"), fetcher=fetcher)
+
+    self.assertFalse(success)
+    self.assertEqual(error, constants.ERROR_TRANSIENT)
+
+  def test_download_to_scratch_directory(self):
+
+    service = self.start_service()
+    fetcher = downloader.get_fetcher(constants.FETCHER_HTTP, url=service.base_url)
+    scratch_dir = os.path.join(self.dir, "scratch")
+    os.mkdir(scratch_dir)
+
+    success, download_path, error = downloader.download_raw_video("abc", self.dir, fetcher=fetcher,
+                                                                  scratch_directory=scratch_dir)
+    fetcher.close()
+
+    self.assertTrue(success)
+    self.assertEqual(download_path, os.path.join(scratch_dir, "abc_raw.mp4"))
+    self.assertTrue(os.path.isfile(download_path))
@@ -0,0 +1,98 @@
+import os, tempfile, unittest
+
+import lib.constants as constants
+import lib.job_state as job_state
+import lib.parallel_download as parallel_download
+import lib.sharding as sharding
+import lib.work_plan as work_plan
+
+class TestParallelDownload(unittest.TestCase):
+
+  def test_group_requests(self):
+
+    segments = [
+      ("a", "train/jogging", 10, 20, "train"),
+      ("b", "train/jogging", 0, 10, "train"),
+      ("a", "valid/running", 30, 40, "valid"),
+      ("a", "valid/running", 50, 60, "valid")
+    ]
+
+    requests, duplicates = parallel_download.group_requests(segments)
+
+    # each video is requested once with all its sections
+    self.assertEqual(requests, [
+      ("a", [("train/jogging", 10, 20, "train"), ("valid/running", 30, 40, "valid")]),
+      ("b", [("train/jogging", 0, 10, "train")])
+    ])
+
+    # a second section in the same class directory would overwrite the first one
+    self.assertEqual(duplicates, {"valid": 1})
+
+  def test_schedule_requests(self):
+
+    requests = [
+      ("a1", [("train/a", 0, 10, "train")]),
+      ("a2", [("train/a", 0, 5, "train")]),
+      ("a3", [("train/a", 0, 8, "train")]),
+      ("b1", [("train/b", 0, 10, "train")]),
+      ("c_1", [("train/c_c", 0, 10, "train")])
+    ]
+
+    def ids(scheduled):
+      return [request[0] for request in scheduled]
+
+    self.assertEqual(ids(parallel_download.schedule_requests(requests, schedule=constants.SCHEDULE_CLASSES)),
+                     ["a1", "a2", "a3", "b1", "c_1"])
+    self.assertEqual(ids(parallel_download.schedule_requests(requests)), ["a1", "b1", "c_1", "a2", "a3"])
+    self.assertEqual(ids(parallel_download.schedule_requests(requests, shortest_first=True)),
+                     ["a2", "b1", "c_1", "a3", "a1"])
+
+    # class names match the directories with underscores
+    self.assertEqual(ids(parallel_download.schedule_requests(requests, priority_classes=["b", "c c"])),
+                     ["b1", "c_1", "a1", "a2", "a3"])
+
+  def test_finished_slices_are_skipped(self):
+
+    with tempfile.TemporaryDirectory() as directory:
+      state_db = os.path.join(directory, "state.db")
+      label_index = {"jogging": [("a", 10, 20), ("b", 0, 10)], "running": [("a", 10, 20)]}
+      groups = [work_plan.WorkGroup(constants.TRAIN, None, ["jogging", "running"], directory, label_index=label_index)]
+
+      # the video is in both classes, only its slice in the running class was cut
+      ledger = job_state.JobLedger(state_db)
+      ledger.record("a", constants.STAGE_CUT, constants.JOB_STATUS_DONE,
+                    target=os.path.join(directory, "running", "a.mp4"))
+      ledger.close()
+
+      pool = parallel_download.Pool(groups, 1, None, False, False, False, state_db=state_db)
+
+      self.assertEqual(pool.plan_videos(), [
+        ("a", [(os.path.join(directory, "jogging"), 10, 20, constants.TRAIN)]),
+        ("b", [(os.path.join(directory, "jogging"), 0, 10, constants.TRAIN)])
+      ])
+      self.assertEqual(pool.result_counter.counts, {constants.TRAIN: {constants.JOB_STATUS_SKIPPED: 1}})
+
+      # the download workers create the class directories
+      self.assertFalse(os.path.isdir(os.path.join(directory, "jogging")))
+
+  def test_unavailable_videos_of_all_shards_are_skipped(self):
+
+    with tempfile.TemporaryDirectory() as directory:
+      unavailable_file = os.path.join(directory, "unavailable.txt")
+      label_index = {"jogging": [("a", 0, 10), ("b", 0, 10), ("c", 0, 10)]}
+      groups = [work_plan.WorkGroup(constants.TRAIN, None, ["jogging"], directory, label_index=label_index)]
+
+      # found by an earlier run with two shards and by a run without shards
+      with open(sharding.shard_path(unavailable_file, 2, 1), "w") as file:
+        file.write("a\n")
+
+      with open(unavailable_file, "w") as file:
+        file.write("b\n")
+
+      pool = parallel_download.Pool(groups, 1, None, False, False, False, unavailable_file=unavailable_file,
+                                    num_shards=3, shard_index=0)
+      planned = [video_id for video_id, _ in pool.plan_videos()]
+
+      self.assertNotIn("a", planned)
+      self.assertNotIn("b", planned)
+      self.assertEqual(pool.unavailable_shard_file, sharding.shard_path(unavailable_file, 3, 0))
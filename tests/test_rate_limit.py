@@ -0,0 +1,37 @@
+import time, unittest
+
+import lib.rate_limit as rate_limit
+
+class TestRateLimit(unittest.TestCase):
+
+  def test_token_bucket_burst_and_rate(self):
+
+    bucket = rate_limit.TokenBucket(20, capacity=2)
+
+    start = time.time()
+    for _ in range(6):
+      bucket.acquire()
+    elapsed = time.time() - start
+
+    # 2 tokens are available immediately, the remaining 4 take 1/20 s each
+    self.assertGreaterEqual(elapsed, 0.15)
+    self.assertLess(elapsed, 1.0)
+
+  def test_bandwidth_debt(self):
+
+    limiter = rate_limit.RateLimiter(max_bandwidth=1000)
+
+    self.assertEqual(limiter.acquire(), 0.0)
+
+    # downloading 1100 bytes puts the bucket 100 bytes into debt
+    limiter.charge_bytes(1100)
+    wait = limiter.acquire()
+
+    self.assertGreater(wait, 0.05)
+    self.assertEqual(limiter.num_waited.value, 1)
+
+  def test_parse_size(self):
+
+    self.assertEqual(rate_limit.parse_size("1024"), 1024)
+    self.assertEqual(rate_limit.parse_size("1.5K"), 1536)
+    self.assertEqual(rate_limit.parse_size("10m"), 10 * 1024 ** 2)
@@ -0,0 +1,83 @@
+import os, tempfile, unittest
+
+import lib.constants as constants
+import lib.job_state as job_state
+import lib.sharding as sharding
+
+class TestSharding(unittest.TestCase):
+
+  def setUp(self):
+
+    self.tmp_dir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+
+    self.tmp_dir.cleanup()
+
+  def test_shards_partition_videos(self):
+
+    video_ids = ["vid{:d}".format(i) for i in range(1000)]
+    shards = [[video_id for video_id in video_ids if sharding.in_shard(video_id, 4, index)] for index in range(4)]
+
+    # every video belongs to exactly one shard and the shards are roughly balanced
+    self.assertEqual(sorted(sum(shards, [])), sorted(video_ids))
+    for shard in shards:
+      self.assertGreater(len(shard), 150)
+
+    # the assignment is stable
+    self.assertEqual(sharding.get_shard("abc", 4), sharding.get_shard("abc", 4))
+    self.assertTrue(sharding.in_shard("abc", 1, 0))
+
+  def test_shard_path(self):
+
+    self.assertEqual(sharding.shard_path("dataset/failed.txt", 8, 2), "dataset/failed.shard-2-of-8.txt")
+    self.assertEqual(sharding.shard_path("dataset/failed.txt", 1, 0), "dataset/failed.txt")
+    self.assertIsNone(sharding.shard_path(None, 8, 2))
+
+  def test_find_shard_paths(self):
+
+    path = os.path.join(self.tmp_dir.name, "unavailable.txt")
+    paths = [sharding.shard_path(path, 4, 1), sharding.shard_path(path, 2, 0), path,
+             os.path.join(self.tmp_dir.name, "failed.shard-0-of-2.txt")]
+
+    for shard_path in paths:
+      open(shard_path, "w").close()
+
+    # shards of any layout, but not the unsharded log or other logs
+    self.assertEqual(sharding.find_shard_paths(path), sorted(paths[:2]))
+    self.assertEqual(sharding.find_shard_paths(None), [])
+
+  def test_merge_id_logs(self):
+
+    output_path = os.path.join(self.tmp_dir.name, "failed.txt")
+    paths = [sharding.shard_path(output_path, 3, index) for index in range(3)]
+
+    with open(paths[0], "w") as file:
+      file.write("a\nb\n")
+
+    with open(paths[1], "w") as file:
+      file.write("c\na\n")
+
+    # the third shard has no failed videos
+    self.assertEqual(sharding.merge_id_logs(paths, output_path), 3)
+
+    with open(output_path, "r") as file:
+      self.assertEqual(file.read().split(), ["a", "b", "c"])
+
+  def test_merge_state_dbs(self):
+
+    output_path = os.path.join(self.tmp_dir.name, "state.db")
+    paths = [sharding.shard_path(output_path, 2, index) for index in range(2)]
+
+    for index, path in enumerate(paths):
+      ledger = job_state.JobLedger(path)
+      ledger.record("vid{:d}".format(index), constants.STAGE_CUT, constants.JOB_STATUS_DONE)
+      ledger.record("shared", constants.STAGE_CUT, constants.JOB_STATUS_FAILED if index == 0 else
+                    constants.JOB_STATUS_DONE)
+      ledger.close()
+
+    self.assertEqual(sharding.merge_state_dbs(paths, output_path), 3)
+
+    ledger = job_state.JobLedger(output_path)
+    self.assertEqual(ledger.finished_ids(constants.STAGE_CUT), {"vid0", "vid1", "shared"})
+    ledger.close()
@@ -0,0 +1,92 @@
+import os, time, unittest
+from multiprocessing import Queue
+
+import lib.supervisor as supervisor
+
+def flaky_worker(queue, output_queue, slot):
+  """
+  Crashes on "crash", hangs on "hang", exits on "exit" and echoes all other items.
+  """
+
+  while True:
+    slot.idle()
+    item = queue.get()
+
+    if item is None:
+      break
+
+    slot.begin(item)
+
+    if item == "crash":
+      os._exit(1)
+    elif item == "hang":
+      time.sleep(60)
+    elif item == "exit":
+      output_queue.put(item)
+      return
+
+    output_queue.put(item)
+
+def collect(output_queue):
+
+  items = []
+
+  while not output_queue.empty():
+    items.append(output_queue.get())
+
+  return items
+
+class TestSupervisor(unittest.TestCase):
+
+  def run_items(self, items, num_workers=2, timeout=None, max_requeues=1):
+
+    queue = Queue()
+    output_queue = Queue()
+    given_up = []
+
+    worker_supervisor = supervisor.Supervisor("test", flaky_worker, (queue, output_queue), num_workers, queue,
+                                              timeout=timeout, give_up=given_up.append, max_requeues=max_requeues,
+                                              check_interval=0.05)
+    worker_supervisor.start()
+
+    for item in items:
+      queue.put(item)
+
+    worker_supervisor.stop()
+    time.sleep(0.1)
+
+    return worker_supervisor, collect(output_queue), given_up
+
+  def test_all_items_processed(self):
+
+    worker_supervisor, output, given_up = self.run_items(["a", "b", "c"])
+
+    self.assertEqual(sorted(output), ["a", "b", "c"])
+    self.assertEqual(worker_supervisor.num_restarts, 0)
+    self.assertEqual(given_up, [])
+
+  def test_crashed_worker_is_replaced(self):
+
+    worker_supervisor, output, given_up = self.run_items(["crash", "a", "b", "c"], max_requeues=1)
+
+    # the crashing item was requeued once and then given up
+    self.assertEqual(sorted(output), ["a", "b", "c"])
+    self.assertEqual(worker_supervisor.num_crashed, 2)
+    self.assertEqual(given_up, ["crash"])
+
+  def test_exited_worker_is_replaced(self):
+
+    worker_supervisor, output, given_up = self.run_items(["exit", "a", "b"], num_workers=1, max_requeues=0)
+
+    # a worker that returns in the middle of an item is replaced like a crashed one
+    self.assertEqual(sorted(output), ["a", "b", "exit"])
+    self.assertEqual(worker_supervisor.num_crashed, 1)
+    self.assertEqual(given_up, ["exit"])
+
+  def test_hung_worker_is_killed(self):
+
+    worker_supervisor, output, given_up = self.run_items(["hang", "a"], timeout=0.3, max_requeues=0)
+
+    self.assertEqual(output, ["a"])
+    self.assertEqual(worker_supervisor.num_timed_out, 1)
+    self.assertEqual(given_up, ["hang"])
@@ -0,0 +1,215 @@
+import os, shutil, subprocess, sys, tempfile, unittest
+
+import cv2
+
+import clean_up_frames
+import lib.constants as constants
+import lib.frame_pack as frame_pack
+import lib.frame_shards as frame_shards
+import lib.job_state as job_state
+import lib.mock_service as mock_service
+import lib.utils as utils
+import lib.parallel_to_frames as parallel_to_frames
+import lib.video as video
+import lib.work_plan as work_plan
+
+NUM_FRAMES = 50
+
+class TestVideo(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+
+    cls.dir = tempfile.mkdtemp()
+    cls.video_path = os.path.join(cls.dir, "source.mp4")
+    mock_service.generate_video(cls.video_path, duration=NUM_FRAMES // 25, width=320, height=180)
+
+  @classmethod
+  def tearDownClass(cls):
+
+    shutil.rmtree(cls.dir)
+
+  def extract(self, name, **kwargs):
+
+    save_path = os.path.join(self.dir, name)
+    os.makedirs(save_path)
+    self.addCleanup(shutil.rmtree, save_path)
+
+    self.assertTrue(video.video_to_jpgs(self.video_path, save_path, **kwargs))
+
+    return save_path
+
+  def test_pipelined_frames_match_sequential(self):
+
+    sequential_path = self.extract("sequential", num_threads=1)
+    pipelined_path = self.extract("pipelined", num_threads=4)
+
+    file_names = ["frame{:d}.jpg".format(i) for i in range(NUM_FRAMES)]
+    self.assertEqual(sorted(os.listdir(pipelined_path)), sorted(file_names + [constants.FRAMES_MARKER]))
+
+    # each file holds the frame with its number, whichever thread wrote it
+    for file_name in file_names:
+      with open(os.path.join(sequential_path, file_name), "rb") as first, \
+          open(os.path.join(pipelined_path, file_name), "rb") as second:
+        self.assertEqual(first.read(), second.read())
+
+  def test_engines_agree_on_frames(self):
+
+    opencv_path = self.extract("opencv")
+    ffmpeg_path = self.extract("ffmpeg", engine=constants.FRAMES_ENGINE_FFMPEG)
+
+    self.assertEqual(sorted(os.listdir(opencv_path)), sorted(os.listdir(ffmpeg_path)))
+    self.assertEqual(cv2.imread(os.path.join(opencv_path, "frame0.jpg")).shape,
+                     cv2.imread(os.path.join(ffmpeg_path, "frame0.jpg")).shape)
+
+  def test_lowres(self):
+
+    self.assertEqual(video.get_lowres("mpeg4", 1920, 1080, 256), 2)
+    self.assertEqual(video.get_lowres("mpeg4", 320, 180, 256), 0)
+    self.assertEqual(video.get_lowres("h264", 1920, 1080, 256), 0)
+
+  def test_extraction_is_atomic(self):
+
+    target_dir = os.path.join(self.dir, "frames", "source")
+    self.addCleanup(shutil.rmtree, os.path.join(self.dir, "frames"))
+
+    self.assertTrue(video.extract_frames(self.video_path, target_dir))
+    self.assertEqual(video.read_frames_marker(target_dir), {"num_frames": NUM_FRAMES, "width": 455, "height": 256})
+    self.assertEqual(len(video.get_frame_paths(target_dir)), NUM_FRAMES)
+    self.assertFalse(os.path.isdir(video.get_partial_path(target_dir)))
+
+    # a failed extraction leaves nothing behind
+    broken_path = os.path.join(self.dir, "broken.mp4")
+
+    with open(broken_path, "wb") as file:
+      file.write(os.urandom(1024))
+
+    broken_dir = os.path.join(self.dir, "frames", "broken")
+    self.assertFalse(video.extract_frames(broken_path, broken_dir))
+    self.assertFalse(os.path.exists(broken_dir))
+    self.assertFalse(os.path.exists(video.get_partial_path(broken_dir)))
+
+  def test_clean_up_finds_incomplete_frames(self):
+
+    root = os.path.join(self.dir, "root")
+    self.addCleanup(shutil.rmtree, root)
+
+    finished_dir = os.path.join(root, "class", "finished")
+    self.assertTrue(video.extract_frames(self.video_path, finished_dir))
+
+    partial_dir = video.get_partial_path(os.path.join(root, "class", "crashed"))
+    old_dir = os.path.join(root, "class", "old")
+    os.makedirs(partial_dir)
+    os.makedirs(old_dir)
+
+    self.assertEqual(sorted(clean_up_frames.find_incomplete(root)), sorted([partial_dir, old_dir]))
+
+  def test_packed_frames(self):
+
+    jpgs_path = self.extract("jpgs")
+
+    for engine in [constants.FRAMES_ENGINE_OPENCV, constants.FRAMES_ENGINE_FFMPEG]:
+      target_dir = os.path.join(self.dir, "packed", engine)
+      self.addCleanup(video.remove_path, os.path.join(self.dir, "packed"))
+
+      self.assertTrue(video.extract_frames(self.video_path, target_dir, engine=engine,
+                                           output_format=constants.FRAMES_FORMAT_PACKED))
+      self.assertTrue(video.is_extracted(target_dir, constants.FRAMES_FORMAT_PACKED))
+      self.assertFalse(os.path.exists(target_dir))
+
+      with frame_pack.PackReader(target_dir + constants.FRAMES_PACK_SUFFIX) as reader:
+        self.assertEqual((len(reader), reader.width, reader.height), (NUM_FRAMES, 455, 256))
+
+      frames = list(video.load_frames(target_dir))
+      self.assertEqual(len(frames), NUM_FRAMES)
+      self.assertEqual(frames[0].shape, (256, 455, 3))
+
+    # the OpenCV engine packs the same JPEG bytes it writes into files
+    opencv_dir = os.path.join(self.dir, "packed", constants.FRAMES_ENGINE_OPENCV)
+    self.assertEqual(list(video.read_frames(opencv_dir)), list(video.read_frames(jpgs_path)))
+
+  def test_pool_writes_tar_shards(self):
+
+    source_dir = os.path.join(self.dir, "videos")
+    target_dir = os.path.join(self.dir, "shards")
+    self.addCleanup(video.remove_path, source_dir)
+    self.addCleanup(video.remove_path, target_dir)
+
+    os.makedirs(os.path.join(source_dir, "pole_vault"))
+
+    for video_id in ["a", "b", "c"]:
+      shutil.copyfile(self.video_path, os.path.join(source_dir, "pole_vault", "{}.mp4".format(video_id)))
+
+    groups = [work_plan.WorkGroup(constants.TRAIN, None, ["pole vault"], target_dir, source_directory=source_dir)]
+
+    def run():
+      pool = parallel_to_frames.Pool(groups, 2, None, output_format=constants.FRAMES_FORMAT_TAR, tar_size=1)
+      pool.start_workers()
+      pool.feed_videos()
+      return pool.stop_workers()
+
+    counts = run()
+    self.assertEqual(counts[groups[0].name], {constants.JOB_STATUS_DONE: 3})
+
+    # a shard is finished after each video, no class directories are created
+    shard_paths = frame_shards.find_shards(target_dir)
+    self.assertEqual(len(shard_paths), 3)
+    self.assertEqual(sorted(os.listdir(target_dir)),
+                     sorted([os.path.basename(path) for path in shard_paths] +
+                            [os.path.basename(frame_shards.get_index_path(path)) for path in shard_paths]))
+
+    samples = [sample for path in shard_paths for sample in frame_shards.read_index(path)]
+    self.assertEqual(sorted(sample["video_id"] for sample in samples), ["a", "b", "c"])
+    self.assertTrue(all(sample["label"] == "pole vault" and sample["num_frames"] == NUM_FRAMES for sample in samples))
+
+    # videos in finished shards are skipped
+    counts = run()
+    self.assertEqual(counts[groups[0].name], {constants.JOB_STATUS_SKIPPED: 3})
+
+  def test_interrupted_shard_is_planned_again(self):
+
+    source_dir = os.path.join(self.dir, "interrupted_videos")
+    target_dir = os.path.join(self.dir, "interrupted_shards")
+    state_db = os.path.join(self.dir, "interrupted.db")
+    self.addCleanup(video.remove_path, source_dir)
+    self.addCleanup(video.remove_path, target_dir)
+    self.addCleanup(video.remove_path, state_db)
+
+    os.makedirs(source_dir)
+
+    for video_id in ["a", "b"]:
+      shutil.copyfile(self.video_path, os.path.join(source_dir, "{}.mp4".format(video_id)))
+
+    # a worker of this machine crashed right before it renamed its shard
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    crashed_prefix = "{}-{:d}".format(frame_shards.get_shard_prefix().rsplit("-", 1)[0], process.pid)
+    writer = frame_shards.ShardWriter(target_dir, crashed_prefix)
+    sample = frame_shards.SampleWriter(writer, "a", None)
+    sample.write(0, b"frame")
+    sample.close(1, 64, 48)
+    writer.tar.close()
+    writer.file.close()
+    utils.save_json(frame_shards.get_index_path(writer.path), writer.samples)
+
+    partial_path = writer.path + constants.PARTIAL_SUFFIX
+    self.assertEqual(sorted(clean_up_frames.find_incomplete(target_dir)),
+                     sorted([partial_path, frame_shards.get_index_path(writer.path)]))
+
+    groups = [work_plan.WorkGroup(constants.TEST, None, None, target_dir, source_directory=source_dir)]
+    pool = parallel_to_frames.Pool(groups, 2, None, state_db=state_db, output_format=constants.FRAMES_FORMAT_TAR)
+    pool.start_workers()
+    pool.feed_videos()
+    counts = pool.stop_workers()
+
+    # the video of the partial shard is extracted again, the partial shard and its index are removed
+    self.assertEqual(counts[constants.TEST], {constants.JOB_STATUS_DONE: 2})
+    self.assertFalse(os.path.exists(partial_path))
+    self.assertFalse(os.path.exists(frame_shards.get_index_path(writer.path)))
+    self.assertEqual(frame_shards.get_finished_ids(target_dir), {"a", "b"})
+
+    # the job states are recorded once the shards are finished
+    ledger = job_state.JobLedger(state_db)
+    self.assertEqual(ledger.get("a", constants.STAGE_FRAMES)["status"], constants.JOB_STATUS_DONE)
+    ledger.close()
@@ -0,0 +1,43 @@
+import unittest
+from multiprocessing import Queue
+
+import lib.constants as constants
+import lib.work_plan as work_plan
+
+class TestWorkPlan(unittest.TestCase):
+
+  def test_plan_groups(self):
+
+    categories = [("arts", ["pole vault", "blowing glass"]), ("sports", ["Pole Vault", "jogging"]),
+                  (None, ["blowing glass"])]
+    splits = [(constants.TRAIN, "train", "train_frames", None), (constants.VALID, "valid", "valid_frames", None)]
+
+    groups = work_plan.plan_groups(categories, splits)
+
+    # classes shared by multiple categories are planned only once per split
+    self.assertEqual([group.name for group in groups], ["train/arts", "train/sports", "valid/arts", "valid/sports"])
+    self.assertEqual(groups[1].classes, ["jogging"])
+    self.assertEqual(groups[2].source_directory, "valid")
+    self.assertEqual(groups[2].target_directory, "valid_frames")
+
+  def test_result_counter(self):
+
+    results_queue = Queue()
+    listened = []
+    counter = work_plan.ResultCounter(results_queue, listener=lambda *result: listened.append(result))
+    counter.start()
+
+    results_queue.put([work_plan.Result("train/arts", constants.JOB_STATUS_DONE, "vid{:d}".format(i))
+                       for i in range(3)])
+    results_queue.put([work_plan.Result("valid/arts", constants.JOB_STATUS_FAILED, "vid3")])
+    counter.add("valid/arts", constants.JOB_STATUS_SKIPPED, 5)
+
+    counts = counter.stop()
+
+    self.assertEqual(counts, {"train/arts": {constants.JOB_STATUS_DONE: 3},
+                              "valid/arts": {constants.JOB_STATUS_FAILED: 1, constants.JOB_STATUS_SKIPPED: 5}})
+    self.assertEqual(work_plan.format_summary(counts).split("\n")[-1], "total: 3 done, 1 failed, 5 skipped")
+
+    # skipped videos are counted in the main process and not reported
+    self.assertEqual(listened[-1], ("valid/arts", constants.JOB_STATUS_FAILED, "vid3"))
+    self.assertEqual(len(listened), 4)
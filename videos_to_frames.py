@@ -1,79 +1,108 @@
-import argparse, json
+import argparse
 
+import lib.autotune as autotune
 import lib.config as config
+import lib.constants as constants
+import lib.coordinator as coordinator
+import lib.frame_shards as frame_shards
 import lib.parallel_to_frames as parallel
+import lib.rate_limit as rate_limit
+import lib.sharding as sharding
+import lib.work_plan as work_plan
 
-def process_category(category, num_workers, failed_save_file):
+def plan(categories, test):
   """
-  Extract video frames for a category.
-  :param category:              Category name.
-  :param num_workers:           Number of worker processes.
-  :param failed_save_file:      Path to a log of failed extractions.
-  :return:                      None.
+  Plan the extraction of video frames for a whole run.
+  :param categories:    List of (category, classes) tuples to extract from the training and validation sets.
+  :param test:          Extract the test set.
+  :return:              List of work groups (see work_plan.WorkGroup).
   """
 
-  with open(config.CATEGORIES_PATH, "r") as file:
-    categories = json.load(file)
+  splits = list(zip([constants.TRAIN, constants.VALID], [config.TRAIN_ROOT, config.VALID_ROOT],
+                    [config.TRAIN_FRAMES_ROOT, config.VALID_FRAMES_ROOT], [None, None]))
+  groups = work_plan.plan_groups(categories, splits)
 
-  if category not in categories:
-    raise ValueError("Category {} not found.".format(category))
+  if test:
+    groups.append(work_plan.WorkGroup(constants.TEST, None, None, config.TEST_FRAMES_ROOT,
+                                      source_directory=config.TEST_ROOT))
 
-  classes = categories[category]
-  process_classes(classes, num_workers, failed_save_file)
+  return groups
 
-def process_classes(classes, num_workers, failed_save_file):
+def process(groups, num_workers, failed_save_file, state_db=None, timeout=None, num_shards=1, shard_index=0,
+            client=None, lease_size=coordinator.DEFAULT_LEASE_SIZE, autotune=False,
+            autotune_interval=autotune.DEFAULT_INTERVAL, threads_per_worker=None,
+            engine=constants.FRAMES_ENGINE_OPENCV, output_format=constants.FRAMES_FORMAT_JPGS,
+            tar_size=frame_shards.DEFAULT_SHARD_SIZE):
   """
-  Extract video frames for a class.
-  :param classes:               List of classes.
+  Extract video frames for all planned videos with a single pool of workers.
+  :param groups:                Planned work (see plan).
   :param num_workers:           Number of worker processes.
   :param failed_save_file:      Path to a log of failed extractions.
-  :return:                      None.
+  :param state_db:              Path to a job state database.
+  :param timeout:               Maximum time in seconds spent on a single video.
+  :param num_shards:            Number of machines that split the work.
+  :param shard_index:           Index of the shard processed by this machine.
+  :param client:                Coordinator client to lease the videos from instead of the planned work.
+  :param lease_size:            Number of videos leased at once.
+  :param autotune:              Search for the number of workers with the highest throughput.
+  :param autotune_interval:     How long each number of workers is measured in seconds.
+  :param threads_per_worker:    Number of ffmpeg and OpenCV threads of each worker.
+  :param engine:                How to extract the frames (see video.video_to_jpgs).
+  :param output_format:         How to save the frames (see parallel_to_frames.Pool).
+  :param tar_size:              Size of the tar shards in bytes.
+  :return:                      Number of videos with each status for each work group.
   """
 
-  for source_root, target_root in zip([config.TRAIN_ROOT, config.VALID_ROOT],
-                                        [config.TRAIN_FRAMES_ROOT, config.VALID_FRAMES_ROOT]):
+  pool = parallel.Pool(groups, num_workers, failed_save_file, state_db=state_db, timeout=timeout,
+                       num_shards=num_shards, shard_index=shard_index,
+                       autotune=autotune, autotune_interval=autotune_interval, threads_per_worker=threads_per_worker,
+                       engine=engine, output_format=output_format, tar_size=tar_size)
+  pool.start_workers()
 
-    pool = parallel.Pool(classes, source_root, target_root, num_workers, failed_save_file)
-    pool.start_workers()
+  if client is None:
     pool.feed_videos()
-    pool.stop_workers()
-
-def process_test_set(num_workers, failed_save_file):
-  """
-  Extract video frames for the test set.
-  :param num_workers:           Number of worker processes.
-  :param failed_save_file:      Path to a log of failed extractions.
-  :return:                      None.
-  """
+  else:
+    coordinator.feed_pool(pool, client, lease_size=lease_size)
 
-  pool = parallel.Pool(None, config.TEST_ROOT, config.TEST_FRAMES_ROOT, num_workers, failed_save_file)
-  pool.start_workers()
-  pool.feed_videos()
-  pool.stop_workers()
+  return pool.stop_workers()
 
 def main(args):
 
+  # each shard writes its own logs, merge_shards.py combines them
+  for name in ["failed_log", "state_db"]:
+    setattr(args, name, sharding.shard_path(getattr(args, name), args.num_shards, args.shard_index))
+
   if args.all:
     # extract for all categories => all videos
-    with open(config.CATEGORIES_PATH, "r") as file:
-      categories = json.load(file)
-
-    for category in categories:
-      process_category(category, args.num_workers, args.failed_log)
-
+    categories = work_plan.get_categories()
   else:
+    categories = []
+
     if args.categories:
       # extract for selected categories
-      for category in args.categories:
-        process_category(category, args.num_workers, args.failed_log)
+      categories += work_plan.get_categories(args.categories)
 
     if args.classes:
       # extract for selected classes
-      process_classes(args.classes, args.num_workers, args.failed_log)
+      categories.append((None, args.classes))
 
-    if args.test:
-      # extract for the test set
-      process_test_set(args.num_workers, args.failed_log)
+  client = None
+  groups = []
+
+  if args.coordinator_url is not None:
+    # the coordinator planned the work
+    client = coordinator.CoordinatorClient(args.coordinator_url, coordinator.get_worker_name())
+  else:
+    groups = plan(categories, args.test)
+
+  counts = process(groups, args.num_workers, args.failed_log, state_db=args.state_db, timeout=args.timeout,
+                   num_shards=args.num_shards, shard_index=args.shard_index,
+                   client=client, lease_size=args.lease_size, autotune=args.autotune,
+                   autotune_interval=args.autotune_interval, threads_per_worker=args.threads_per_worker,
+                   engine=args.engine, output_format=args.output_format,
+                   tar_size=int(rate_limit.parse_size(args.tar_size)))
+
+  print(work_plan.format_summary(counts))
 
 if __name__ == "__main__":
 
@@ -87,6 +116,40 @@ if __name__ == "__main__":
   parser.add_argument("--num-workers", type=int, default=1, help="number of worker threads")
   parser.add_argument("--failed-log", default="dataset/failed_frames.txt", help="where to save list of videos for "
                                                                                 "which the frame extraction failed")
+  parser.add_argument("--state-db", help="SQLite database recording the state of each video, finished videos are "
+                                         "skipped when the extraction is resumed")
+  parser.add_argument("--timeout", type=float, default=900,
+                      help="kill a worker that spends more seconds on a single video and requeue the video")
+
+  parser.add_argument("--engine", default=constants.FRAMES_ENGINE_OPENCV,
+                      choices=[constants.FRAMES_ENGINE_OPENCV, constants.FRAMES_ENGINE_FFMPEG],
+                      help="{}: decode, resize and save the frames one by one with OpenCV, {}: do all of it in a "
+                           "single ffmpeg process".format(constants.FRAMES_ENGINE_OPENCV,
+                                                          constants.FRAMES_ENGINE_FFMPEG))
+  parser.add_argument("--output-format", default=constants.FRAMES_FORMAT_JPGS,
+                      choices=[constants.FRAMES_FORMAT_JPGS, constants.FRAMES_FORMAT_PACKED,
+                               constants.FRAMES_FORMAT_TAR],
+                      help="{}: a directory with a JPEG file for each frame, {}: a single file with all frames of a "
+                           "video and their index, {}: tar shards with the frames and labels of many videos".format(
+                        constants.FRAMES_FORMAT_JPGS, constants.FRAMES_FORMAT_PACKED, constants.FRAMES_FORMAT_TAR))
+  parser.add_argument("--tar-size", default="1G", help="size of each tar shard (e.g. 1G or 500M)")
+  parser.add_argument("--autotune", default=False, action="store_true",
+                      help="search for the number of workers with the highest throughput, starting with "
+                           "--num-workers, and split the cores between them")
+  parser.add_argument("--autotune-interval", type=float, default=autotune.DEFAULT_INTERVAL,
+                      help="how long to measure each number of workers in seconds")
+  parser.add_argument("--threads-per-worker", type=int, help="number of ffmpeg and OpenCV threads of each worker")
+  parser.add_argument("--coordinator-url", help="lease the videos from a coordinator (see coordinator.py) instead of "
+                                                "planning them, e.g. http://10.0.0.1:8100")
+  parser.add_argument("--lease-size", type=int, default=coordinator.DEFAULT_LEASE_SIZE,
+                      help="number of videos leased from the coordinator at once")
+  parser.add_argument("--num-shards", type=int, default=1,
+                      help="split the videos between this many machines by a hash of their ids")
+  parser.add_argument("--shard-index", type=int, default=0, help="index of the shard processed by this machine, "
+                                                                 "from 0 to --num-shards - 1")
 
   parsed = parser.parse_args()
+
+  if not 0 <= parsed.shard_index < parsed.num_shards:
+    parser.error("--shard-index has to be between 0 and --num-shards - 1")
   main(parsed)
@@ -1,6 +1,8 @@
 import argparse, os
 
+import lib.constants as constants
 import lib.parallel_to_frames as parallel
+import lib.work_plan as work_plan
 
 def process_classes(classes, train_root, valid_root, train_frames_root, valid_frames_root, num_workers,
                     failed_save_file):
@@ -12,13 +14,14 @@ def process_classes(classes, train_root, valid_root, train_frames_root, valid_fr
   :return:                      None.
   """
 
-  for source_root, target_root in zip([train_root, valid_root],
-                                      [train_frames_root, valid_frames_root]):
+  splits = list(zip([constants.TRAIN, constants.VALID], [train_root, valid_root],
+                    [train_frames_root, valid_frames_root], [None, None]))
+  groups = work_plan.plan_groups([(None, classes)], splits)
 
-    pool = parallel.Pool(classes, source_root, target_root, num_workers, failed_save_file)
-    pool.start_workers()
-    pool.feed_videos()
-    pool.stop_workers()
+  pool = parallel.Pool(groups, num_workers, failed_save_file)
+  pool.start_workers()
+  pool.feed_videos()
+  print(work_plan.format_summary(pool.stop_workers()))
 
 def main(args):
 
@@ -1,83 +1,100 @@
-import argparse, json
+import argparse
 
+import lib.autotune as autotune
 import lib.config as config
+import lib.constants as constants
+import lib.coordinator as coordinator
 import lib.parallel_to_sound as parallel
+import lib.sharding as sharding
+import lib.work_plan as work_plan
 
-def process_category(category, num_workers, failed_save_file, no_sound_save_file):
+def plan(categories, test):
   """
-  Extract sounds for a category.
-  :param category:              Category name.
-  :param num_workers:           Number of worker processes.
-  :param failed_save_file:      Path to a log of failed extractions.
-  :param no_sound_save_file:    Path to a log of videos with no sound.
-  :return:                      None.
+  Plan the extraction of sounds for a whole run.
+  :param categories:    List of (category, classes) tuples to extract from the training and validation sets.
+  :param test:          Extract the test set.
+  :return:              List of work groups (see work_plan.WorkGroup).
   """
 
-  with open(config.CATEGORIES_PATH, "r") as file:
-    categories = json.load(file)
+  splits = list(zip([constants.TRAIN, constants.VALID], [config.TRAIN_ROOT, config.VALID_ROOT],
+                    [config.TRAIN_SOUND_ROOT, config.VALID_SOUND_ROOT], [None, None]))
+  groups = work_plan.plan_groups(categories, splits)
 
-  if category not in categories:
-    raise ValueError("Category {} not found.".format(category))
+  if test:
+    groups.append(work_plan.WorkGroup(constants.TEST, None, None, config.TEST_SOUND_ROOT,
+                                      source_directory=config.TEST_ROOT))
 
-  classes = categories[category]
-  process_classes(classes, num_workers, failed_save_file, no_sound_save_file)
+  return groups
 
-def process_classes(classes, num_workers, failed_save_file, no_sound_save_file):
+def process(groups, num_workers, failed_save_file, no_sound_save_file, state_db=None, timeout=None,
+            num_shards=1, shard_index=0,
+            client=None, lease_size=coordinator.DEFAULT_LEASE_SIZE, autotune=False,
+            autotune_interval=autotune.DEFAULT_INTERVAL, threads_per_worker=None):
   """
-  Extract sounds for a category.
-  :param classes:               List of classes.
+  Extract sounds for all planned videos with a single pool of workers.
+  :param groups:                Planned work (see plan).
   :param num_workers:           Number of worker processes.
   :param failed_save_file:      Path to a log of failed extractions.
   :param no_sound_save_file:    Path to a log of videos with no sound.
-  :return:                      None.
+  :param state_db:              Path to a job state database.
+  :param timeout:               Maximum time in seconds spent on a single video.
+  :param num_shards:            Number of machines that split the work.
+  :param shard_index:           Index of the shard processed by this machine.
+  :param client:                Coordinator client to lease the videos from instead of the planned work.
+  :param lease_size:            Number of videos leased at once.
+  :param autotune:              Search for the number of workers with the highest throughput.
+  :param autotune_interval:     How long each number of workers is measured in seconds.
+  :param threads_per_worker:    Number of ffmpeg threads of each worker.
+  :return:                      Number of videos with each status for each work group.
   """
 
-  for source_root, target_root in zip([config.TRAIN_ROOT, config.VALID_ROOT],
-                                        [config.TRAIN_SOUND_ROOT, config.VALID_SOUND_ROOT]):
+  pool = parallel.Pool(groups, num_workers, failed_save_file, no_sound_save_file, state_db=state_db,
+                       timeout=timeout, num_shards=num_shards, shard_index=shard_index,
+                       autotune=autotune, autotune_interval=autotune_interval, threads_per_worker=threads_per_worker)
+  pool.start_workers()
 
-    pool = parallel.Pool(classes, source_root, target_root, num_workers, failed_save_file, no_sound_save_file)
-    pool.start_workers()
+  if client is None:
     pool.feed_videos()
-    pool.stop_workers()
+  else:
+    coordinator.feed_pool(pool, client, lease_size=lease_size)
 
-def process_test_set(num_workers, failed_save_file, no_sound_save_file):
-  """
-  Extract sounds for the test set.
-  :param num_workers:           Number of worker processes.
-  :param failed_save_file:      Path to a log of failed extractions.
-  :param no_sound_save_file:    Path to a log of videos with no sound.
-  :return:                      None.
-  """
-
-  pool = parallel.Pool(None, config.TEST_ROOT, config.TEST_SOUND_ROOT, num_workers, failed_save_file,
-                       no_sound_save_file)
-  pool.start_workers()
-  pool.feed_videos()
-  pool.stop_workers()
+  return pool.stop_workers()
 
 def main(args):
 
+  # each shard writes its own logs, merge_shards.py combines them
+  for name in ["failed_log", "no_sound_log", "state_db"]:
+    setattr(args, name, sharding.shard_path(getattr(args, name), args.num_shards, args.shard_index))
+
   if args.all:
     # extract for all categories => all videos
-    with open(config.CATEGORIES_PATH, "r") as file:
-      categories = json.load(file)
-
-    for category in categories:
-      process_category(category, args.num_workers, args.failed_log, args.no_sound_log)
-
+    categories = work_plan.get_categories()
   else:
+    categories = []
+
     if args.categories:
       # extract for selected categories
-      for category in args.categories:
-        process_category(category, args.num_workers, args.failed_log, args.no_sound_log)
+      categories += work_plan.get_categories(args.categories)
 
     if args.classes:
       # extract for selected classes
-      process_classes(args.classes, args.num_workers, args.failed_log, args.no_sound_log)
+      categories.append((None, args.classes))
 
-    if args.test:
-      # extract for the test set
-      process_test_set(args.num_workers, args.failed_log, args.no_sound_log)
+  client = None
+  groups = []
+
+  if args.coordinator_url is not None:
+    # the coordinator planned the work
+    client = coordinator.CoordinatorClient(args.coordinator_url, coordinator.get_worker_name())
+  else:
+    groups = plan(categories, args.test)
+
+  counts = process(groups, args.num_workers, args.failed_log, args.no_sound_log, state_db=args.state_db,
+                   timeout=args.timeout, num_shards=args.num_shards, shard_index=args.shard_index,
+                   client=client, lease_size=args.lease_size, autotune=args.autotune,
+                   autotune_interval=args.autotune_interval, threads_per_worker=args.threads_per_worker)
+
+  print(work_plan.format_summary(counts))
 
 if __name__ == "__main__":
 
@@ -91,6 +108,28 @@ if __name__ == "__main__":
   parser.add_argument("--num-workers", type=int, default=1, help="number of worker threads")
   parser.add_argument("--failed-log", default="dataset/failed_sound.txt", help="where to save list of failed videos")
   parser.add_argument("--no-sound-log", default="dataset/no_sound.txt", help="where to save list of videos without sound")
+  parser.add_argument("--state-db", help="SQLite database recording the state of each video, finished videos are "
+                                         "skipped when the extraction is resumed")
+  parser.add_argument("--timeout", type=float, default=300,
+                      help="kill a worker that spends more seconds on a single video and requeue the video")
+
+  parser.add_argument("--autotune", default=False, action="store_true",
+                      help="search for the number of workers with the highest throughput, starting with "
+                           "--num-workers, and split the cores between them")
+  parser.add_argument("--autotune-interval", type=float, default=autotune.DEFAULT_INTERVAL,
+                      help="how long to measure each number of workers in seconds")
+  parser.add_argument("--threads-per-worker", type=int, help="number of ffmpeg threads of each worker")
+  parser.add_argument("--coordinator-url", help="lease the videos from a coordinator (see coordinator.py) instead of "
+                                                "planning them, e.g. http://10.0.0.1:8100")
+  parser.add_argument("--lease-size", type=int, default=coordinator.DEFAULT_LEASE_SIZE,
+                      help="number of videos leased from the coordinator at once")
+  parser.add_argument("--num-shards", type=int, default=1,
+                      help="split the videos between this many machines by a hash of their ids")
+  parser.add_argument("--shard-index", type=int, default=0, help="index of the shard processed by this machine, "
+                                                                 "from 0 to --num-shards - 1")
 
   parsed = parser.parse_args()
+
+  if not 0 <= parsed.shard_index < parsed.num_shards:
+    parser.error("--shard-index has to be between 0 and --num-shards - 1")
   main(parsed)